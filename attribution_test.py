@@ -1,79 +1,22 @@
 from neo4j import GraphDatabase
+from neo4j_writer import create_schema
+from neo4jtest import propagate_labels
 import random
 from collections import deque
 
 
 def set_initial_attribution_labels(session, source_prefix):
-    cypher = f"""
-        MATCH (source:Node)-[r:TRANSPORT]->(target:Node)
-        WHERE source.name STARTS WITH '{source_prefix}'
+    cypher = """
+        MATCH (source:IP)-[r:TRANSPORT]->(target:IP)
+        WHERE source.name STARTS WITH $source_prefix
         SET r.attribution_label = source.name
     """
-    session.run(cypher)
+    session.run(cypher, source_prefix=source_prefix)
 
 
-def get_connected_nodes(session, node_name):
-    connected_nodes = session.run("""
-        MATCH (n {name: $node_name})-[r]->(connected:Node)
-        RETURN connected.name AS name
-    """, node_name=node_name).data()
-
-    return [connected_node['name'] for connected_node in connected_nodes]
-
-
-def propagate_labels(session, node_name):
-
-    connected_nodes = get_connected_nodes(session, node_name)
-
-    if not connected_nodes:
-        return
-
-    for connected_node in connected_nodes:
-
-        matched = set_attribution_label(session, connected_node)
-
-        if matched:
-            propagate_labels(session, connected_node)
-
-
-def set_attribution_label(session, node_name):
-
-    matched = False
-
-    # get incoming edges
-    incoming_rels = session.run("""
-        MATCH (n {name: $node_name})<-[r]-()
-        RETURN r.source_port AS source_port, r.destination_port AS destination_port, r.transport AS transport, r.attribution_label AS attribution_label
-    """, node_name=node_name).data()
-
-    # get outcoming edges
-    outgoing_rels = session.run("""
-        MATCH (n {name: $node_name})-[r]->()
-        RETURN ID(r) AS id, r.source_port AS source_port, r.destination_port AS destination_port, r.transport AS transport
-    """, node_name=node_name).data()
-
-    # compare
-    for incoming_rel in incoming_rels:
-        for outgoing_rel in outgoing_rels:
-            if (
-                incoming_rel['source_port'] == outgoing_rel['source_port']
-                and incoming_rel['destination_port'] == outgoing_rel['destination_port']
-                and incoming_rel['transport'] == outgoing_rel['transport']
-            ):
-
-                matched = True
-                # update attribution label of outcoming edge
-                session.run("""
-                    MATCH ()-[r]->() WHERE ID(r) = $id
-                    SET r.attribution_label = $attribution_label
-                """, id=outgoing_rel['id'], attribution_label=incoming_rel['attribution_label'])
-
-
-    return matched
-
 def merge_edges(session):
     query = """
-    MATCH (a)-[r:TRANSPORT]->(b)
+    MATCH (a:IP)-[r:TRANSPORT]->(b:IP)
     WHERE r.attribution_label = 'unknown'
     WITH a, b, r.transport as transport, collect(r) as edges
     WHERE size(edges) > 1
@@ -130,25 +73,24 @@ rels = [
 ]
 
 with driver.session() as session:
+    create_schema(session)
+
     for node in nodes:
         session.run(
-            "CREATE (n:Node {name: $name, ip: $ip, hostname: $hostname})",
+            "CREATE (n:IP {name: $name, ip: $ip, hostname: $hostname})",
             name=node['name'], ip=node['ip'], hostname=node['hostname']
         )
 
     for rel in rels:
         session.run(
-            "MATCH (a {{name: '{source}'}}), (b {{name: '{target}'}}) "
-            "CREATE (a)-[r:TRANSPORT {{source_port: {source_port}, destination_port: {destination_port}, name: '{transport}', attribution_label: '{attribution_label}'}}]->(b)".format(
-                source=rel['source'], target=rel['target'], source_port=rel['source_port'],
-                destination_port=rel['destination_port'], transport=rel['transport'], attribution_label=rel['attribution_label']
-            )
+            "MATCH (a:IP {name: $source}), (b:IP {name: $target}) "
+            "CREATE (a)-[r:TRANSPORT {source_port: $source_port, destination_port: $destination_port, name: $transport, transport: $transport, attribution_label: $attribution_label}]->(b)",
+            **rel
         )
 
     vpn_instance = '192.168.0.3'
 
     set_initial_attribution_labels(session, 'w1-s')
-    set_attribution_label(session, vpn_instance)
     propagate_labels(session, vpn_instance)
     merge_edges(session)
 
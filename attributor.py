@@ -10,19 +10,21 @@ https://kth.diva-portal.org/smash/record.jsf?aq2=%5B%5B%5D%5D&c=29&af=%5B%5D&sea
 from __future__ import annotations
 
 import json
-import re
 import sqlite3 as sl
 from copy import copy
 from datetime import datetime
-from typing import Any, List, Optional, Union
+from typing import Any, List, Optional, Set, Union
 
 import maya
 import networkx as nx
 from elasticsearch_dsl import Integer
+from ip_classifier import students
 from querier import (
+    DEFAULT_WORLD,
     flows_over_path_query_result,
     get_player_pivot_for_flow_query_result,
     get_target_instances_query_result,
+    store_path,
 )
 from twmn.player import Player, PlayerSession
 from twmn_helpers.logging import Logging
@@ -38,7 +40,7 @@ def get_player_flows(
 
     root_instance = "10.0.0.2"
 
-    graph: nx.DiGraph = get_network_map_session(session)
+    graph: nx.DiGraph = get_network_map_session(session, player.world)
 
     if root_instance not in graph.nodes:
         return []
@@ -51,9 +53,12 @@ def get_player_flows(
 
     player_part: List[Optional[FlowPart]] = []
 
+    # Paths cannot go through the students' hosts
+    excluded = set(students(graph.nodes))
+
     for i, target_instance in enumerate(target_instances):
 
-        paths = find_all_paths(graph, root_instance, target_instance)
+        paths = find_all_paths(graph, root_instance, target_instance, excluded=excluded)
 
         l.debug(f"...checking target instance {i+1}/{nb_instances} : {target_instance}")
         l.debug(f"...number of paths : {len(paths)}")
@@ -250,7 +255,7 @@ def flows_over_path(
 
     print('start flows_over_path_query_result')
 
-    hits = flows_over_path_query_result(source, destination, session)
+    hits = flows_over_path_query_result(source, destination, session, player.world)
 
     print('flows_over_path_query_result complete')
 
@@ -429,13 +434,15 @@ def get_network_map() -> nx.DiGraph:
     return G
 
 
-def get_network_map_session(session: PlayerSession) -> nx.DiGraph:
+def get_network_map_session(
+    session: PlayerSession, world: str = DEFAULT_WORLD
+) -> nx.DiGraph:
     """Returns an ordered graph that represents all the connections between the
-    hosts of the network during a session."""
+    hosts of the network of a world during a session."""
 
     G = nx.DiGraph()
 
-    con = sl.connect("packetbeat.db")
+    con = sl.connect(store_path("packetbeat.db", world))
 
     req = (
         "SELECT DISTINCT source__ip, destination__ip FROM PACKETBEAT WHERE (event__start <= '"
@@ -470,14 +477,22 @@ def get_network_map_session(session: PlayerSession) -> nx.DiGraph:
 
 
 def find_all_paths(
-    graph: nx.DiGraph, start: Any, end: Any, path: List[Any] = None
+    graph: nx.DiGraph,
+    start: Any,
+    end: Any,
+    path: List[Any] = None,
+    excluded: Optional[Set[Any]] = None,
 ) -> List[List[Any]]:
     """Find all the paths from start to end.
     :start: The starting node
     :end: The destination node
     :path: An already discovered part of a path
+    :excluded: The nodes that paths cannot go through, the students' hosts
+    of the graph if None
     :returns: All the paths from start to end
     """
+    if excluded is None:
+        excluded = set(students(graph.nodes))
     path = path or []
     path = path + [start]
     if start == end:
@@ -486,8 +501,8 @@ def find_all_paths(
         return []
     paths = []
     for node in graph.successors(start):
-        if (node not in path) and (not bool(re.match("192\.168\.0\.[0-9]{1,3}", node))):
-            newpaths = find_all_paths(graph, node, end, path)
+        if (node not in path) and (node not in excluded):
+            newpaths = find_all_paths(graph, node, end, path, excluded)
             for newpath in newpaths:
                 paths.append(newpath)
     return paths
\ No newline at end of file
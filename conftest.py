@@ -0,0 +1,3 @@
+# These scripts are run by hand against live Neo4j and Elasticsearch
+# servers, they are not tests
+collect_ignore = ["attribution_test.py", "t_connection/test_connection.py"]
@@ -4,20 +4,31 @@
 from a graph that represents the connections between the hosts."""
 #initial
 
-import copy
-import re
+import json
+from datetime import datetime
+from functools import partial
+from queue import Empty, Queue
+from typing import Any, Dict, List, Optional, Tuple
 
 import networkx as nx
 import numpy as np
+from bokeh.document import Document
 from bokeh.io import show
 from bokeh.models import (
+    BooleanFilter,
+    Button,
+    CDSView,
     CheckboxGroup,
     Circle,
     ColorPicker,
     Column,
+    ColumnDataSource,
     CustomJS,
+    CustomJSHover,
     DateRangeSlider,
     Div,
+    GraphRenderer,
+    HoverTool,
     MultiChoice,
     MultiLine,
     NodesAndLinkedEdges,
@@ -28,136 +39,95 @@ from bokeh.models import (
 )
 #from bokeh.models.graphs import from_networkx
 from bokeh.plotting import figure, from_networkx
+from bokeh.server.server import Server
+from graph_clusters import ClusterView
+from graph_filter import (
+    SERVICE_BITS,
+    SERVICES,
+    GraphFilter,
+    index_attrs,
+    ports_to_mask,
+)
+from graph_live import LiveGraph
+from graph_playback import ONE_DAY, ONE_HOUR, build_frames
+from ip_classifier import STUDENT, classify
 from networkx.drawing.nx_agraph import graphviz_layout
 
+RANGE1_COLOR, RANGE2_COLOR, STUDENT_COLOR, OTHER_COLOR = (
+    "orange",
+    "yellow",
+    "green",
+    "blue",
+)
 
-class Displayer:
-    def __init__(self, graph: nx.MultiDiGraph) -> None:
-        self.graph = graph
-
-    def display(self) -> None:
-        """Creates an appropriate visualization of a graph containing all the
-        flows of the players in the network."""
-
-        G = self.graph
-
-        RANGE1_COLOR, RANGE2_COLOR, STUDENT_COLOR, OTHER_COLOR = (
-            "orange",
-            "yellow",
-            "green",
-            "blue",
-        )
-        RANGE1, RANGE2, STUDENT, OTHER = 1, 2, 3, 4
-
-        STUDENTS = []
-
-        for node in G.nodes:
-            if bool(re.match("192\.168\.0\.[0-9]{1,3}", node)):
-                G.nodes[node]["color"] = STUDENT_COLOR
-                G.nodes[node]["type"] = STUDENT
-                STUDENTS.append(node)
-            elif bool(re.match("10\.0\.[0-3]\.[0-9]{1,3}", node)):
-                G.nodes[node]["color"] = RANGE1_COLOR
-                G.nodes[node]["type"] = RANGE1
-            elif bool(re.match("10\.0\.[4-7]\.[0-9]{1,3}", node)):
-                G.nodes[node]["color"] = RANGE2_COLOR
-                G.nodes[node]["type"] = RANGE2
-            else:
-                G.nodes[node]["color"] = OTHER_COLOR
-                G.nodes[node]["type"] = OTHER
-
-        for n in G.nodes:
-            G.nodes[n]["size"] = 30
-
-        # Set initial opacity of nodes
-        for n in G.nodes:
-            G.nodes[n]["opacity"] = 1
-
-        for n in G.nodes:
-            G.nodes[n]["ports"] = []
-
-        # Visualization with Bokeh
-
-        color_by_this_attribute = "color"
-        size_by_this_attribute = "size"
-        opacity_by_this_attribute = "opacity"
-
-        # Set title
-        title = "World 1 vizualisation"
-
-        # Set colors for node and edge hovered
-        node_highlight_color = "white"
-        edge_highlight_color = "black"
+# Name of the service of each bit of the port masks
+SERVICE_NAMES = [SERVICES[port] for port in SERVICE_BITS]
 
-        # Establish which categories will appear when hovering over each node
-        HOVER_TOOLTIPS = [("IP", "@index"), ("Count", "@count"), ("Services", "@ports")]
+# Color of each category, indexed by the category codes
+COLORS = np.array(["", RANGE1_COLOR, RANGE2_COLOR, STUDENT_COLOR, OTHER_COLOR])
 
-        print(G)
 
-        pos = nx.nx_pydot.graphviz_layout(G)
+class Displayer:
+    def __init__(self, graph: nx.MultiDiGraph, pos: Optional[Dict] = None) -> None:
+        """Create a displayer.
+        :graph: The graph of the flows of the players
+        :pos: An optional layout of the nodes, computed with graphviz otherwise
+        """
+        self.graph = graph
+        self.pos = pos
 
+    def display(self, webgl: bool = False) -> None:
+        """Creates an appropriate visualization of a graph containing all the
+        flows of the players in the network, as a standalone HTML page where
+        the filtering runs in the browser.
+        :webgl: Whether to render the nodes with WebGL, for large graphs
+        """
 
-        # Create a plot — set dimensions, toolbar, and title
-        graph_plot = figure(
-            tooltips=HOVER_TOOLTIPS,
-            tools="pan,wheel_zoom,save,reset,box_zoom",
-            active_scroll="wheel_zoom",
-            width=1000,
-            height=800,
-            **get_ranges(pos),
-            title=title
+        graph_plot, graph_setup = self.build_plot(
+            output_backend="webgl" if webgl else "canvas",
+            HOVER_TOOLTIPS=[
+                ("IP", "@index"),
+                ("Count", "@count"),
+                ("Services", "@ports{services}"),
+            ],
         )
 
-        graph_plot.toolbar.logo = None
-        graph_plot.axis.visible = False
-        graph_plot.xgrid.grid_line_color = None
-        graph_plot.ygrid.grid_line_color = None
+        STUDENTS = self.style_nodes(graph_setup)
 
-        print('pos is')
-        print(pos)
-
-        node_ids = {node: i for i, node in enumerate(G.nodes)}
-        graph_layout_setup = {node_ids[node]: pos for node, pos in pos.items()}
-
-        graph_setup = from_networkx(G, graph_layout_setup)
-
-        fixed_layout_provider = StaticLayoutProvider(graph_layout=graph_layout_setup)
-        graph_setup.layout_provider = fixed_layout_provider
+        # Ports are sent as bitmasks, decoded when hovering
+        graph_plot.select_one(HoverTool).formatters = {
+            "@ports": CustomJSHover(
+                code="""
+            const services = %s;
+            const names = [];
+            for(var bit = 0; bit < services.length; bit++) {
+                if(((value >>> bit) & 1) && !names.includes(services[bit])) {
+                    names.push(services[bit]);
+                }
+            }
+            return names.join(", ");
+        """
+                % json.dumps(SERVICE_NAMES),
+            )
+        }
 
-        # Set node size, color and opacity
+        index_edges(graph_setup)
 
-        graph_setup.node_renderer.glyph = Circle(
-            size=size_by_this_attribute,
-            fill_color=color_by_this_attribute,
-            fill_alpha=opacity_by_this_attribute,
-        )
-        # Set node highlight colors
-        graph_setup.node_renderer.hover_glyph = Circle(
-            size=size_by_this_attribute, fill_color=node_highlight_color, line_width=2
-        )
-        graph_setup.node_renderer.selection_glyph = Circle(
-            size=size_by_this_attribute, fill_color=node_highlight_color, line_width=2
-        )
+        attrs = encode_columns(graph_setup)
 
-        # Set edge opacity and width
-        graph_setup.edge_renderer.glyph = MultiLine(
-            line_color="grey", line_alpha=0.8, line_width=1
-        )
-        # Set edge highlight colors
-        graph_setup.edge_renderer.selection_glyph = MultiLine(
-            line_color=edge_highlight_color, line_width=2
-        )
-        graph_setup.edge_renderer.hover_glyph = MultiLine(
-            line_color=edge_highlight_color, line_width=2
+        # Flows of each student over any date range, answered from the ranks
+        # of the edge positions
+        attr_offsets, attr_positions = index_attrs(
+            graph_setup.edge_renderer.data_source.data["attr"], len(attrs)
         )
 
-        # Highlight nodes and edges when they are hovered
-        graph_setup.selection_policy = NodesAndLinkedEdges()
-        graph_setup.inspection_policy = NodesAndLinkedEdges()
+        widgets = self.build_widgets(STUDENTS, graph_setup)
 
-        graph_plot.renderers.append(graph_setup)
+        multi_choice = widgets["multi_choice"]
+        checkbox_group = widgets["checkbox_group"]
+        count_slider = widgets["count_slider"]
+        para = widgets["para"]
 
-        multi_choice = MultiChoice(value=[], options=STUDENTS, disabled=True)
         multi_choice.js_on_change(
             "value",
             CustomJS(
@@ -167,10 +137,6 @@ class Displayer:
             ),
         )
 
-        LABELS = ["Show older activities", "Filter data from student IPs"]
-
-        checkbox_group = CheckboxGroup(labels=LABELS, active=[0])
-
         callback = CustomJS(
             args=dict(multi_choice=multi_choice),
             code="""
@@ -186,11 +152,6 @@ class Displayer:
 
         checkbox_group.js_on_event("change", callback)
 
-        count_max = max(graph_setup.node_renderer.data_source.data["count"])
-
-        count_slider = Slider(
-            start=1, end=count_max, value=1, step=1, title="Min packets number involved"
-        )
         count_slider.js_on_change(
             "value",
             CustomJS(
@@ -200,215 +161,757 @@ class Displayer:
             ),
         )
 
-        para = Div(text="""""", width=250, height=80)
+        student_idx = np.array(
+            [
+                i
+                for i, t in enumerate(graph_setup.node_renderer.data_source.data["type"])
+                if t == STUDENT
+            ],
+            dtype=np.int32,
+        )
+
+        node_source = graph_setup.node_renderer.data_source
+        edge_source = graph_setup.edge_renderer.data_source
+
+        nb_nodes = len(node_source.data["index"])
+        nb_edges = len(edge_source.data["start"])
+
+        # Scratch column of the callback, which rewrites the derived columns
+        # in place instead of rebuilding the tables
+        node_source.data["max_date"] = np.zeros(nb_nodes, dtype=np.float64)
 
-        backup_node_data = copy.deepcopy(graph_setup.node_renderer.data_source.data)
-        backup_edge_data = copy.deepcopy(graph_setup.edge_renderer.data_source.data)
-
-        code = """ 
-            var new_start = edata['start'].slice();
-            var new_end = edata['end'].slice();
-            var new_start_node = new_start[0];
-            var new_end_node = new_end[0];
-            var new_index = ndata['index'].slice();
-            var new_count = edata['count'].slice();
-            var new_color = ndata['color'].slice();
-            var new_opacity = ndata['opacity'].slice();
-            var new_type = ndata['type'].slice();
-            var new_size = ndata['size'].slice();
-            var new_ports = edata['ports'].slice();
-            var new_date = edata['date'].slice();
-            var new_attr = edata['attr'].slice();
+        # Shown nodes and edges are selected by views over the shared sources
+        node_filter = BooleanFilter(booleans=[True] * nb_nodes)
+        edge_filter = BooleanFilter(booleans=[True] * nb_edges)
+
+        graph_setup.node_renderer.view = CDSView(source=node_source, filters=[node_filter])
+        graph_setup.edge_renderer.view = CDSView(source=edge_source, filters=[edge_filter])
+
+        code = """
+            const node_source = graph_setup.node_renderer.data_source;
+            const edge_source = graph_setup.edge_renderer.data_source;
+            const ndata = node_source.data;
+            const edata = edge_source.data;
+            const index = ndata['index'];
+            const node_count = ndata['count'];
+            const node_size = ndata['size'];
+            const node_opacity = ndata['opacity'];
+            const node_max_date = ndata['max_date'];
+            const node_ports = ndata['ports'];
+            const node_mask = node_filter.booleans;
+            const edge_mask = edge_filter.booleans;
+            const start_idx = edata['start_idx'];
+            const end_idx = edata['end_idx'];
+            const count = edata['count'];
+            const ports = edata['ports'];
+            const date = edata['date'];
+            const attr = edata['attr'];
+            const nb_nodes = index.length;
             var date_from = cb_obj.value[0];
             var date_to = cb_obj.value[1];
             var one_day = 86400000;
             const display_old_data = checkbox_group.active.includes(0);
             if(!display_old_data) {
-                date_from = date_to-(4*86400000);       
+                date_from = date_to-(4*86400000);
             }
-            const students = multi_choice.value;
+            const students = new Set(multi_choice.value);
             const disabled = multi_choice.disabled;
-            var students_list = [];
-            for(const [index, t] of new_type.entries()) {
-                if(t==3) {
-                    students_list.push(new_index[index]);
-                }
+            const min_count = count_slider.value;
+            // Attribution labels are sent as codes into attrs
+            const selected = new Uint8Array(attrs.length);
+            const attr_ids = new Map();
+            for(var a = 0; a < attrs.length; a++) {
+                attr_ids.set(attrs[a], a);
+                selected[a] = students.has(attrs[a]) ? 1 : 0;
             }
-            var students_list_map = [];
-            if(disabled) {
-                students_list_map = students_list
+            // Edges are sorted by date, find the window by binary search
+            function bisect(x, strict) {
+                var lo = 0;
+                var hi = date.length;
+                while(lo < hi) {
+                    const mid = (lo + hi) >>> 1;
+                    if((date[mid] < x) || (strict && (date[mid] == x))) {
+                        lo = mid + 1;
+                    }
+                    else {
+                        hi = mid;
+                    }
+                }
+                return lo;
             }
-            else {
-                students_list_map = students
+            const first = bisect(date_from, false);
+            const last = Math.max(bisect(date_to, true), first);
+            // The node mask first marks the nodes seen in the window
+            node_mask.fill(false);
+            edge_mask.fill(false);
+            node_count.fill(0);
+            node_ports.fill(0);
+            function add_to_node(n, c, x) {
+                if(node_mask[n]) {
+                    node_count[n] += c;
+                    if(x > node_max_date[n]) {
+                        node_max_date[n] = x;
+                    }
+                }
+                else {
+                    node_mask[n] = true;
+                    node_count[n] = c;
+                    node_max_date[n] = x;
+                }
             }
-            var map1 = new Map();
-            for (const s of students_list_map) {
-                map1.set(s, 0);
+            for(var k = first; k < last; k++) {
+                const a = attr[k];
+                if((disabled==false) && !((a >= 0) && selected[a])) {
+                    continue;
+                }
+                const x = date[k];
+                const e = end_idx[k];
+                add_to_node(start_idx[k], count[k], x);
+                add_to_node(e, count[k], x);
+                node_ports[e] |= ports[k];
+                edge_mask[k] = true;
             }
-            console.log("Map1");
-            console.log(map1);
-            var map2 = new Map([[20, 'FTP'], [21, 'FTP'], [22, 'SSH'], [23, 'Telnet'], [25, 'SMTP'], [53, 'DNS'], [67, 'DHCP'], [68, 'DHCP'], [69, 'TFTP'], [80, 'HTTP'], [110, 'POP3'], [119, 'NNTP'], [123, 'NTP'], [143, 'IMAP4'], [389, 'LDAP'], [443, 'HTTPS'], [993, 'IMAPS'], [1812, 'RADIUS'], [5190, 'AIM']]);
-            console.log("Map2");
-            console.log(map2);
-            const min_count = count_slider.value;
-            var new_data_nodes = {};    
-            var new_data_index = [];
-            var new_data_count = [];
-            var new_data_color = [];
-            var new_data_max_date = [];
-            var new_data_opacity = [];
-            var new_data_type = [];
-            var new_data_size = [];
-            var new_data_ports = [];
-            var new_data_start = [];
-            var new_data_end = [];
-            var new_data_date = [];
-            var new_data_attr = [];
-            for (const [index, x] of new_date.entries()) {
-                if ((x >= date_from) && (x <= date_to)) {
-                    new_start_node = new_start[index]
-                    new_end_node = new_end[index]
-                    if( (disabled==true) || ((disabled==false) && (students.includes(new_attr[index])))) {
-                        if (new_data_index.indexOf(new_start_node) == -1) {
-                            new_data_index.push(new_start_node);
-                            new_data_count.push(new_count[index]);
-                            new_data_color.push(new_color[new_index.indexOf(new_start_node)]);
-                            new_data_type.push(new_type[new_index.indexOf(new_start_node)]);
-                            new_data_max_date.push(x);
-                            new_data_ports.push([])
-                        }
-                        else {
-                            new_data_count[new_data_index.indexOf(new_start_node)] = new_data_count[new_data_index.indexOf(new_start_node)] + new_count[index];
-                            if(x>new_data_max_date[new_data_index.indexOf(new_start_node)]) {
-                                new_data_max_date[new_data_index.indexOf(new_start_node)] = x;
-                            }
-                        }
-                        if (new_data_index.indexOf(new_end_node) == -1) {
-                            new_data_index.push(new_end_node)
-                            new_data_count.push(new_count[index]);
-                            new_data_color.push(new_color[new_index.indexOf(new_end_node)]);
-                            new_data_type.push(new_type[new_index.indexOf(new_end_node)]);
-                            new_data_max_date.push(x);
-                            var ports_tmp = []
-                            for (const p of new_ports[index]) {
-                                ports_tmp.push(map2.get(p))
-                            }
-                            new_data_ports.push(ports_tmp)
-                        }
-                        else {
-                            new_data_count[new_data_index.indexOf(new_end_node)] = new_data_count[new_data_index.indexOf(new_end_node)] + new_count[index];
-                            if(x>new_data_max_date[new_data_index.indexOf(new_end_node)]) {
-                                new_data_max_date[new_data_index.indexOf(new_end_node)] = x;
-                            }
-                            for (const p of new_ports[index]) {
-                                if(new_data_ports[new_data_index.indexOf(new_end_node)].indexOf(map2.get(p)) == -1) {
-                                    new_data_ports[new_data_index.indexOf(new_end_node)].push(map2.get(p))
-                                }
-                            }
-                        }
-                        new_data_start.push(new_start_node)
-                        new_data_end.push(new_end_node)
-                        new_data_date.push(x)
-                        new_data_attr.push(new_attr[index])
-                        if(map1.has(new_attr[index])) {
-                            map1.set(new_attr[index], map1.get(new_attr[index])+1)
-                        }
-                    }
+            for(const s of student_idx) {
+                if(!node_mask[s] && ((disabled==true) || students.has(index[s]))) {
+                    node_mask[s] = true;
+                    node_count[s] = 0;
+                    node_max_date[s] = date_from-3*one_day;
                 }
             }
-            for (const s of students_list) {
-                if (new_data_index.indexOf(s) == -1) {
-                    if((disabled==true) || ((disabled==false) && (students.includes(s))) ) {
-                        new_data_index.push(s)
-                        new_data_count.push(0);
-                        new_data_color.push(new_color[new_index.indexOf(s)]);
-                        new_data_type.push(new_type[new_index.indexOf(s)]);
-                        new_data_max_date.push(date_from-3*one_day);
-                    }
+            var sum_count = 0;
+            for(var n = 0; n < nb_nodes; n++) {
+                if(node_mask[n]) {
+                    sum_count += node_count[n];
                 }
             }
-            for (const date of new_data_max_date) {
+            // Then only keeps the nodes involved in enough packets
+            for(var n = 0; n < nb_nodes; n++) {
+                if(!node_mask[n]) {
+                    continue;
+                }
+                if(node_count[n] < min_count) {
+                    node_mask[n] = false;
+                    continue;
+                }
+                if(sum_count>0) {
+                    node_size[n] = 20*(1+((node_count[n]/sum_count)*4));
+                }
+                else {
+                    node_size[n] = 20;
+                }
+                const max_date = node_max_date[n];
                 switch(true) {
-                    case date <= date_to-3*one_day:
-                      new_data_opacity.push(0.25);
+                    case max_date <= date_to-3*one_day:
+                      node_opacity[n] = 0.25;
                       break;
-                    case ((date > date_to-3*one_day) && (date <= date_to-2*one_day)):
-                      new_data_opacity.push(0.5);
+                    case ((max_date > date_to-3*one_day) && (max_date <= date_to-2*one_day)):
+                      node_opacity[n] = 0.5;
                       break;
-                    case ((date > date_to-2*one_day) && (date <= date_to-one_day)):
-                      new_data_opacity.push(0.75);
+                    case ((max_date > date_to-2*one_day) && (max_date <= date_to-one_day)):
+                      node_opacity[n] = 0.75;
                       break;
                     default:
-                      new_data_opacity.push(1);
-                } 
+                      node_opacity[n] = 1;
+                }
             }
-            var sum_count = new_data_count.reduce((pv, cv) => pv + cv, 0);
-            for (const count of new_data_count) {
-                if(sum_count>0) {
-                    var size = 20*(1+((count/sum_count)*4));
-                    new_data_size.push(size);
+            for(var k = first; k < last; k++) {
+                if(edge_mask[k] && !(node_mask[start_idx[k]] && node_mask[end_idx[k]])) {
+                    edge_mask[k] = false;
                 }
-                else {
-                    var size = 20;
-                    new_data_size.push(size);
+            }
+            // The positions of the edges of each label are sorted, their rank
+            // is the prefix count of the flows of the label
+            function rank(lo, hi, x) {
+                while(lo < hi) {
+                    const mid = (lo + hi) >>> 1;
+                    if(attr_positions[mid] < x) {
+                        lo = mid + 1;
+                    }
+                    else {
+                        hi = mid;
+                    }
                 }
+                return lo;
             }
             var str = "Packets involved per student :"
-            for (const [key, value] of map1) {
-                str += "</br>" + key + " : " + value + " packets"
+            for(const s of student_idx) {
+                if((disabled==true) || students.has(index[s])) {
+                    const a = attr_ids.get(index[s]);
+                    var value = 0;
+                    if(a !== undefined) {
+                        const lo = attr_offsets[a];
+                        const hi = attr_offsets[a + 1];
+                        value = rank(lo, hi, last) - rank(lo, hi, first);
+                    }
+                    str += "</br>" + index[s] + " : " + value + " packets"
+                }
             }
             para.text = str
-            var node_to_remove = []
-            var index = 0;
-            while(index <  new_data_count.length) {
-                if(new_data_count[index] < min_count) {
-                    node_to_remove.push(new_data_index[index])
-                    new_data_index.splice(index, 1);
-                    new_data_count.splice(index, 1);
-                    new_data_size.splice(index, 1);
-                    new_data_color.splice(index, 1);
-                    new_data_type.splice(index, 1);
-                    new_data_opacity.splice(index, 1);
-                    new_data_ports.splice(index, 1);
-                    index-=1
-                } 
-                index+=1
-            }
-            var index = 0;
-            while(index < new_data_date.length) {
-                if((node_to_remove.indexOf(new_data_start[index]) != -1) || (node_to_remove.indexOf(new_data_end[index]) != -1)) {
-                    new_data_attr.splice(index, 1);
-                    new_data_date.splice(index, 1);
-                    new_data_start.splice(index, 1);
-                    new_data_end.splice(index, 1);
-                    index-=1
-                }       
-                index+=1      
-            }
-            new_data_nodes['index'] = new_data_index;
-            new_data_nodes['count'] = new_data_count;
-            new_data_nodes['size'] = new_data_size;
-            new_data_nodes['color'] = new_data_color;
-            new_data_nodes['type'] = new_data_type;
-            new_data_nodes['opacity'] = new_data_opacity;    
-            new_data_nodes['ports'] = new_data_ports;    
-            var new_data_edge = {'attr': new_data_attr, 'date': new_data_date, 'start': new_data_start, 'end': new_data_end};
-            graph_setup.edge_renderer.data_source.data = new_data_edge; 
-            graph_setup.node_renderer.data_source.data = new_data_nodes;    
+            node_source.change.emit();
+            edge_source.change.emit();
         """
         callback = CustomJS(
             args=dict(
                 graph_setup=graph_setup,
-                ndata=backup_node_data,
-                edata=backup_edge_data,
+                node_filter=node_filter,
+                edge_filter=edge_filter,
                 multi_choice=multi_choice,
                 checkbox_group=checkbox_group,
                 count_slider=count_slider,
                 para=para,
+                student_idx=student_idx,
+                attrs=attrs,
+                attr_offsets=attr_offsets,
+                attr_positions=attr_positions,
             ),
             code=code,
         )
 
+        widgets["date_range_slider"].js_on_change("value", callback)
+
+        show(self.build_layout(graph_plot, widgets))
+
+    def playback(
+        self, step: int = ONE_HOUR, width: int = 4 * ONE_DAY, webgl: bool = False
+    ) -> None:
+        """Creates a standalone HTML page replaying the flows of the players,
+        with a window of fixed width sliding over time. The frames are
+        precomputed, each one only changing what entered or left the window.
+        :step: The time between two frames, in ms
+        :width: The width of the shown window, in ms
+        :webgl: Whether to render the nodes with WebGL, for large graphs
+        """
+
+        graph_plot, graph_setup = self.build_plot(
+            output_backend="webgl" if webgl else "canvas",
+            HOVER_TOOLTIPS=[("IP", "@index"), ("Count", "@count")],
+        )
+
+        self.style_nodes(graph_setup)
+
+        index_edges(graph_setup)
+        encode_columns(graph_setup)
+
+        node_source = graph_setup.node_renderer.data_source
+        edge_source = graph_setup.edge_renderer.data_source
+
+        frame_data, delta_data = build_frames(
+            node_source.data, edge_source.data, step, width
+        )
+
+        # Start from the first frame, the page then applies the next ones
+        node_mask = np.zeros(len(node_source.data["index"]), dtype=bool)
+        edge_mask = np.zeros(len(edge_source.data["start"]), dtype=bool)
+
+        edge_mask[frame_data["enter_lo"][0] : frame_data["enter_hi"][0]] = True
+
+        first = slice(frame_data["node_lo"][0], frame_data["node_hi"][0])
+        nodes = delta_data["node"][first]
+        for key in ("count", "size", "opacity"):
+            node_source.data[key][nodes] = delta_data[key][first]
+        node_mask[nodes] = delta_data["shown"][first] == 1
+
+        node_filter = BooleanFilter(booleans=node_mask.tolist())
+        edge_filter = BooleanFilter(booleans=edge_mask.tolist())
+
+        graph_setup.node_renderer.view = CDSView(source=node_source, filters=[node_filter])
+        graph_setup.edge_renderer.view = CDSView(source=edge_source, filters=[edge_filter])
+
+        play_button = Button(label="Play", width=100)
+        speed_slider = Slider(start=1, end=30, value=5, step=1, title="Frames per second")
+        date_div = Div(
+            text=datetime.utcfromtimestamp(frame_data["time"][0] / 1000).strftime(
+                "%Y-%m-%d %H:%M"
+            ),
+            width=250,
+        )
+
+        code = """
+            const node_source = graph_setup.node_renderer.data_source;
+            const edge_source = graph_setup.edge_renderer.data_source;
+            const ndata = node_source.data;
+            const node_count = ndata['count'];
+            const node_size = ndata['size'];
+            const node_opacity = ndata['opacity'];
+            const node_mask = node_filter.booleans;
+            const edge_mask = edge_filter.booleans;
+            const fdata = frame_source.data;
+            const ddata = delta_source.data;
+            const nb_frames = fdata['time'].length;
+            if(cb_obj._playing) {
+                cb_obj._playing = false;
+                cb_obj.label = "Play";
+                return;
+            }
+            cb_obj._playing = true;
+            cb_obj.label = "Pause";
+            if(cb_obj._frame === undefined) {
+                cb_obj._frame = 1 % nb_frames;
+            }
+            function apply(f) {
+                if(f == 0) {
+                    node_mask.fill(false);
+                    edge_mask.fill(false);
+                }
+                // Edges may enter and leave the window between two frames
+                for(var k = fdata['enter_lo'][f]; k < fdata['enter_hi'][f]; k++) {
+                    edge_mask[k] = true;
+                }
+                for(var k = fdata['leave_lo'][f]; k < fdata['leave_hi'][f]; k++) {
+                    edge_mask[k] = false;
+                }
+                for(var j = fdata['node_lo'][f]; j < fdata['node_hi'][f]; j++) {
+                    const n = ddata['node'][j];
+                    node_count[n] = ddata['count'][j];
+                    node_size[n] = ddata['size'][j];
+                    node_opacity[n] = ddata['opacity'][j];
+                    node_mask[n] = (ddata['shown'][j] == 1);
+                }
+                date_div.text = new Date(fdata['time'][f]).toISOString().slice(0, 16).replace('T', ' ');
+                node_source.change.emit();
+                edge_source.change.emit();
+            }
+            const button = cb_obj;
+            function tick() {
+                if(!button._playing) {
+                    return;
+                }
+                apply(button._frame);
+                button._frame = (button._frame + 1) % nb_frames;
+                setTimeout(tick, 1000 / speed_slider.value);
+            }
+            tick();
+        """
+
+        play_button.js_on_click(
+            CustomJS(
+                args=dict(
+                    graph_setup=graph_setup,
+                    node_filter=node_filter,
+                    edge_filter=edge_filter,
+                    frame_source=ColumnDataSource(frame_data),
+                    delta_source=ColumnDataSource(delta_data),
+                    speed_slider=speed_slider,
+                    date_div=date_div,
+                ),
+                code=code,
+            )
+        )
+
+        show(Column(graph_plot, Row(play_button, speed_slider, date_div)))
+
+    def serve(self, port: int = 5006, lod: Optional[str] = None) -> None:
+        """Serves the visualization with a Bokeh server. The widget callbacks
+        run in Python against pre-indexed arrays and only the visible subgraph
+        is pushed to the browser.
+        :port: The port of the Bokeh server
+        :lod: "subnet" or "/24" to start from hosts collapsed into clusters,
+        expanded on click, instead of drawing every host
+        """
+        if lod:
+            app = partial(self.make_lod_document, mode=lod)
+        else:
+            app = self.make_document
+
+        server = Server({"/": app}, port=port)
+        server.start()
+
+        print(f"Serving the visualization on http://localhost:{port}/")
+
+        server.io_loop.add_callback(server.show, "/")
+        server.io_loop.start()
+
+    def live(
+        self,
+        feed: Queue,
+        port: int = 5006,
+        max_edges: int = 10000,
+        period: int = 500,
+    ) -> None:
+        """Serves a visualization updated with the edges attributed while it
+        is shown. Only one session should be opened, as the sessions would
+        share the feed.
+        :feed: The queue of the newly attributed edges, one list per flow
+        :port: The port of the Bokeh server
+        :max_edges: The number of most recent edges shown
+        :period: The time between two reads of the feed, in ms
+        """
+        app = partial(
+            self.make_live_document, feed=feed, max_edges=max_edges, period=period
+        )
+
+        server = Server({"/": app}, port=port)
+        server.start()
+
+        print(f"Serving the live visualization on http://localhost:{port}/")
+
+        server.io_loop.add_callback(server.show, "/")
+        server.io_loop.start()
+
+    def make_live_document(
+        self,
+        doc: Document,
+        feed: Queue,
+        max_edges: int = 10000,
+        period: int = 500,
+        batch_size: int = 5000,
+    ) -> None:
+        """Builds the live visualization of a Bokeh server session. New edges
+        are streamed into the data sources, the oldest ones being rolled over,
+        and the counts of the nodes they touch are patched.
+        :doc: The document of the session
+        :feed: The queue of the newly attributed edges, one list per flow
+        :max_edges: The number of most recent edges shown
+        :period: The time between two reads of the feed, in ms
+        :batch_size: The maximum number of edges applied per read
+        """
+
+        live_graph = LiveGraph(COLORS, self.pos, max_edges)
+
+        node_source = ColumnDataSource(
+            {
+                key: []
+                for key in ("index", "x", "y", "color", "type", "count", "size", "opacity")
+            }
+        )
+        edge_source = ColumnDataSource(
+            {key: [] for key in ("x0", "y0", "x1", "y1", "date", "attr", "count")}
+        )
+
+        graph_plot = figure(
+            tools="pan,wheel_zoom,save,reset,box_zoom",
+            active_scroll="wheel_zoom",
+            width=1000,
+            height=800,
+            title="World 1 vizualisation",
+        )
+
+        graph_plot.toolbar.logo = None
+        graph_plot.axis.visible = False
+        graph_plot.xgrid.grid_line_color = None
+        graph_plot.ygrid.grid_line_color = None
+
+        graph_plot.segment(
+            "x0", "y0", "x1", "y1", source=edge_source, line_color="grey", line_alpha=0.8
+        )
+        node_renderer = graph_plot.scatter(
+            "x",
+            "y",
+            source=node_source,
+            size="size",
+            fill_color="color",
+            fill_alpha="opacity",
+            line_color="black",
+        )
+
+        graph_plot.add_tools(
+            HoverTool(
+                renderers=[node_renderer],
+                tooltips=[("IP", "@index"), ("Count", "@count")],
+            )
+        )
+
+        date_div = Div(text="", width=250)
+
+        def apply(edges: List[Dict[str, Any]]) -> None:
+            node_data, edge_data, patches = live_graph.update(edges)
+
+            if node_data["index"]:
+                node_source.stream(node_data)
+            if patches["count"]:
+                node_source.patch(patches)
+
+            edge_source.stream(edge_data, rollover=max_edges)
+
+            date_div.text = "Last flow : " + datetime.utcfromtimestamp(
+                max(edge_data["date"]) / 1000
+            ).strftime("%Y-%m-%d %H:%M:%S")
+
+        def poll() -> None:
+            edges: List[Dict[str, Any]] = []
+            while len(edges) < batch_size:
+                try:
+                    edges.extend(feed.get_nowait())
+                except Empty:
+                    break
+            if edges:
+                apply(edges)
+
+        # Start from the graph of the displayer, if any
+        if self.graph.number_of_edges():
+            apply(
+                [
+                    dict(data, source=u, destination=v)
+                    for u, v, data in self.graph.edges(data=True)
+                ]
+            )
+
+        doc.add_periodic_callback(poll, period)
+
+        doc.add_root(Column(graph_plot, date_div))
+        doc.title = "World 1 vizualisation"
+
+    def make_document(self, doc: Document) -> None:
+        """Builds the visualization of a Bokeh server session.
+        :doc: The document of the session
+        """
+
+        graph_plot, graph_setup = self.build_plot()
+
+        STUDENTS = self.style_nodes(graph_setup)
+
+        index_edges(graph_setup)
+
+        # Index the whole graph before the data sources only hold what is shown
+        graph_filter = GraphFilter(
+            graph_setup.node_renderer.data_source.data,
+            graph_setup.edge_renderer.data_source.data,
+        )
+
+        pos = self.layout()
+
+        widgets = self.build_widgets(STUDENTS, graph_setup)
+
+        multi_choice = widgets["multi_choice"]
+        checkbox_group = widgets["checkbox_group"]
+        count_slider = widgets["count_slider"]
+        date_range_slider = widgets["date_range_slider"]
+        para = widgets["para"]
+
+        def update(attr: str, old: Any, new: Any) -> None:
+            date_from, date_to = date_range_slider.value
+
+            node_data, edge_data, packets = graph_filter.filter(
+                date_from,
+                date_to,
+                show_old=0 in checkbox_group.active,
+                students=None if multi_choice.disabled else multi_choice.value,
+                min_count=count_slider.value,
+            )
+
+            graph_setup.layout_provider.graph_layout = {
+                node: pos[node] for node in node_data["index"]
+            }
+            graph_setup.edge_renderer.data_source.data = edge_data
+            graph_setup.node_renderer.data_source.data = node_data
+
+            para.text = packets_text(packets)
+
+        def toggle_students(attr: str, old: List[int], new: List[int]) -> None:
+            multi_choice.disabled = 1 not in new
+            if multi_choice.disabled:
+                multi_choice.value = []
+            update(attr, old, new)
+
+        checkbox_group.on_change("active", toggle_students)
+        multi_choice.on_change("value", update)
+        count_slider.on_change("value", update)
+        date_range_slider.on_change("value", update)
+
+        update("value", None, None)
+
+        doc.add_root(self.build_layout(graph_plot, widgets))
+        doc.title = "World 1 vizualisation"
+
+    def make_lod_document(self, doc: Document, mode: str = "subnet") -> None:
+        """Builds a level-of-detail visualization of a Bokeh server session.
+        Hosts are first drawn as one super-node per cluster, with aggregated
+        edge counts. Clicking a cluster expands it into its hosts, clicking a
+        host collapses its cluster back.
+        :doc: The document of the session
+        :mode: How hosts are grouped, see graph_clusters.cluster_label
+        """
+
+        view = ClusterView(self.graph, COLORS, mode)
+
+        node_data, edge_data, layout = view.visible()
+
+        graph_setup = GraphRenderer()
+        graph_setup.node_renderer.data_source.data = node_data
+        graph_setup.edge_renderer.data_source.data = edge_data
+        graph_setup.layout_provider = StaticLayoutProvider(graph_layout=layout)
+
+        graph_plot, graph_setup = self.build_plot(
+            graph_setup,
+            layout,
+            tools="pan,wheel_zoom,save,reset,box_zoom,tap",
+            HOVER_TOOLTIPS=[("Node", "@index"), ("Hosts", "@hosts"), ("Count", "@count")],
+        )
+
+        date_range_slider = DateRangeSlider(
+            title="Date",
+            start=view.date.min(),
+            end=view.date.max(),
+            value=(view.date.min(), view.date.max()),
+            step=1,
+            width=1000,
+        )
+
+        def update(attr: str, old: Any, new: Any) -> None:
+            node_data, edge_data, layout = view.visible(*date_range_slider.value)
+
+            graph_setup.layout_provider.graph_layout = layout
+            graph_setup.edge_renderer.data_source.data = edge_data
+            graph_setup.node_renderer.data_source.data = node_data
+
+        def on_tap(attr: str, old: List[int], new: List[int]) -> None:
+            if not new:
+                return
+            label = graph_setup.node_renderer.data_source.data["index"][new[0]]
+            graph_setup.node_renderer.data_source.selected.indices = []
+            view.toggle(label)
+            update(attr, old, new)
+
+        graph_setup.node_renderer.data_source.selected.on_change("indices", on_tap)
+        date_range_slider.on_change("value", update)
+
+        doc.add_root(Column(graph_plot, date_range_slider))
+        doc.title = "World 1 vizualisation"
+
+    def style_nodes(self, graph_setup: GraphRenderer) -> List[str]:
+        """Sets the color, type, size, opacity and ports columns of the nodes of
+        a graph renderer, classifying all of them at once.
+        :returns: The list of the students' IPs
+        """
+
+        node_data = graph_setup.node_renderer.data_source.data
+
+        nodes = list(node_data["index"])
+        types = classify(nodes)
+
+        node_data["color"] = COLORS[types]
+        node_data["type"] = types
+        node_data["size"] = np.full(len(nodes), 30.0)
+        node_data["opacity"] = np.ones(len(nodes))
+        node_data["ports"] = np.zeros(len(nodes), dtype=np.uint32)
+
+        STUDENTS = [nodes[i] for i in np.flatnonzero(types == STUDENT)]
+
+        return STUDENTS
+
+    def layout(self) -> Dict:
+        """Returns the layout of the nodes, computed once with graphviz if none
+        was given."""
+
+        if not self.pos:
+            print(self.graph)
+
+            self.pos = nx.nx_pydot.graphviz_layout(self.graph)
+
+        return self.pos
+
+    def build_plot(
+        self,
+        graph_setup: Optional[GraphRenderer] = None,
+        pos: Optional[Dict] = None,
+        tools: str = "pan,wheel_zoom,save,reset,box_zoom",
+        HOVER_TOOLTIPS: Optional[List[Tuple[str, str]]] = None,
+        output_backend: str = "canvas",
+    ) -> Tuple[figure, GraphRenderer]:
+        """Creates the plot and the graph renderer holding the whole graph.
+        :graph_setup: A graph renderer to style instead of the whole graph
+        :pos: The layout of the nodes of graph_setup
+        :tools: The tools of the plot
+        :HOVER_TOOLTIPS: The tooltips of the nodes
+        :output_backend: "canvas", or "webgl" for large graphs
+        """
+
+        G = self.graph
+
+        # Visualization with Bokeh
+
+        color_by_this_attribute = "color"
+        size_by_this_attribute = "size"
+        opacity_by_this_attribute = "opacity"
+
+        # Set title
+        title = "World 1 vizualisation"
+
+        # Set colors for node and edge hovered
+        node_highlight_color = "white"
+        edge_highlight_color = "black"
+
+        # Establish which categories will appear when hovering over each node
+        if HOVER_TOOLTIPS is None:
+            HOVER_TOOLTIPS = [("IP", "@index"), ("Count", "@count"), ("Services", "@ports")]
+
+        pos = pos or self.layout()
+
+        # Create a plot — set dimensions, toolbar, and title
+        graph_plot = figure(
+            tooltips=HOVER_TOOLTIPS,
+            tools=tools,
+            active_scroll="wheel_zoom",
+            width=1000,
+            height=800,
+            **get_ranges(pos),
+            title=title,
+            output_backend=output_backend,
+        )
+
+        graph_plot.toolbar.logo = None
+        graph_plot.axis.visible = False
+        graph_plot.xgrid.grid_line_color = None
+        graph_plot.ygrid.grid_line_color = None
+
+        if graph_setup is None:
+            # The layout is keyed by node name, like the index column of the nodes
+            graph_setup = from_networkx(G, pos)
+
+        # Set node size, color and opacity
+
+        graph_setup.node_renderer.glyph = Circle(
+            size=size_by_this_attribute,
+            fill_color=color_by_this_attribute,
+            fill_alpha=opacity_by_this_attribute,
+        )
+        # Set node highlight colors
+        graph_setup.node_renderer.hover_glyph = Circle(
+            size=size_by_this_attribute, fill_color=node_highlight_color, line_width=2
+        )
+        graph_setup.node_renderer.selection_glyph = Circle(
+            size=size_by_this_attribute, fill_color=node_highlight_color, line_width=2
+        )
+
+        # Set edge opacity and width
+        graph_setup.edge_renderer.glyph = MultiLine(
+            line_color="grey", line_alpha=0.8, line_width=1
+        )
+        # Set edge highlight colors
+        graph_setup.edge_renderer.selection_glyph = MultiLine(
+            line_color=edge_highlight_color, line_width=2
+        )
+        graph_setup.edge_renderer.hover_glyph = MultiLine(
+            line_color=edge_highlight_color, line_width=2
+        )
+
+        # Highlight nodes and edges when they are hovered
+        graph_setup.selection_policy = NodesAndLinkedEdges()
+        graph_setup.inspection_policy = NodesAndLinkedEdges()
+
+        graph_plot.renderers.append(graph_setup)
+
+        return graph_plot, graph_setup
+
+    def build_widgets(
+        self, STUDENTS: List[str], graph_setup: GraphRenderer
+    ) -> Dict[str, Any]:
+        """Creates the widgets filtering the graph, without their callbacks."""
+
+        multi_choice = MultiChoice(value=[], options=STUDENTS, disabled=True)
+
+        LABELS = ["Show older activities", "Filter data from student IPs"]
+
+        checkbox_group = CheckboxGroup(labels=LABELS, active=[0])
+
+        count_max = max(graph_setup.node_renderer.data_source.data["count"])
+
+        count_slider = Slider(
+            start=1, end=count_max, value=1, step=1, title="Min packets number involved"
+        )
+
+        para = Div(text="""""", width=250, height=80)
+
         date_min = min(graph_setup.edge_renderer.data_source.data["date"])
         date_max = max(graph_setup.edge_renderer.data_source.data["date"])
 
@@ -420,7 +923,17 @@ class Displayer:
             step=1,
             width=1000,
         )
-        date_range_slider.js_on_change("value", callback)
+
+        return {
+            "multi_choice": multi_choice,
+            "checkbox_group": checkbox_group,
+            "count_slider": count_slider,
+            "para": para,
+            "date_range_slider": date_range_slider,
+        }
+
+    def build_layout(self, graph_plot: figure, widgets: Dict[str, Any]) -> Row:
+        """Places the plot, the widgets and the legend."""
 
         picker_range1 = ColorPicker(
             title="10.0.0.0/22", color=RANGE1_COLOR, disabled=True
@@ -433,21 +946,29 @@ class Displayer:
             title="Students", color=STUDENT_COLOR, disabled=True
         )
 
-        layout = Column(graph_plot, date_range_slider)
+        layout = Column(graph_plot, widgets["date_range_slider"])
         layout = Row(
             layout,
             Column(
-                checkbox_group,
-                multi_choice,
+                widgets["checkbox_group"],
+                widgets["multi_choice"],
                 picker_range1,
                 picker_range2,
                 picker_students,
                 picker_others,
-                count_slider,
-                para,
+                widgets["count_slider"],
+                widgets["para"],
             ),
         )
-        show(layout)
+        return layout
+
+
+def packets_text(packets: Dict[str, int]) -> str:
+    """Returns the text of the packets involved per student panel."""
+    text = "Packets involved per student :"
+    for student, count in packets.items():
+        text += "</br>" + student + " : " + str(count) + " packets"
+    return text
 
 
 def get_ranges(pos):
@@ -466,4 +987,71 @@ def get_ranges(pos):
     return {
         "x_range": Range1d(min_x - x_margin, max_x + x_margin),
         "y_range": Range1d(min_y - y_margin, max_y + y_margin),
-    }
\ No newline at end of file
+    }
+
+
+def index_edges(graph_setup: GraphRenderer) -> None:
+    """Sorts the edges of a graph renderer by date and adds the position of
+    their start and end nodes in the node columns, so that the date window can
+    be found by binary search and node lookups become array accesses."""
+
+    node_data = graph_setup.node_renderer.data_source.data
+    edge_data = graph_setup.edge_renderer.data_source.data
+
+    order = np.argsort(np.asarray(edge_data["date"]), kind="stable")
+
+    sorted_edge_data = {
+        key: np.asarray(column)[order]
+        if isinstance(column, np.ndarray)
+        else [column[i] for i in order]
+        for key, column in edge_data.items()
+    }
+
+    node_ids = {node: i for i, node in enumerate(node_data["index"])}
+
+    sorted_edge_data["start_idx"] = np.array(
+        [node_ids[node] for node in sorted_edge_data["start"]], dtype=np.int32
+    )
+    sorted_edge_data["end_idx"] = np.array(
+        [node_ids[node] for node in sorted_edge_data["end"]], dtype=np.int32
+    )
+
+    graph_setup.edge_renderer.data_source.data = sorted_edge_data
+
+
+def encode_columns(graph_setup: GraphRenderer) -> List[str]:
+    """Converts the columns of a graph renderer indexed by index_edges to
+    typed arrays, which Bokeh sends in binary instead of as JSON lists. The
+    ports become bitmasks of the services and the attribution labels codes.
+    :returns: The attribution labels, indexed by their codes
+    """
+
+    node_data = graph_setup.node_renderer.data_source.data
+    edge_data = graph_setup.edge_renderer.data_source.data
+
+    for key in ("count", "size", "opacity"):
+        node_data[key] = np.asarray(node_data[key], dtype=np.float64)
+    node_data["type"] = np.asarray(node_data["type"], dtype=np.int8)
+    node_data["ports"] = np.zeros(len(node_data["index"]), dtype=np.uint32)
+
+    attrs: List[str] = []
+    attr_ids: Dict[str, int] = {}
+    codes = np.empty(len(edge_data["attr"]), dtype=np.int32)
+
+    for i, attr in enumerate(edge_data["attr"]):
+        if attr is None:
+            codes[i] = -1
+        elif attr in attr_ids:
+            codes[i] = attr_ids[attr]
+        else:
+            codes[i] = attr_ids[attr] = len(attrs)
+            attrs.append(attr)
+
+    edge_data["attr"] = codes
+    edge_data["date"] = np.asarray(edge_data["date"], dtype=np.float64)
+    edge_data["count"] = np.asarray(edge_data["count"], dtype=np.float64)
+    edge_data["ports"] = np.array(
+        [ports_to_mask(ports) for ports in edge_data["ports"]], dtype=np.uint32
+    )
+
+    return attrs
@@ -3,20 +3,37 @@
 
 import json
 import os
+import tempfile
 import time
-from typing import List
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from copy import copy
+from queue import Queue
+from threading import Thread
+from typing import Any, Dict, List, Optional, Tuple
 
 import networkx as nx
 from attributor import get_player_flows
 from displayer import Displayer
+from graph_artifact import save_graph
+from graph_cube import GraphCube, flow_edges, inside_window
 from maya import parse as maya_parse
 from querier import (
+    DEFAULT_WORLD,
     get_filebeat_packets,
     get_journalbeat_packets,
     get_packetbeat_packets,
     save_all_players_data,
+    store_path,
 )
-from twmn.player import CoplayerSessions, Player, PlayerSession, limit_player_sessions
+from twmn.player import (
+    CoplayerSessions,
+    EpochPlayer,
+    EpochPlayerSession,
+    Player,
+    timestamp_to_epoch,
+)
+from twmn.session_index import SessionIndex, session_bounds
 from twmn_helpers.logging import Logging
 from twmn_helpers.time import Timeframe
 import warnings
@@ -29,31 +46,178 @@ warnings.filterwarnings('ignore')
 l = Logging(__name__)
 
 
-def main():
+def main(worlds: List[str] = None, workers: int = 4, fetch: bool = False):
+
+    worlds = worlds or [DEFAULT_WORLD]
+
+    t: Timeframe = Timeframe(
+        maya_parse("2022-10-04T00:00:01"), maya_parse("2022-10-04T23:59:59")
+    )
+
+    summary = run_worlds(worlds, t, workers, fetch)
+
+    l.debug(
+        f"{summary['worlds']} worlds, {summary['players']} players, {summary['flows']} flows"
+    )
+    l.debug(f"Execution time : {summary['elapsed']} seconds")
+
+    for world in worlds:
+        G = GraphCube(store_path("graph_cube.db", world)).graph(t)
+
+        # nx.write_gpickle(G, "graph.gpickle")
+
+        # displayer: Displayer = Displayer(G)
+        # displayer.display()
+        test_display(G, store_path("graph_data", world, create=True))
+
+
+def run_worlds(
+    worlds: List[str], t: Timeframe, workers: int = 4, fetch: bool = False
+) -> Dict[str, Any]:
+    """Runs the pipeline of several worlds concurrently. Worlds share nothing
+    but the Elasticsearch cluster, each one keeping its own local stores, so
+    they are run in separate processes.
+    :worlds: The names of the worlds
+    :t: The timeframe to attribute
+    :workers: The maximum number of worlds run at the same time
+    :fetch: Whether to download the packets of the worlds first
+    :returns: The merged summary of the worlds
+    """
+
+    st = time.time()
+
+    summaries = []
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(worlds))) as pool:
+        futures = {pool.submit(run_world, world, t, fetch): world for world in worlds}
+
+        for future in as_completed(futures):
+            summary = future.result()
+            l.debug(
+                f"world {summary['world']} done in {summary['elapsed']} seconds"
+            )
+            summaries.append(summary)
+
+    summary = merge_summaries(summaries)
+    summary["elapsed"] = time.time() - st
+
+    return summary
+
+
+def run_world(world: str, t: Timeframe, fetch: bool = False) -> Dict[str, Any]:
+    """Runs the pipeline of a single world against its own local stores.
+    :world: The name of the world
+    :t: The timeframe to attribute
+    :fetch: Whether to download the packets of the world first
+    :returns: A summary of the run
+    """
+
+    st = time.time()
+
+    if fetch:
+        save_all_players_data([], world)
+        get_filebeat_packets(world)
+        get_journalbeat_packets(world)
+        get_packetbeat_packets(world)
+
+    players = load_players(store_path("player_data.json", world))
+    index = SessionIndex.from_players(players)
+
+    cube = GraphCube(store_path("graph_cube.db", world, create=True))
+
+    # Sessions attributed by earlier runs are skipped, as saving adds to the
+    # stored counts
+    nb_flows = attribute_players(players, index, t, cube, windows=cube.windows(t))
+    cube.add_window(t)
+
+    cube.save()
+
+    G = cube.graph(t)
+
+    return {
+        "world": world,
+        "players": len(players),
+        "flows": nb_flows,
+        "nodes": G.number_of_nodes(),
+        "edges": G.number_of_edges(),
+        "elapsed": time.time() - st,
+    }
+
+
+def live(
+    world: str = DEFAULT_WORLD,
+    t: Optional[Timeframe] = None,
+    port: int = 5006,
+    max_edges: int = 10000,
+):
+    """Attributes the flows of a world while showing them in a live
+    visualization, fed with the edges of each flow as soon as it is found.
+    :world: The name of the world
+    :t: The timeframe to attribute
+    :port: The port of the Bokeh server
+    :max_edges: The number of most recent edges shown
+    """
+
+    t = t or Timeframe(
+        maya_parse("2022-10-04T00:00:01"), maya_parse("2022-10-04T23:59:59")
+    )
+
+    players = load_players(store_path("player_data.json", world))
+    index = SessionIndex.from_players(players)
+
+    cube = GraphCube(store_path("graph_cube.db", world, create=True))
+
+    # The stored cube only receives timeframes never attributed, as saving
+    # adds to the stored counts. Otherwise the flows go to a scratch cube,
+    # only used to feed the visualization.
+    persist = not cube.windows(t)
+    if not persist:
+        cube = GraphCube(os.path.join(tempfile.mkdtemp(), "graph_cube.db"))
+
+    feed: Queue = Queue()
+
+    def attribute() -> None:
+        nb_flows = attribute_players(players, index, t, cube, feed)
+        if persist:
+            cube.add_window(t)
+            cube.save()
+        l.debug(f"world {world} attributed, {nb_flows} flows")
+
+    Thread(target=attribute, daemon=True).start()
+
+    Displayer(nx.MultiDiGraph()).live(feed, port, max_edges)
+
 
-    # player_data = []
-    # save_all_players_data(player_data)
-    #
-    # get_filebeat_packets()
-    #
-    #
-    # get_journalbeat_packets()
-    #
-    #
-    # get_packetbeat_packets()
+def merge_summaries(summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merges the summaries of several worlds into one."""
 
+    return {
+        "worlds": len(summaries),
+        "players": sum(s["players"] for s in summaries),
+        "flows": sum(s["flows"] for s in summaries),
+        "nodes": sum(s["nodes"] for s in summaries),
+        "edges": sum(s["edges"] for s in summaries),
+        "per_world": sorted(summaries, key=lambda s: s["world"]),
+    }
 
 
+def load_players(player_file: str = "player_data.json") -> List[EpochPlayer]:
+    """Loads the players, their sessions and their coplayers' sessions, as
+    epoch-based players and sessions
+    :player_file: The json file written by save_all_players_data
+    :returns: The list of players
+    """
+
     players = []
 
-    with open("player_data.json", "r") as fichier:
+    with open(player_file, "r") as fichier:
         data = json.load(fichier)
         all_players = []
 
         print('start making player_data.json')
 
         for player in data:
-            all_players.append(Player(player["name"], player["id"]))
+            all_players.append(EpochPlayer(player["name"], player["id"]))
             print('appending player name and id')
 
         for player in data:
@@ -66,22 +230,22 @@ def main():
                     coplayer_player = get_player(c["player"], all_players)
                     for coplayer_session in c["sessions"]:
                         coplayer_sessions.append(
-                            PlayerSession(
-                                maya_parse(coplayer_session["start"]),
-                                maya_parse(coplayer_session["end"]),
+                            EpochPlayerSession(
+                                timestamp_to_epoch(coplayer_session["start"]),
+                                timestamp_to_epoch(coplayer_session["end"]),
                             )
                         )
                     coplayers.append(             #append coplayer session
                         CoplayerSessions(coplayer_player, coplayer_sessions)   #player sessions and name, append to coplayer sessions
                     )
                 sessions.append(                  #append player session
-                    PlayerSession(
-                        maya_parse(session["start"]),
-                        maya_parse(session["end"]),
+                    EpochPlayerSession(
+                        timestamp_to_epoch(session["start"]),
+                        timestamp_to_epoch(session["end"]),
                         coplayers,
                     )
                 )
-            p = Player(
+            p = EpochPlayer(
                 name=player["name"],
                 id=player["id"],
                 world=player["world"],
@@ -92,50 +256,45 @@ def main():
 
     print('player_data.json complete')
 
-    t: Timeframe = Timeframe(
-        maya_parse("2022-10-04T00:00:01"), maya_parse("2022-10-04T23:59:59")
-    )
-    G = nx.MultiDiGraph()
-    G_session = nx.DiGraph()
-
-    service_ports = [
-        20,
-        21,
-        22,
-        23,
-        25,
-        53,
-        67,
-        68,
-        69,
-        80,
-        110,
-        119,
-        123,
-        143,
-        389,
-        443,
-        993,
-        1812,
-        5190,
-    ]
-    st = time.time()
-    for i, player in enumerate(players):
+    return players
+
+
+def attribute_players(
+    players: List[Player],
+    index: SessionIndex,
+    t: Timeframe,
+    cube: GraphCube,
+    feed: Optional[Queue] = None,
+    windows: Optional[List[Tuple[float, float]]] = None,
+) -> int:
+    """Runs the attribution of the flows of all players during a timeframe and
+    rolls the attributed flows up into the time cube
+    :players: The list of players
+    :index: The index of the sessions of the players, built once per roster
+    :t: The timeframe to attribute
+    :cube: The time cube receiving the attributed flows
+    :feed: An optional queue receiving the edges of each attributed flow
+    :windows: The windows of earlier runs, whose sessions are skipped as
+    they are already in the cube
+    :returns: The total number of flows
+    """
 
-        # print(t)
-        # print(player.sessions)
-        sessions = limit_player_sessions(player.sessions, t)
-        # print(len(sessions))
-        # sessions = []
-        # for session in player.sessions:
-        #     sessions.append(session)
+    nb_flows = 0
 
-        nb_flows = 0
+    sessions_in_frame = defaultdict(list)
+
+    for player, session in index.contained(t.start, t.end):
+        if windows and inside_window(*session_bounds(session), windows):
+            continue
+        sessions_in_frame[player].append(copy(session))
+
+    for i, player in enumerate(players):
+
+        sessions = sessions_in_frame[player]
 
         print('len sessions')
         print(len(sessions))
 
-
         for count, session in enumerate(sessions):
 
             l.debug(f"...checking player {i}/{len(players)}")
@@ -150,73 +309,13 @@ def main():
             )
 
             for flow in flows:
-                for flowpart in flow:
-                    attr_ip = flow[0].source
-                    if flowpart.source in G.nodes:
-                        G.nodes[flowpart.source]["count"] += 1
-                    else:
-                        G.add_node(flowpart.source, count=1)
-                    if flowpart.destination in G.nodes:
-                        G.nodes[flowpart.destination]["count"] += 1
-                    else:
-                        G.add_node(flowpart.destination, count=1)
-
-                    G_session.add_node(flowpart.source)
-                    G_session.add_node(flowpart.destination)
-
-                    if G_session.has_edge(flowpart.source, flowpart.destination):
-                        if (
-                            G_session[flowpart.source][flowpart.destination]["date"]
-                            > flowpart.start.epoch
-                        ):
-                            G_session[flowpart.source][flowpart.destination][
-                                "date"
-                            ] = flowpart.start.epoch
-                        G_session[flowpart.source][flowpart.destination]["count"] += 1
-                        if (
-                            flowpart.dport
-                            not in G_session[flowpart.source][flowpart.destination][
-                                "ports"
-                            ]
-                            and flowpart.dport in service_ports
-                        ):
-                            G_session[flowpart.source][flowpart.destination][
-                                "ports"
-                            ].append(flowpart.dport)
-                    else:
-                        p = [flowpart.dport] if flowpart.dport in service_ports else []
-                        G_session.add_edge(
-                            flowpart.source,
-                            flowpart.destination,
-                            ports=p,
-                            date=flowpart.start.epoch,
-                            count=1,
-                        )
-
-            for edge in G_session.edges(data=True):
-                G.add_edge(
-                    edge[0],
-                    edge[1],
-                    date=edge[2]["date"] * 1000,
-                    attr=attr_ip,
-                    ports=edge[2]["ports"],
-                    count=edge[2]["count"],
-                )
+                cube.add_flow(flow)
+                if feed is not None:
+                    feed.put(flow_edges(flow))
 
     l.debug(f"Total number of flows : {nb_flows}")
 
-    et = time.time()
-    elapsed_time = et - st
-
-    l.debug(f"Execution time : {elapsed_time} seconds")
-
-    # nx.write_gpickle(G, "graph.gpickle")
-
-    # displayer: Displayer = Displayer(G)
-    # displayer.display()
-    test_display(G)
-
-
+    return nb_flows
 
 
 def get_player(player: str, players: List[Player]) -> Player:
@@ -247,25 +346,10 @@ def get_player(player: str, players: List[Player]) -> Player:
 #
 #     plt.show()
 
-def test_display(G: nx.MultiDiGraph, layout_file: str = "graph_data.json"):
+def test_display(G: nx.MultiDiGraph, layout_file: str = "graph_data"):
     pos = nx.spring_layout(G, k=5, iterations=50)
-    pos_list = {key: list(value) for key, value in pos.items()}
-
-    nodes = []
-    for n, data in G.nodes(data=True):
-        node = {"id": n, "pos": pos_list[n]}
-        node.update(data)
-        nodes.append(node)
-
-    edges = []
-    for u, v, data in G.edges(data=True):
-        edge = {"source": u, "target": v, "data": data}
-        edges.append(edge)
-
-    graph_data = {"nodes": nodes, "edges": edges}
 
-    with open(layout_file, "w") as f:
-        json.dump(graph_data, f)
+    save_graph(G, layout_file, pos)
 
     nx.draw(G, pos, with_labels=True, node_size=200, node_color="skyblue", font_size=10, font_color="black")
     nx.draw_networkx_edge_labels(G, pos, edge_labels={(u, v): d["count"] for u, v, d in G.edges(data=True)}, font_size=8)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+"""This module saves the graph of the attributed flows as a compact artifact :
+a node table and an edge table stored as typed numeric columns, with the IPs
+and the attribution labels dictionary-encoded. Columns are written as .npy
+files that can be memory-mapped when loading, or in a single compressed .npz
+archive."""
+
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+from displayer import Displayer
+
+ARTIFACT_VERSION = 1
+
+META_FILE = "meta.json"
+COMPRESSED_FILE = "columns.npz"
+
+NODE_COLUMNS = ["node_count", "node_x", "node_y"]
+EDGE_COLUMNS = [
+    "edge_source",
+    "edge_target",
+    "edge_date",
+    "edge_attr",
+    "edge_count",
+    "edge_port_offsets",
+    "edge_ports",
+]
+
+
+class GraphArtifact:
+    """Columns of a graph artifact loaded from disk."""
+
+    def __init__(
+        self, nodes: List[str], attrs: List[str], columns: Dict[str, np.ndarray]
+    ) -> None:
+        """Create a graph artifact.
+        :nodes: The node table, indexed by the node codes
+        :attrs: The attribution labels, indexed by the attribution codes
+        :columns: The node and edge columns
+        """
+        self.nodes = nodes
+        self.attrs = attrs
+        self.columns = columns
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def __len__(self) -> int:
+        """Return the number of edges."""
+        return len(self.columns["edge_source"])
+
+    def has_positions(self) -> bool:
+        return not np.isnan(self.columns["node_x"]).any()
+
+    def positions(self) -> Dict[str, Tuple[float, float]]:
+        """Returns the layout of the nodes, keyed by node name."""
+        return {
+            node: (float(x), float(y))
+            for node, x, y in zip(self.nodes, self["node_x"], self["node_y"])
+        }
+
+    def edge_ports(self, i: int) -> List[int]:
+        """Returns the service ports of an edge."""
+        offsets = self["edge_port_offsets"]
+        return self["edge_ports"][offsets[i] : offsets[i + 1]].tolist()
+
+
+def save_graph(
+    G: nx.MultiDiGraph,
+    path: str,
+    pos: Optional[Dict[str, Any]] = None,
+    compress: bool = False,
+) -> None:
+    """Saves a graph of attributed flows as a graph artifact.
+    :G: The graph built by the executor
+    :path: The directory of the artifact
+    :pos: An optional layout of the nodes
+    :compress: Whether to store the columns in a compressed archive, which
+    cannot be memory-mapped
+    """
+    os.makedirs(path, exist_ok=True)
+
+    nodes = list(G.nodes)
+    node_ids = {node: i for i, node in enumerate(nodes)}
+
+    attrs: List[str] = []
+    attr_ids: Dict[str, int] = {}
+
+    nb_nodes = len(nodes)
+    nb_edges = G.number_of_edges()
+
+    columns = {
+        "node_count": np.fromiter(
+            (data.get("count", 0) for _, data in G.nodes(data=True)),
+            dtype=np.int64,
+            count=nb_nodes,
+        ),
+        "node_x": np.full(nb_nodes, np.nan),
+        "node_y": np.full(nb_nodes, np.nan),
+        "edge_source": np.empty(nb_edges, dtype=np.int32),
+        "edge_target": np.empty(nb_edges, dtype=np.int32),
+        "edge_date": np.empty(nb_edges, dtype=np.int64),
+        "edge_attr": np.empty(nb_edges, dtype=np.int32),
+        "edge_count": np.empty(nb_edges, dtype=np.int64),
+        "edge_port_offsets": np.zeros(nb_edges + 1, dtype=np.int64),
+    }
+
+    if pos:
+        for node, (x, y) in pos.items():
+            columns["node_x"][node_ids[node]] = x
+            columns["node_y"][node_ids[node]] = y
+
+    ports: List[int] = []
+
+    for i, (u, v, data) in enumerate(G.edges(data=True)):
+        attr = data.get("attr")
+        if attr is None:
+            code = -1
+        elif attr in attr_ids:
+            code = attr_ids[attr]
+        else:
+            code = attr_ids[attr] = len(attrs)
+            attrs.append(attr)
+
+        columns["edge_source"][i] = node_ids[u]
+        columns["edge_target"][i] = node_ids[v]
+        columns["edge_date"][i] = data.get("date", 0)
+        columns["edge_attr"][i] = code
+        columns["edge_count"][i] = data.get("count", 1)
+
+        ports.extend(data.get("ports", []))
+        columns["edge_port_offsets"][i + 1] = len(ports)
+
+    columns["edge_ports"] = np.array(ports, dtype=np.uint16)
+
+    meta = {
+        "version": ARTIFACT_VERSION,
+        "compressed": compress,
+        "nodes": nodes,
+        "attrs": attrs,
+    }
+
+    with open(os.path.join(path, META_FILE), "w") as f:
+        json.dump(meta, f)
+
+    if compress:
+        np.savez_compressed(os.path.join(path, COMPRESSED_FILE), **columns)
+    else:
+        for name, column in columns.items():
+            np.save(os.path.join(path, f"{name}.npy"), column)
+
+
+def load_artifact(path: str, mmap: bool = True) -> GraphArtifact:
+    """Loads the columns of a graph artifact.
+    :path: The directory of the artifact
+    :mmap: Whether to memory-map uncompressed columns instead of reading them
+    :returns: The loaded artifact
+    """
+    with open(os.path.join(path, META_FILE), "r") as f:
+        meta = json.load(f)
+
+    if meta["version"] != ARTIFACT_VERSION:
+        raise ValueError(f"Unsupported graph artifact version: {meta['version']}")
+
+    if meta["compressed"]:
+        with np.load(os.path.join(path, COMPRESSED_FILE)) as archive:
+            columns = {name: archive[name] for name in archive.files}
+    else:
+        columns = {
+            name: np.load(
+                os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None
+            )
+            for name in NODE_COLUMNS + EDGE_COLUMNS
+        }
+
+    return GraphArtifact(meta["nodes"], meta["attrs"], columns)
+
+
+def load_graph(path: str) -> nx.MultiDiGraph:
+    """Loads a graph artifact as the networkx graph built by the executor."""
+    return artifact_to_graph(load_artifact(path))
+
+
+def artifact_to_graph(artifact: GraphArtifact) -> nx.MultiDiGraph:
+    """Rebuilds the networkx graph built by the executor from its columns."""
+
+    nodes = artifact.nodes
+    attrs = artifact.attrs
+
+    G = nx.MultiDiGraph()
+
+    G.add_nodes_from(
+        (node, {"count": int(count)})
+        for node, count in zip(nodes, artifact["node_count"])
+    )
+
+    offsets = artifact["edge_port_offsets"].tolist()
+    ports = artifact["edge_ports"].tolist()
+
+    G.add_edges_from(
+        (
+            nodes[u],
+            nodes[v],
+            {
+                "date": date,
+                "attr": attrs[attr] if attr >= 0 else None,
+                "ports": ports[offsets[i] : offsets[i + 1]],
+                "count": count,
+            },
+        )
+        for i, (u, v, date, attr, count) in enumerate(
+            zip(
+                artifact["edge_source"].tolist(),
+                artifact["edge_target"].tolist(),
+                artifact["edge_date"].tolist(),
+                artifact["edge_attr"].tolist(),
+                artifact["edge_count"].tolist(),
+            )
+        )
+    )
+
+    return G
+
+
+def load_displayer(path: str) -> Displayer:
+    """Loads a graph artifact into a Displayer, reusing the saved layout."""
+
+    artifact = load_artifact(path)
+    G = artifact_to_graph(artifact)
+
+    return Displayer(G, artifact.positions() if artifact.has_positions() else None)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+"""This module provides a level-of-detail view of the graph shown by the
+Displayer. Hosts are collapsed into one super-node per subnet (or per /24),
+with the edges between them aggregated, and a cluster is only expanded into
+its hosts on demand. Layout is computed on the clusters, the hosts of an
+expanded cluster being placed around it."""
+
+import math
+from typing import Any, Dict, List, Set, Tuple
+
+import networkx as nx
+import numpy as np
+from ip_classifier import OTHER, RANGE1, RANGE2, STUDENT, classify
+
+SUBNETS = {
+    RANGE1: "10.0.0.0/22",
+    RANGE2: "10.0.4.0/22",
+    STUDENT: "192.168.0.0/24",
+    OTHER: "Others",
+}
+
+
+def cluster_label(node: str, node_type: int, mode: str = "subnet") -> str:
+    """Returns the cluster of a host.
+    :node: The IP (or name) of the host
+    :node_type: The category of the host, see ip_classifier
+    :mode: "subnet" to group by range, "/24" to group by /24 network
+    """
+    if mode == "subnet":
+        return SUBNETS.get(node_type, SUBNETS[OTHER])
+    if mode == "/24":
+        octets = node.split(".")
+        if len(octets) == 4 and all(o.isdigit() for o in octets):
+            return ".".join(octets[:3]) + ".0/24"
+        return SUBNETS[OTHER]
+    raise ValueError(f"Unknown cluster mode: {mode}")
+
+
+def ring_position(
+    center: Tuple[float, float], k: int, spacing: float, offset: float = 0.5
+) -> Tuple[float, float]:
+    """Returns the position of the k-th node placed on rings around a center,
+    with a sunflower placement keeping the nodes evenly spaced.
+    :center: The position the nodes are placed around
+    :k: The number of nodes already placed around it
+    :spacing: The distance between neighbouring nodes
+    :offset: Added to k for the radius, larger to keep the nodes further from
+    the center
+    """
+    cx, cy = center
+    r = spacing * math.sqrt(k + offset)
+    theta = k * math.pi * (3 - math.sqrt(5))
+    return (cx + r * math.cos(theta), cy + r * math.sin(theta))
+
+
+class ClusterView:
+    """Collapsed view of a graph, with some clusters expanded into hosts."""
+
+    def __init__(
+        self,
+        G: nx.MultiDiGraph,
+        colors: np.ndarray,
+        mode: str = "subnet",
+        spacing: float = 40.0,
+    ) -> None:
+        """Group the hosts of a graph into clusters.
+        :G: The graph of the flows
+        :colors: The color of each category of ip_classifier
+        :mode: How hosts are grouped, see cluster_label
+        :spacing: The distance between the hosts of an expanded cluster
+        """
+        self.spacing = spacing
+
+        self.nodes = list(G.nodes)
+        node_ids = {node: i for i, node in enumerate(self.nodes)}
+
+        self.types = classify(self.nodes)
+        self.colors = colors[self.types].tolist()
+
+        labels = [
+            cluster_label(n, t, mode) for n, t in zip(self.nodes, self.types.tolist())
+        ]
+        self.clusters, self.cluster_of = np.unique(labels, return_inverse=True)
+        self.clusters = self.clusters.tolist()
+        self.cluster_ids = {c: i for i, c in enumerate(self.clusters)}
+        self.members: List[np.ndarray] = [
+            np.flatnonzero(self.cluster_of == c) for c in range(len(self.clusters))
+        ]
+
+        edges = list(G.edges(data=True))
+        date = np.array([d.get("date", 0) for _, _, d in edges], dtype=np.float64)
+        order = np.argsort(date, kind="stable")
+
+        self.date = date[order]
+        self.src = np.array([node_ids[u] for u, _, _ in edges], dtype=np.int64)[order]
+        self.dst = np.array([node_ids[v] for _, v, _ in edges], dtype=np.int64)[order]
+        self.count = np.array(
+            [d.get("count", 1) for _, _, d in edges], dtype=np.float64
+        )[order]
+
+        self.expanded: Set[int] = set()
+        self.cluster_pos = self.layout_clusters()
+        self.host_pos: Dict[int, Tuple[float, float]] = {}
+
+    def layout_clusters(self) -> Dict[int, Tuple[float, float]]:
+        """Lays out the cluster graph, whose size is the number of clusters."""
+
+        C = nx.Graph()
+        C.add_nodes_from(range(len(self.clusters)))
+
+        a, b = self.cluster_of[self.src], self.cluster_of[self.dst]
+        for u, v in set(zip(a.tolist(), b.tolist())):
+            if u != v:
+                C.add_edge(u, v)
+
+        scale = self.spacing * 10 * max(1, math.sqrt(len(self.nodes)))
+        pos = nx.spring_layout(C, seed=1, scale=scale)
+
+        return {c: (float(x), float(y)) for c, (x, y) in pos.items()}
+
+    def expand(self, cluster: int) -> None:
+        """Expands a cluster into its hosts, placed on rings around it."""
+
+        self.expanded.add(cluster)
+
+        cx, cy = self.cluster_pos[cluster]
+        members = self.members[cluster]
+
+        for k, node in enumerate(members.tolist()):
+            if node in self.host_pos:
+                continue
+            self.host_pos[node] = ring_position((cx, cy), k, self.spacing)
+
+    def collapse(self, cluster: int) -> None:
+        self.expanded.discard(cluster)
+
+    def toggle(self, label: str) -> None:
+        """Expands a collapsed cluster, or collapses the cluster of a host."""
+        if label in self.cluster_ids:
+            self.expand(self.cluster_ids[label])
+        elif label in self.nodes:
+            self.collapse(int(self.cluster_of[self.nodes.index(label)]))
+
+    def visible(
+        self, date_from: float = -np.inf, date_to: float = np.inf
+    ) -> Tuple[Dict[str, list], Dict[str, list], Dict[str, Tuple[float, float]]]:
+        """Computes the shown graph, with the edges dated between date_from
+        and date_to aggregated between the shown nodes.
+        :returns: The node columns, the edge columns and the layout
+        """
+
+        collapsed = [c for c in range(len(self.clusters)) if c not in self.expanded]
+        hosts = [
+            node for c in sorted(self.expanded) for node in self.members[c].tolist()
+        ]
+
+        labels = [self.clusters[c] for c in collapsed] + [self.nodes[n] for n in hosts]
+        nb_shown = len(labels)
+
+        # Shown node representing each host
+        rep = np.empty(len(self.nodes), dtype=np.int64)
+        cluster_rep = np.full(len(self.clusters), -1, dtype=np.int64)
+        cluster_rep[collapsed] = np.arange(len(collapsed))
+        rep[:] = cluster_rep[self.cluster_of]
+        rep[hosts] = np.arange(len(collapsed), nb_shown)
+
+        first = int(np.searchsorted(self.date, date_from, side="left"))
+        last = int(np.searchsorted(self.date, date_to, side="right"))
+
+        src = rep[self.src[first:last]]
+        dst = rep[self.dst[first:last]]
+        count = self.count[first:last]
+        date = self.date[first:last]
+
+        node_count = np.bincount(src, weights=count, minlength=nb_shown)
+        node_count += np.bincount(dst, weights=count, minlength=nb_shown)
+
+        between = src != dst
+        pairs, inverse = np.unique(
+            src[between] * nb_shown + dst[between], return_inverse=True
+        )
+        edge_count = np.bincount(inverse, weights=count[between], minlength=len(pairs))
+        edge_date = np.full(len(pairs), np.inf)
+        np.minimum.at(edge_date, inverse, date[between])
+
+        sum_count = node_count.sum()
+        hosts_per_node = [len(self.members[c]) for c in collapsed] + [1] * len(hosts)
+
+        types = [self.types[self.members[c][0]] for c in collapsed] + [
+            self.types[n] for n in hosts
+        ]
+
+        node_data: Dict[str, Any] = {
+            "index": labels,
+            "count": node_count.tolist(),
+            "hosts": hosts_per_node,
+            "size": [
+                (20 + 10 * math.log2(h)) * (1 + (c / sum_count if sum_count else 0))
+                for h, c in zip(hosts_per_node, node_count.tolist())
+            ],
+            "color": [self.colors[self.members[c][0]] for c in collapsed]
+            + [self.colors[n] for n in hosts],
+            "type": [int(t) for t in types],
+            "opacity": [1] * nb_shown,
+            "ports": [[] for _ in range(nb_shown)],
+        }
+
+        edge_data = {
+            "start": [labels[p] for p in (pairs // nb_shown).tolist()],
+            "end": [labels[p] for p in (pairs % nb_shown).tolist()],
+            "count": edge_count.tolist(),
+            "date": edge_date.tolist(),
+        }
+
+        layout = {self.clusters[c]: self.cluster_pos[c] for c in collapsed}
+        layout.update({self.nodes[n]: self.host_pos[n] for n in hosts})
+
+        return node_data, edge_data, layout
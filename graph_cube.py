@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+
+"""This module rolls the attributed flows of the players up into a time cube
+stored in a local database. Edges are kept in hourly and daily buckets with
+per-(source, destination, attribution) counts, minimum dates and port sets, so
+that any time range can be answered by merging buckets instead of running the
+attribution again."""
+
+import json
+import sqlite3 as sl
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import networkx as nx
+from graph_filter import SERVICES
+from maya import MayaDT
+from twmn_helpers.logging import Logging
+from twmn_helpers.time import Timeframe
+
+l = Logging(__name__)
+
+HOUR = 3600
+DAY = 86400
+
+# Bucket resolutions, from the coarsest to the finest
+RESOLUTIONS = {"day": DAY, "hour": HOUR}
+
+# The ports whose services are shown, as in the port masks of the Displayer
+SERVICE_PORTS = list(SERVICES)
+
+EdgeKey = Tuple[str, str, str]
+
+
+def flow_edges(flow: List) -> List[Dict[str, Any]]:
+    """Returns the edges of a flow, attributed to the source of its first
+    part, with the same attributes as the edges of GraphCube.graph."""
+    attr_ip = flow[0].source
+    return [
+        {
+            "source": flowpart.source,
+            "destination": flowpart.destination,
+            "date": flowpart.start.epoch * 1000,
+            "attr": attr_ip,
+            "ports": [flowpart.dport] if flowpart.dport in SERVICE_PORTS else [],
+            "count": 1,
+        }
+        for flowpart in flow
+    ]
+
+
+def inside_window(start: float, end: float, windows: List[Tuple[float, float]]) -> bool:
+    """Tells whether a session lies strictly inside one of the windows of
+    earlier runs, and so was attributed by one of them, as a run only takes
+    the sessions inside its window.
+    :start: The start epoch of the session
+    :end: The end epoch of the session
+    :windows: The windows of the earlier runs, see GraphCube.windows
+    """
+    return any(s < start and end < e for s, e in windows)
+
+
+class CubeCell:
+    """Aggregated counters of the edges between two hosts attributed to the
+    same player inside a bucket."""
+
+    __slots__ = ("count", "date_min", "ports")
+
+    def __init__(self, count: int = 0, date_min: float = None, ports: Set[int] = None):
+        self.count = count
+        self.date_min = date_min
+        self.ports = ports or set()
+
+    def merge(self, count: int, date_min: float, ports: Iterable[int]) -> None:
+        """Merge the counters of another cell into this one."""
+        self.count += count
+        if self.date_min is None or date_min < self.date_min:
+            self.date_min = date_min
+        self.ports.update(ports)
+
+
+class GraphCube:
+    """Time cube of the attributed edges, backed by a sqlite database."""
+
+    def __init__(self, db_file: str = "graph_cube.db") -> None:
+        """Open (and create if needed) a graph cube.
+        :db_file: The local database holding the buckets
+        """
+        self.db_file = db_file
+
+        # Cells added since the last save, keyed by (resolution, bucket, edge)
+        self.pending: Dict[Tuple[str, int, EdgeKey], CubeCell] = {}
+        self.pending_windows: List[Tuple[float, float]] = []
+
+        con = sl.connect(self.db_file)
+
+        with con:
+            con.execute(
+                """
+                CREATE TABLE IF NOT EXISTS CUBE (
+                    resolution TEXT,
+                    bucket INTEGER,
+                    source TEXT,
+                    destination TEXT,
+                    attr TEXT,
+                    count INTEGER,
+                    date_min REAL,
+                    ports TEXT,
+                    PRIMARY KEY (resolution, bucket, source, destination, attr)
+                );
+            """
+            )
+            con.execute(
+                """
+                CREATE TABLE IF NOT EXISTS WINDOWS (
+                    start REAL,
+                    end REAL
+                );
+            """
+            )
+
+    def add_edge(
+        self,
+        source: str,
+        destination: str,
+        attr: str,
+        date: float,
+        port: Optional[int] = None,
+        count: int = 1,
+    ) -> None:
+        """Adds an attributed edge to the hourly and daily buckets.
+        :source: The source host
+        :destination: The destination host
+        :attr: The attribution label (the IP of the player)
+        :date: The epoch (in seconds) of the edge
+        :port: The destination port, only kept if it is a service port
+        :count: The number of flow parts represented by the edge
+        """
+        ports = [port] if port in SERVICE_PORTS else []
+
+        for resolution, width in RESOLUTIONS.items():
+            key = (resolution, int(date // width) * width, (source, destination, attr))
+            cell = self.pending.get(key)
+            if cell is None:
+                cell = self.pending[key] = CubeCell()
+            cell.merge(count, date, ports)
+
+    def add_flow(self, flow: List) -> None:
+        """Adds every part of a flow, attributed to the source of its first
+        part."""
+        attr_ip = flow[0].source
+        for flowpart in flow:
+            self.add_edge(
+                flowpart.source,
+                flowpart.destination,
+                attr_ip,
+                flowpart.start.epoch,
+                flowpart.dport,
+            )
+
+    def add_window(self, timeframe: Timeframe) -> None:
+        """Records that the attribution was run over a timeframe."""
+        self.pending_windows.append((timeframe.start.epoch, timeframe.end.epoch))
+
+    def windows(self, timeframe: Timeframe) -> List[Tuple[float, float]]:
+        """Returns the windows over which the attribution was run, stored or
+        pending, that overlap a timeframe.
+        :timeframe: The timeframe to attribute
+        :returns: The start and end epochs of the windows, in order
+        """
+        start, end = timeframe.start.epoch, timeframe.end.epoch
+
+        con = sl.connect(self.db_file)
+
+        with con:
+            data = con.execute(
+                "SELECT start, end FROM WINDOWS WHERE end > ? AND start < ?",
+                (start, end),
+            )
+            stored = data.fetchall()
+
+        pending = [(s, e) for s, e in self.pending_windows if e > start and s < end]
+
+        return sorted([*stored, *pending])
+
+    def uncovered(self, timeframe: Timeframe) -> List[Timeframe]:
+        """Returns the parts of a timeframe over which the attribution was not
+        run yet.
+        :timeframe: The timeframe to attribute
+        :returns: The uncovered timeframes, in order
+        """
+        start, end = timeframe.start.epoch, timeframe.end.epoch
+
+        windows = self.windows(timeframe)
+
+        if not windows:
+            return [timeframe]
+
+        parts = []
+        cursor = start
+
+        for s, e in windows:
+            if s > cursor:
+                parts.append((cursor, min(s, end)))
+            cursor = max(cursor, e)
+            if cursor >= end:
+                break
+
+        if cursor < end:
+            parts.append((cursor, end))
+
+        return [Timeframe(MayaDT(s), MayaDT(e)) for s, e in parts if s < e]
+
+    def covers(self, timeframe: Timeframe) -> bool:
+        """Tells whether the attribution was already run over a timeframe."""
+        return not self.uncovered(timeframe)
+
+    def save(self) -> None:
+        """Merges the pending cells into the buckets stored on disk."""
+
+        con = sl.connect(self.db_file)
+
+        buckets = {(resolution, bucket) for resolution, bucket, _ in self.pending}
+
+        with con:
+            for resolution, bucket in buckets:
+                data = con.execute(
+                    "SELECT source, destination, attr, count, date_min, ports FROM CUBE WHERE resolution = ? AND bucket = ?",
+                    (resolution, bucket),
+                )
+                for row in data:
+                    cell = self.pending.get((resolution, bucket, (row[0], row[1], row[2])))
+                    if cell is not None:
+                        cell.merge(row[3], row[4], json.loads(row[5]))
+
+            sql = "INSERT OR REPLACE INTO CUBE (resolution, bucket, source, destination, attr, count, date_min, ports) values(?, ?, ?, ?, ?, ?, ?, ?)"
+
+            con.executemany(
+                sql,
+                [
+                    (
+                        resolution,
+                        bucket,
+                        *edge,
+                        cell.count,
+                        cell.date_min,
+                        json.dumps(sorted(cell.ports)),
+                    )
+                    for (resolution, bucket, edge), cell in self.pending.items()
+                ],
+            )
+            con.executemany(
+                "INSERT INTO WINDOWS (start, end) values(?, ?)", self.pending_windows
+            )
+
+        l.debug(f"saved {len(self.pending)} cells in {len(buckets)} buckets")
+
+        self.pending = {}
+        self.pending_windows = []
+
+    def plan(self, start: float, end: float) -> List[Tuple[str, int]]:
+        """Returns the smallest list of buckets covering [start, end[. Whole
+        days use daily buckets, the remaining hours hourly buckets. The range
+        is widened to hour boundaries.
+        :start: The epoch (in seconds) of the beginning of the range
+        :end: The epoch (in seconds) of the end of the range
+        :returns: A list of (resolution, bucket) pairs
+        """
+        start = int(start // HOUR) * HOUR
+        end = -int(-end // HOUR) * HOUR
+
+        first_day = -(-start // DAY) * DAY
+        last_day = (end // DAY) * DAY
+
+        if first_day >= last_day:
+            return [("hour", h) for h in range(start, end, HOUR)]
+
+        return [
+            *[("hour", h) for h in range(start, first_day, HOUR)],
+            *[("day", d) for d in range(first_day, last_day, DAY)],
+            *[("hour", h) for h in range(last_day, end, HOUR)],
+        ]
+
+    def edges(self, timeframe: Timeframe) -> Dict[EdgeKey, CubeCell]:
+        """Merges the buckets covering a timeframe.
+        :timeframe: The timeframe to answer
+        :returns: The aggregated cell of every attributed edge in the timeframe
+        """
+        if self.pending:
+            self.save()
+
+        plan = self.plan(timeframe.start.epoch, timeframe.end.epoch)
+
+        cells: Dict[EdgeKey, CubeCell] = {}
+
+        con = sl.connect(self.db_file)
+
+        with con:
+            for resolution in RESOLUTIONS:
+                buckets = [b for r, b in plan if r == resolution]
+                if not buckets:
+                    continue
+                req = (
+                    "SELECT source, destination, attr, count, date_min, ports FROM CUBE WHERE resolution = ? AND bucket IN ("
+                    + ", ".join("?" for _ in buckets)
+                    + ")"
+                )
+                data = con.execute(req, (resolution, *buckets))
+                for row in data:
+                    edge = (row[0], row[1], row[2])
+                    cell = cells.get(edge)
+                    if cell is None:
+                        cell = cells[edge] = CubeCell()
+                    cell.merge(row[3], row[4], json.loads(row[5]))
+
+        return cells
+
+    def graph(self, timeframe: Timeframe) -> nx.MultiDiGraph:
+        """Builds the graph of the attributed flows during a timeframe, with
+        the same node and edge attributes as the ones built by the executor."""
+
+        G = nx.MultiDiGraph()
+
+        for (source, destination, attr), cell in self.edges(timeframe).items():
+            for node in (source, destination):
+                if node in G.nodes:
+                    G.nodes[node]["count"] += cell.count
+                else:
+                    G.add_node(node, count=cell.count)
+
+            G.add_edge(
+                source,
+                destination,
+                date=cell.date_min * 1000,
+                attr=attr,
+                ports=sorted(cell.ports),
+                count=cell.count,
+            )
+
+        return G
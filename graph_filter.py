@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+"""This module filters the graph shown by the Displayer in Python. The node
+and edge columns of the graph renderer are indexed once into numpy arrays, so
+that every interaction only costs a binary search on the dates and a few
+vectorized passes over the edges of the selected window."""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from ip_classifier import STUDENT
+
+ONE_DAY = 86400000
+
+SERVICES = {
+    20: "FTP",
+    21: "FTP",
+    22: "SSH",
+    23: "Telnet",
+    25: "SMTP",
+    53: "DNS",
+    67: "DHCP",
+    68: "DHCP",
+    69: "TFTP",
+    80: "HTTP",
+    110: "POP3",
+    119: "NNTP",
+    123: "NTP",
+    143: "IMAP4",
+    389: "LDAP",
+    443: "HTTPS",
+    993: "IMAPS",
+    1812: "RADIUS",
+    5190: "AIM",
+}
+
+# Bit of each service port in the port masks
+SERVICE_BITS = {port: bit for bit, port in enumerate(SERVICES)}
+
+
+def ports_to_mask(ports: List[int]) -> int:
+    """Encodes a list of service ports as a bitmask."""
+    mask = 0
+    for port in ports:
+        if port in SERVICE_BITS:
+            mask |= 1 << SERVICE_BITS[port]
+    return mask
+
+
+def mask_to_services(mask: int) -> List[str]:
+    """Decodes a port bitmask into the distinct names of the services."""
+    services: List[str] = []
+    for port, bit in SERVICE_BITS.items():
+        if mask >> bit & 1 and SERVICES[port] not in services:
+            services.append(SERVICES[port])
+    return services
+
+
+def index_attrs(attr_codes: np.ndarray, nb_attrs: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Groups the positions of date-sorted edges by attribution label. The
+    rank of a position among the ones of its label is the prefix count of the
+    flows of the label, so that the flows in any range of edges are found
+    with two binary searches.
+    :attr_codes: The code of the label of each edge, -1 for none
+    :nb_attrs: The number of labels
+    :returns: The offsets of the positions of each label and the positions
+    """
+    order = np.argsort(attr_codes, kind="stable")
+    order = order[attr_codes[order] >= 0]
+
+    offsets = np.zeros(nb_attrs + 1, dtype=np.int32)
+    offsets[1:] = np.cumsum(np.bincount(attr_codes[order], minlength=nb_attrs))
+
+    return offsets, order.astype(np.int32)
+
+
+def count_attr_flows(
+    offsets: np.ndarray, positions: np.ndarray, code: int, first: int, last: int
+) -> int:
+    """Returns the number of flows of a label between two edge positions."""
+    label_positions = positions[offsets[code] : offsets[code + 1]]
+    return int(
+        np.searchsorted(label_positions, last) - np.searchsorted(label_positions, first)
+    )
+
+
+class GraphFilter:
+    """Pre-indexed arrays of the graph shown by the Displayer."""
+
+    def __init__(self, node_data: Dict[str, Any], edge_data: Dict[str, Any]) -> None:
+        """Index the columns of a graph renderer.
+        :node_data: The node columns
+        :edge_data: The edge columns, sorted by date and holding the start_idx
+        and end_idx columns added by displayer.index_edges
+        """
+        self.index = list(node_data["index"])
+        self.color = list(node_data["color"])
+        self.type = np.asarray(node_data["type"], dtype=np.int32)
+
+        self.start = list(edge_data["start"])
+        self.end = list(edge_data["end"])
+        self.start_idx = np.asarray(edge_data["start_idx"], dtype=np.int32)
+        self.end_idx = np.asarray(edge_data["end_idx"], dtype=np.int32)
+        self.date = np.asarray(edge_data["date"], dtype=np.float64)
+        self.count = np.asarray(edge_data["count"], dtype=np.float64)
+        self.ports = np.array(
+            [ports_to_mask(ports) for ports in edge_data["ports"]], dtype=np.int64
+        )
+
+        # Dictionary-encoded attribution labels
+        self.attrs, self.attr_codes = np.unique(
+            np.asarray(edge_data["attr"], dtype=object).astype(str), return_inverse=True
+        )
+        self.attr_ids = {attr: i for i, attr in enumerate(self.attrs)}
+        self.attr_offsets, self.attr_positions = index_attrs(
+            self.attr_codes, len(self.attrs)
+        )
+
+        self.student_idx = np.flatnonzero(self.type == STUDENT)
+
+    def window(self, date_from: float, date_to: float) -> Tuple[int, int]:
+        """Returns the range of edges dated between date_from and date_to."""
+        first = int(np.searchsorted(self.date, date_from, side="left"))
+        last = int(np.searchsorted(self.date, date_to, side="right"))
+        return first, max(first, last)
+
+    def filter(
+        self,
+        date_from: float,
+        date_to: float,
+        show_old: bool = True,
+        students: Optional[List[str]] = None,
+        min_count: int = 1,
+    ) -> Tuple[Dict[str, list], Dict[str, list], Dict[str, int]]:
+        """Computes the visible subgraph.
+        :date_from: The beginning of the selected date range, in ms
+        :date_to: The end of the selected date range, in ms
+        :show_old: Whether to show activities older than four days
+        :students: The students whose flows are shown, all if None
+        :min_count: The minimum number of packets of a node
+        :returns: The node columns, the edge columns and the number of flows of
+        each shown student
+        """
+        if not show_old:
+            date_from = date_to - 4 * ONE_DAY
+
+        first, last = self.window(date_from, date_to)
+
+        selected = np.arange(first, last)
+
+        if students is not None:
+            codes = [self.attr_ids[s] for s in students if s in self.attr_ids]
+            selected = selected[np.isin(self.attr_codes[selected], codes)]
+
+        nb_nodes = len(self.index)
+
+        start_idx = self.start_idx[selected]
+        end_idx = self.end_idx[selected]
+        count = self.count[selected]
+        date = self.date[selected]
+
+        seen = np.zeros(nb_nodes, dtype=bool)
+        seen[start_idx] = True
+        seen[end_idx] = True
+
+        node_count = np.bincount(start_idx, weights=count, minlength=nb_nodes)
+        node_count += np.bincount(end_idx, weights=count, minlength=nb_nodes)
+
+        node_max_date = np.full(nb_nodes, -np.inf)
+        np.maximum.at(node_max_date, start_idx, date)
+        np.maximum.at(node_max_date, end_idx, date)
+
+        node_ports = np.zeros(nb_nodes, dtype=np.int64)
+        np.bitwise_or.at(node_ports, end_idx, self.ports[selected])
+
+        # Students without flows are still shown, as long as they are selected
+        shown_students = self.student_idx
+        if students is not None:
+            wanted = set(students)
+            shown_students = np.array(
+                [i for i in self.student_idx if self.index[i] in wanted], dtype=np.int64
+            )
+        idle = shown_students[~seen[shown_students]]
+        seen[idle] = True
+        node_max_date[idle] = date_from - 3 * ONE_DAY
+
+        sum_count = node_count[seen].sum()
+
+        kept = seen & (node_count >= min_count)
+        kept_idx = np.flatnonzero(kept)
+
+        if sum_count > 0:
+            size = 20 * (1 + (node_count[kept_idx] / sum_count) * 4)
+        else:
+            size = np.full(len(kept_idx), 20.0)
+
+        age = date_to - node_max_date[kept_idx]
+        opacity = np.select(
+            [age >= 3 * ONE_DAY, age >= 2 * ONE_DAY, age >= ONE_DAY],
+            [0.25, 0.5, 0.75],
+            default=1.0,
+        )
+
+        node_data = {
+            "index": [self.index[i] for i in kept_idx],
+            "count": node_count[kept_idx].tolist(),
+            "size": size.tolist(),
+            "color": [self.color[i] for i in kept_idx],
+            "type": self.type[kept_idx].tolist(),
+            "opacity": opacity.tolist(),
+            "ports": [mask_to_services(int(node_ports[i])) for i in kept_idx],
+        }
+
+        shown = selected[kept[start_idx] & kept[end_idx]]
+
+        edge_data = {
+            "attr": [self.attrs[c] for c in self.attr_codes[shown]],
+            "date": self.date[shown].tolist(),
+            "start": [self.start[i] for i in shown],
+            "end": [self.end[i] for i in shown],
+        }
+
+        packets = {
+            self.index[i]: count_attr_flows(
+                self.attr_offsets,
+                self.attr_positions,
+                self.attr_ids[self.index[i]],
+                first,
+                last,
+            )
+            if self.index[i] in self.attr_ids
+            else 0
+            for i in shown_students
+        }
+
+        return node_data, edge_data, packets
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""This module keeps the state of the live mode of the Displayer. Newly
+attributed edges are turned into rows to stream into the data sources of the
+plot, and into patches of the nodes whose count changed, so that an update
+costs in proportion to the new edges. Only the most recent edges are kept,
+the counts of the dropped ones being taken back, and new nodes are placed
+around a known neighbour without moving the nodes already shown."""
+
+import math
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from graph_clusters import ring_position
+from ip_classifier import classify
+
+
+class LiveGraph:
+    """Rolling graph of the edges streamed to the live Displayer."""
+
+    def __init__(
+        self,
+        colors: np.ndarray,
+        pos: Optional[Dict[str, Tuple[float, float]]] = None,
+        max_edges: int = 10000,
+        spacing: float = 40.0,
+    ) -> None:
+        """Create an empty live graph.
+        :colors: The color of each category of ip_classifier
+        :pos: Positions of nodes known in advance
+        :max_edges: The number of most recent edges kept
+        :spacing: The distance between the nodes placed around a neighbour
+        """
+        self.colors = colors
+        self.pos = dict(pos or {})
+        self.max_edges = max_edges
+        self.spacing = spacing
+
+        # Row of each node in the node source
+        self.rows: Dict[str, int] = {}
+        self.count: List[float] = []
+
+        # Number of nodes already placed around each node
+        self.placed: Dict[Optional[str], int] = {}
+
+        # Rows of the nodes and count of the kept edges, oldest first
+        self.edges: Deque[Tuple[int, int, float]] = deque()
+
+    def place(self, node: str, anchor: Optional[str]) -> Tuple[float, float]:
+        """Places a new node on rings around a neighbour, or around the origin
+        if none is known yet."""
+
+        if node in self.pos:
+            return self.pos[node]
+
+        center = self.pos[anchor] if anchor in self.pos else (0.0, 0.0)
+
+        k = self.placed.get(anchor, 0)
+        self.placed[anchor] = k + 1
+
+        # At least a spacing away from the anchor, which is a host too
+        self.pos[node] = ring_position(center, k, self.spacing, offset=1.5)
+
+        return self.pos[node]
+
+    def update(
+        self, edges: List[Dict[str, Any]]
+    ) -> Tuple[Dict[str, list], Dict[str, list], Dict[str, List[Tuple[int, Any]]]]:
+        """Adds new edges to the graph.
+        :edges: The edges, as built by graph_cube.flow_edges
+        :returns: The node rows and the edge rows to stream, and the patches
+        of the nodes already streamed
+        """
+
+        nb_streamed = len(self.rows)
+
+        new_nodes: List[str] = []
+        touched = set()
+
+        edge_data: Dict[str, list] = {
+            key: [] for key in ("x0", "y0", "x1", "y1", "date", "attr", "count")
+        }
+
+        for edge in edges:
+            source, destination = edge["source"], edge["destination"]
+            count = edge.get("count", 1)
+
+            for node, neighbour in ((source, destination), (destination, source)):
+                if node not in self.rows:
+                    self.rows[node] = len(self.count)
+                    self.count.append(0)
+                    self.place(node, neighbour if neighbour in self.rows else None)
+                    new_nodes.append(node)
+
+            u, v = self.rows[source], self.rows[destination]
+            self.count[u] += count
+            self.count[v] += count
+            touched.update((u, v))
+
+            self.edges.append((u, v, count))
+
+            x0, y0 = self.pos[source]
+            x1, y1 = self.pos[destination]
+            for key, value in zip(
+                edge_data, (x0, y0, x1, y1, edge["date"], edge.get("attr"), count)
+            ):
+                edge_data[key].append(value)
+
+        # The sources drop the same oldest edges when streaming with rollover
+        while len(self.edges) > self.max_edges:
+            u, v, count = self.edges.popleft()
+            self.count[u] -= count
+            self.count[v] -= count
+            touched.update((u, v))
+
+        types = classify(new_nodes)
+
+        node_data = {
+            "index": new_nodes,
+            "x": [self.pos[node][0] for node in new_nodes],
+            "y": [self.pos[node][1] for node in new_nodes],
+            "color": self.colors[types].tolist(),
+            "type": types.tolist(),
+            "count": [self.count[self.rows[node]] for node in new_nodes],
+            "size": [node_size(self.count[self.rows[node]]) for node in new_nodes],
+            "opacity": [node_opacity(self.count[self.rows[node]]) for node in new_nodes],
+        }
+
+        patched = sorted(row for row in touched if row < nb_streamed)
+
+        patches = {
+            "count": [(row, self.count[row]) for row in patched],
+            "size": [(row, node_size(self.count[row])) for row in patched],
+            "opacity": [(row, node_opacity(self.count[row])) for row in patched],
+        }
+
+        return node_data, edge_data, patches
+
+
+def node_size(count: float) -> float:
+    """Size of a node, which only depends on its own count so that updates
+    never resize the other nodes."""
+    return 20 + 5 * math.log2(1 + count)
+
+
+def node_opacity(count: float) -> float:
+    """Nodes whose edges were all dropped are faded out."""
+    return 1.0 if count > 0 else 0.25
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""This module precomputes the frames of the playback mode of the Displayer.
+A window of fixed width slides over the dated edges, and each frame only
+holds what changed since the previous one : as edges are sorted by date, the
+edges entering and leaving the window are two ranges of edge positions, and
+the nodes whose count, size, opacity or visibility changed are stored in
+compressed rows, indexed by the frame offsets."""
+
+from typing import Any, Dict, Tuple
+
+import numpy as np
+from ip_classifier import STUDENT
+
+ONE_HOUR = 3600000
+ONE_DAY = 86400000
+
+
+def build_frames(
+    node_data: Dict[str, Any],
+    edge_data: Dict[str, Any],
+    step: int = ONE_HOUR,
+    width: int = 4 * ONE_DAY,
+) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """Computes the changes of the shown graph from one frame to the next.
+    The first frame is relative to an empty graph.
+    :node_data: The node columns
+    :edge_data: The edge columns, sorted by date and holding the start_idx
+    and end_idx columns added by displayer.index_edges
+    :step: The time between two frames, in ms
+    :width: The width of the shown window, in ms
+    :returns: The frame columns (time, ranges of the edges entering and
+    leaving the window, offsets of the node changes) and the node changes
+    (node position and new count, size, opacity and visibility)
+    """
+    date = np.asarray(edge_data["date"], dtype=np.float64)
+    start_idx = np.asarray(edge_data["start_idx"], dtype=np.int64)
+    end_idx = np.asarray(edge_data["end_idx"], dtype=np.int64)
+    count = np.asarray(edge_data["count"], dtype=np.float64)
+
+    nb_nodes = len(node_data["index"])
+    student_idx = np.flatnonzero(np.asarray(node_data["type"]) == STUDENT)
+
+    if len(date):
+        times = np.arange(date[0], date[-1] + step, step, dtype=np.float64)
+    else:
+        times = np.zeros(1)
+
+    # The window of a frame holds the edges dated between time - width and time
+    hi = np.searchsorted(date, times, side="right")
+    lo = np.searchsorted(date, times - width, side="left")
+
+    nb_frames = len(times)
+
+    # Sizes are relative to the busiest frame, so that they can be compared
+    cum_count = np.concatenate([[0.0], np.cumsum(count)])
+    scale = 2 * (cum_count[hi] - cum_count[lo]).max()
+
+    is_student = np.zeros(nb_nodes, dtype=bool)
+    is_student[student_idx] = True
+
+    # Hidden nodes hold the opacity of nodes without recent flows
+    prev_count = np.zeros(nb_nodes)
+    prev_opacity = np.full(nb_nodes, 0.25)
+    prev_shown = np.zeros(nb_nodes, dtype=bool)
+
+    offsets = np.zeros(nb_frames + 1, dtype=np.int32)
+    deltas = []
+
+    for f in range(nb_frames):
+        window = slice(lo[f], hi[f])
+
+        node_count = np.bincount(start_idx[window], weights=count[window], minlength=nb_nodes)
+        node_count += np.bincount(end_idx[window], weights=count[window], minlength=nb_nodes)
+
+        node_max_date = np.full(nb_nodes, -np.inf)
+        np.maximum.at(node_max_date, start_idx[window], date[window])
+        np.maximum.at(node_max_date, end_idx[window], date[window])
+
+        # Students are shown even without flows, like in the filtered views
+        shown = np.isfinite(node_max_date) | is_student
+
+        age = times[f] - node_max_date
+        opacity = np.select(
+            [age >= 3 * ONE_DAY, age >= 2 * ONE_DAY, age >= ONE_DAY],
+            [0.25, 0.5, 0.75],
+            default=1.0,
+        )
+
+        changed = np.flatnonzero(
+            (node_count != prev_count) | (opacity != prev_opacity) | (shown != prev_shown)
+        )
+
+        deltas.append((changed, node_count[changed], opacity[changed], shown[changed]))
+        offsets[f + 1] = offsets[f] + len(changed)
+
+        prev_count, prev_opacity, prev_shown = node_count, opacity, shown
+
+    nodes = np.concatenate([d[0] for d in deltas])
+    node_count = np.concatenate([d[1] for d in deltas])
+
+    if scale > 0:
+        size = 20 * (1 + (node_count / scale) * 4)
+    else:
+        size = np.full(len(node_count), 20.0)
+
+    frame_data = {
+        "time": times,
+        "enter_lo": np.concatenate([lo[:1], hi[:-1]]).astype(np.int32),
+        "enter_hi": hi.astype(np.int32),
+        "leave_lo": np.concatenate([lo[:1], lo[:-1]]).astype(np.int32),
+        "leave_hi": lo.astype(np.int32),
+        "node_lo": offsets[:-1],
+        "node_hi": offsets[1:],
+    }
+
+    delta_data = {
+        "node": nodes.astype(np.int32),
+        "count": node_count,
+        "size": size,
+        "opacity": np.concatenate([d[2] for d in deltas]),
+        "shown": np.concatenate([d[3] for d in deltas]).astype(np.int8),
+    }
+
+    return frame_data, delta_data
@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+
+"""This module abstracts the storage of the attribution graph, the hosts
+linked by TRANSPORT relationships, so that the attribution algorithms run
+the same against Neo4j or against an in-memory store. The in-memory store
+keeps the relationships in columns with adjacency lists of positions, which
+makes it a fast path for small worlds and allows running the algorithms
+without a Bolt server."""
+
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from neo4j_writer import write_rows
+
+Relationships = Dict[str, List[Dict[str, Any]]]
+
+# Time window of the relationships to consider, as the inclusive start and
+# the exclusive end of their event_start, or None for every relationship
+Window = Optional[Tuple[str, str]]
+
+# Properties of the relationships, as written by neo4j_writer
+RELATIONSHIP_PROPERTIES = [
+    "source_port",
+    "destination_port",
+    "transport",
+    "attribution_label",
+    "event_start",
+    "event_end",
+    "count",
+    "source_ports",
+    "destination_ports",
+]
+
+
+class GraphStore(ABC):
+    """Storage of the hosts and of the TRANSPORT relationships between them."""
+
+    @abstractmethod
+    def upsert_nodes(self, nodes: Iterable[Dict[str, Any]]) -> None:
+        """Creates the hosts that do not exist yet.
+        :nodes: The hosts, with their name and hostname
+        """
+
+    @abstractmethod
+    def insert_relationships(
+        self, rows: Iterable[Dict[str, Any]], source_prefix: Optional[str] = "w1-s"
+    ) -> None:
+        """Creates relationships, and the hosts they link if needed.
+        :rows: The relationships, as built by neo4jtest.packet_to_row
+        :source_prefix: The prefix of the students' hosts, whose relationships
+        are attributed to them, None to keep the labels of the rows
+        """
+
+    @abstractmethod
+    def nodes(self) -> Iterable[Dict[str, Any]]:
+        """Returns the hosts, with their name and hostname."""
+
+    @abstractmethod
+    def relationships(self, window: Window = None) -> Iterable[Dict[str, Any]]:
+        """Returns every relationship, with its id, the names of the hosts it
+        links as source_ip and destination_ip, and its properties."""
+
+    @abstractmethod
+    def get_relationships(
+        self, node_names: List[str], window: Window = None
+    ) -> Tuple[Relationships, Relationships]:
+        """Returns the incoming and outgoing relationships of several hosts.
+        The outgoing ones hold the name of the host they go to as target.
+        :returns: The incoming and the outgoing relationships, keyed by name
+        """
+
+    def neighbours(
+        self, node_names: List[str], window: Window = None
+    ) -> Dict[str, List[str]]:
+        """Returns the hosts the relationships of several hosts go to."""
+        _, outgoing = self.get_relationships(node_names, window)
+        return {name: [rel["target"] for rel in rels] for name, rels in outgoing.items()}
+
+    @abstractmethod
+    def set_relationship_properties(self, key: str, values: Dict[int, Any]) -> None:
+        """Sets a property of several relationships at once.
+        :key: The name of the property
+        :values: The new values, keyed by relationship id
+        """
+
+    @abstractmethod
+    def set_initial_attribution_labels(
+        self, source_prefix: str, window: Window = None
+    ) -> None:
+        """Attributes the relationships from the students' hosts to them."""
+
+    @abstractmethod
+    def merge_edges(self, window: Window = None) -> int:
+        """Merges the unattributed relationships with the same hosts and
+        transport into one relationship holding their ports and the sum of
+        their counts, starting with the first of them and ending with the
+        last.
+        :returns: The number of merged relationships
+        """
+
+
+def window_predicate(window: Window, variable: str = "r") -> str:
+    """Cypher predicate restricting relationships to a window, written as a
+    range on event_start so that it is answered by the range index."""
+    if window is None:
+        return "true"
+    return f"{variable}.event_start >= $window_start AND {variable}.event_start < $window_end"
+
+
+def window_parameters(window: Window) -> Dict[str, Optional[str]]:
+    start, end = window or (None, None)
+    return {"window_start": start, "window_end": end}
+
+
+def in_window(event_start: Optional[str], window: Window) -> bool:
+    if window is None:
+        return True
+    return event_start is not None and window[0] <= event_start < window[1]
+
+
+class Neo4jGraphStore(GraphStore):
+    """Graph store backed by a Neo4j session."""
+
+    def __init__(self, session) -> None:
+        self.session = session
+
+    def upsert_nodes(self, nodes: Iterable[Dict[str, Any]]) -> None:
+        self.session.run("""
+            UNWIND $nodes AS node
+            MERGE (n:IP {name: node.name})
+            ON CREATE SET n.hostname = node.hostname
+        """, nodes=list(nodes)).consume()
+
+    def insert_relationships(
+        self, rows: Iterable[Dict[str, Any]], source_prefix: Optional[str] = "w1-s"
+    ) -> None:
+        # An empty prefix never matches, as no host has an empty name
+        self.session.execute_write(write_rows, list(rows), source_prefix or "\0")
+
+    def nodes(self) -> Iterable[Dict[str, Any]]:
+        for record in self.session.run("""
+            MATCH (n:IP) RETURN n.name AS name, n.hostname AS hostname
+        """):
+            yield record.data()
+
+    def relationships(self, window: Window = None) -> Iterable[Dict[str, Any]]:
+        for record in self.session.run(f"""
+            MATCH (a:IP)-[r:TRANSPORT]->(b:IP)
+            WHERE {window_predicate(window)}
+            RETURN ID(r) AS id, a.name AS source_ip, b.name AS destination_ip, r.source_port AS source_port, r.destination_port AS destination_port, r.transport AS transport, r.attribution_label AS attribution_label, r.event_start AS event_start, r.event_end AS event_end, r.count AS count, r.source_ports AS source_ports, r.destination_ports AS destination_ports
+        """, **window_parameters(window)):
+            yield record.data()
+
+    def get_relationships(
+        self, node_names: List[str], window: Window = None
+    ) -> Tuple[Relationships, Relationships]:
+        records = self.session.run(f"""
+            UNWIND $node_names AS node_name
+            MATCH (n:IP {{name: node_name}})<-[r:TRANSPORT]-()
+            WHERE {window_predicate(window)}
+            RETURN node_name, false AS outgoing, ID(r) AS id, r.source_port AS source_port, r.destination_port AS destination_port, r.transport AS transport, r.attribution_label AS attribution_label, r.event_start AS event_start, null AS target
+            UNION ALL
+            UNWIND $node_names AS node_name
+            MATCH (n:IP {{name: node_name}})-[r:TRANSPORT]->(m:IP)
+            WHERE {window_predicate(window)}
+            RETURN node_name, true AS outgoing, ID(r) AS id, r.source_port AS source_port, r.destination_port AS destination_port, r.transport AS transport, r.attribution_label AS attribution_label, r.event_start AS event_start, m.name AS target
+        """, node_names=list(node_names), **window_parameters(window)).data()
+
+        incoming: Relationships = {node_name: [] for node_name in node_names}
+        outgoing: Relationships = {node_name: [] for node_name in node_names}
+
+        for record in records:
+            rels = outgoing if record["outgoing"] else incoming
+            rels[record["node_name"]].append(record)
+
+        return incoming, outgoing
+
+    def set_relationship_properties(self, key: str, values: Dict[int, Any]) -> None:
+        if not values:
+            return
+
+        self.session.run("""
+            UNWIND $updates AS update
+            MATCH ()-[r:TRANSPORT]->() WHERE ID(r) = update.id
+            SET r += update.properties
+        """, updates=[
+            {"id": id, "properties": {key: value}} for id, value in values.items()
+        ]).consume()
+
+    def set_initial_attribution_labels(
+        self, source_prefix: str, window: Window = None
+    ) -> None:
+        self.session.run(f"""
+            MATCH (source:IP)-[r:TRANSPORT]->(target:IP)
+            WHERE source.name STARTS WITH $source_prefix AND {window_predicate(window)}
+            SET r.attribution_label = source.name
+        """, source_prefix=source_prefix, **window_parameters(window)).consume()
+
+    def merge_edges(self, window: Window = None) -> int:
+        result = self.session.run(f"""
+            MATCH (a:IP)-[r:TRANSPORT]->(b:IP)
+            WHERE r.attribution_label = 'unknown' AND {window_predicate(window)}
+            WITH a, b, r.transport as transport, collect(r) as edges,
+                min(r.event_start) as event_start, max(r.event_end) as event_end,
+                sum(coalesce(r.count, 1)) as count
+            WHERE size(edges) > 1
+            CREATE (a)-[merged:TRANSPORT {{
+                transport: transport,
+                attribution_label: 'unknown',
+                event_start: event_start,
+                event_end: event_end,
+                count: count,
+                source_ports: [x in edges WHERE x.source_port IS NOT NULL | x.source_port],
+                destination_ports: [x in edges WHERE x.destination_port IS NOT NULL | x.destination_port]
+            }}]->(b)
+            FOREACH (r IN edges | DELETE r)
+            RETURN a, b, transport, size(edges) as merged_count
+        """, **window_parameters(window))
+
+        return sum(record["merged_count"] for record in result)
+
+
+class MemoryGraphStore(GraphStore):
+    """Graph store keeping the graph in memory. Relationships are stored in
+    columns, indexed by their position, with the positions of the incoming
+    and outgoing relationships of each host."""
+
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.hostnames: List[Optional[str]] = []
+        self.node_ids: Dict[str, int] = {}
+
+        self.in_rels: List[List[int]] = []
+        self.out_rels: List[List[int]] = []
+
+        self.ids: List[int] = []
+        self.source: List[int] = []
+        self.target: List[int] = []
+        self.alive: List[bool] = []
+        self.columns: Dict[str, List[Any]] = {key: [] for key in RELATIONSHIP_PROPERTIES}
+
+        # Position of each relationship id
+        self.positions: Dict[int, int] = {}
+
+    @classmethod
+    def copy(cls, store: GraphStore, window: Window = None) -> "MemoryGraphStore":
+        """Loads the graph of another store, or its relationships within a
+        window, keeping their ids so that changes can be written back to it."""
+        memory = cls()
+        if window is None:
+            memory.upsert_nodes(store.nodes())
+        memory.insert_relationships(store.relationships(window), source_prefix=None)
+        return memory
+
+    def add_node(self, name: str, hostname: Optional[str] = None) -> int:
+        if name not in self.node_ids:
+            self.node_ids[name] = len(self.names)
+            self.names.append(name)
+            self.hostnames.append(hostname)
+            self.in_rels.append([])
+            self.out_rels.append([])
+        return self.node_ids[name]
+
+    def upsert_nodes(self, nodes: Iterable[Dict[str, Any]]) -> None:
+        for node in nodes:
+            self.add_node(node["name"], node.get("hostname"))
+
+    def add_relationship(
+        self, source: int, target: int, properties: Dict[str, Any], id: Optional[int] = None
+    ) -> int:
+        position = len(self.ids)
+        id = position if id is None else id
+
+        self.ids.append(id)
+        self.source.append(source)
+        self.target.append(target)
+        self.alive.append(True)
+        for key, column in self.columns.items():
+            column.append(properties.get(key))
+
+        self.positions[id] = position
+        self.out_rels[source].append(position)
+        self.in_rels[target].append(position)
+
+        return id
+
+    def insert_relationships(
+        self, rows: Iterable[Dict[str, Any]], source_prefix: Optional[str] = "w1-s"
+    ) -> None:
+        for row in rows:
+            source = self.add_node(row["source_ip"], row.get("source_hostname"))
+            target = self.add_node(row["destination_ip"], row.get("destination_hostname"))
+
+            properties = dict(row)
+            if source_prefix and row["source_ip"].startswith(source_prefix):
+                properties["attribution_label"] = row["source_ip"]
+
+            self.add_relationship(source, target, properties, row.get("id"))
+
+    def nodes(self) -> Iterable[Dict[str, Any]]:
+        for name, hostname in zip(self.names, self.hostnames):
+            yield {"name": name, "hostname": hostname}
+
+    def relationship(self, position: int) -> Dict[str, Any]:
+        rel = {key: column[position] for key, column in self.columns.items()}
+        rel["id"] = self.ids[position]
+        return rel
+
+    def in_window(self, position: int, window: Window) -> bool:
+        return self.alive[position] and in_window(
+            self.columns["event_start"][position], window
+        )
+
+    def relationships(self, window: Window = None) -> Iterable[Dict[str, Any]]:
+        for position in range(len(self.ids)):
+            if self.in_window(position, window):
+                rel = self.relationship(position)
+                rel["source_ip"] = self.names[self.source[position]]
+                rel["destination_ip"] = self.names[self.target[position]]
+                yield rel
+
+    def get_relationships(
+        self, node_names: List[str], window: Window = None
+    ) -> Tuple[Relationships, Relationships]:
+        incoming: Relationships = {node_name: [] for node_name in node_names}
+        outgoing: Relationships = {node_name: [] for node_name in node_names}
+
+        for node_name in node_names:
+            node = self.node_ids.get(node_name)
+            if node is None:
+                continue
+
+            for position in self.in_rels[node]:
+                if self.in_window(position, window):
+                    rel = self.relationship(position)
+                    rel.update(node_name=node_name, outgoing=False, target=None)
+                    incoming[node_name].append(rel)
+
+            for position in self.out_rels[node]:
+                if self.in_window(position, window):
+                    rel = self.relationship(position)
+                    rel.update(
+                        node_name=node_name,
+                        outgoing=True,
+                        target=self.names[self.target[position]],
+                    )
+                    outgoing[node_name].append(rel)
+
+        return incoming, outgoing
+
+    def set_relationship_properties(self, key: str, values: Dict[int, Any]) -> None:
+        column = self.columns[key]
+        for id, value in values.items():
+            column[self.positions[id]] = value
+
+    def set_initial_attribution_labels(
+        self, source_prefix: str, window: Window = None
+    ) -> None:
+        labels = self.columns["attribution_label"]
+        for position, source in enumerate(self.source):
+            if self.names[source].startswith(source_prefix) and self.in_window(
+                position, window
+            ):
+                labels[position] = self.names[source]
+
+    def delete_relationships(self, positions: List[int]) -> None:
+        for position in positions:
+            self.alive[position] = False
+            del self.positions[self.ids[position]]
+
+    def merge_edges(self, window: Window = None) -> int:
+        groups = defaultdict(list)
+
+        for position in range(len(self.ids)):
+            if (
+                self.in_window(position, window)
+                and self.columns["attribution_label"][position] == "unknown"
+            ):
+                key = (
+                    self.source[position],
+                    self.target[position],
+                    self.columns["transport"][position],
+                )
+                groups[key].append(position)
+
+        merged_count = 0
+        next_id = max(self.ids, default=-1) + 1
+
+        for (source, target, transport), positions in groups.items():
+            if len(positions) < 2:
+                continue
+
+            source_ports = [self.columns["source_port"][p] for p in positions]
+            destination_ports = [self.columns["destination_port"][p] for p in positions]
+            starts = [self.columns["event_start"][p] for p in positions]
+            ends = [self.columns["event_end"][p] for p in positions]
+            counts = [self.columns["count"][p] for p in positions]
+
+            self.delete_relationships(positions)
+            self.add_relationship(
+                source,
+                target,
+                {
+                    "transport": transport,
+                    "attribution_label": "unknown",
+                    "event_start": min((t for t in starts if t is not None), default=None),
+                    "event_end": max((t for t in ends if t is not None), default=None),
+                    "count": sum(1 if c is None else c for c in counts),
+                    "source_ports": [p for p in source_ports if p is not None],
+                    "destination_ports": [p for p in destination_ports if p is not None],
+                },
+                next_id,
+            )
+            next_id += 1
+
+            merged_count += len(positions)
+
+        return merged_count
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""This module classifies the hosts of the network by IP range. IPs are
+converted once to 32-bit integers, and whole arrays of them are matched
+against a table of CIDR ranges with numpy, so that the Displayer and the
+attributor share the same categories without running a regex per host."""
+
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+RANGE1, RANGE2, STUDENT, OTHER = 1, 2, 3, 4
+
+# Ranges of the categories, the first matching range wins
+RANGES: List[Tuple[str, int]] = [
+    ("192.168.0.0/24", STUDENT),
+    ("10.0.0.0/22", RANGE1),
+    ("10.0.4.0/22", RANGE2),
+]
+
+
+def parse_cidr(cidr: str) -> Tuple[int, int]:
+    """Returns the network and the netmask of a CIDR range as integers."""
+    ip, prefix = cidr.split("/")
+    mask = (0xFFFFFFFF << (32 - int(prefix))) & 0xFFFFFFFF
+    return ip_to_int(ip) & mask, mask
+
+
+def ip_to_int(ip: str) -> int:
+    """Converts a dotted IPv4 address to an integer, or -1 if it is not one."""
+    octets = ip.split(".")
+    if len(octets) != 4:
+        return -1
+    value = 0
+    for octet in octets:
+        if not (octet.isdigit() and len(octet) <= 3 and int(octet) <= 255):
+            return -1
+        value = value << 8 | int(octet)
+    return value
+
+
+def ips_to_array(ips: Iterable[str]) -> np.ndarray:
+    """Converts IPs to an array of integers, -1 standing for invalid IPs."""
+    return np.fromiter((ip_to_int(ip) for ip in ips), dtype=np.int64)
+
+
+NETWORKS = np.array([parse_cidr(cidr)[0] for cidr, _ in RANGES], dtype=np.int64)
+NETMASKS = np.array([parse_cidr(cidr)[1] for cidr, _ in RANGES], dtype=np.int64)
+CODES = np.array([code for _, code in RANGES] + [OTHER], dtype=np.int8)
+
+
+def classify_array(ips: np.ndarray) -> np.ndarray:
+    """Returns the category of each IP of an array built by ips_to_array."""
+    matches = (ips[:, None] & NETMASKS) == NETWORKS
+    matches &= (ips >= 0)[:, None]
+    # Index of the first matching range, or of OTHER if there is none
+    first = np.where(matches.any(axis=1), matches.argmax(axis=1), len(RANGES))
+    return CODES[first]
+
+
+def classify(ips: Iterable[str]) -> np.ndarray:
+    """Returns the category of each IP."""
+    return classify_array(ips_to_array(ips))
+
+
+def students(ips: Iterable[str]) -> List[str]:
+    """Returns the IPs belonging to the students' range."""
+    ips = list(ips)
+    return [ip for ip, code in zip(ips, classify(ips).tolist()) if code == STUDENT]
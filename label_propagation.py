@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""This module propagates the attribution labels of the relationships of a
+graph_store.GraphStore. A relationship going out of a host takes the label
+of the latest relationship with the same ports and transport that came into
+it before, and labels flow from host to host, level by level."""
+
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+from graph_store import GraphStore, MemoryGraphStore, Window
+
+
+def relationship_key(rel: Dict[str, Any]) -> Tuple:
+    return (rel["source_port"], rel["destination_port"], rel["transport"])
+
+
+def start_order(rel: Dict[str, Any]) -> Tuple:
+    """Sort key of the start of a relationship, unknown starts coming first."""
+    return (0, "") if rel["event_start"] is None else (1, rel["event_start"])
+
+
+def match_relationships(
+    incoming_rels: List[Dict[str, Any]], outgoing_rels: List[Dict[str, Any]]
+) -> Dict[int, str]:
+    """Matches the incoming and outgoing relationships of a node with the same
+    ports and transport, with a hash join. An outgoing relationship takes the
+    label of the latest matching incoming one started before it.
+    :returns: The new attribution label of the matched outgoing relationships,
+    keyed by relationship id
+    """
+    incoming_by_key = defaultdict(list)
+
+    for incoming_rel in incoming_rels:
+        incoming_by_key[relationship_key(incoming_rel)].append(incoming_rel)
+
+    starts = {}
+
+    for key, rels in incoming_by_key.items():
+        rels.sort(key=start_order)
+        starts[key] = [start_order(rel) for rel in rels]
+
+    labels = {}
+
+    for outgoing_rel in outgoing_rels:
+        key = relationship_key(outgoing_rel)
+
+        rels = incoming_by_key.get(key)
+        if not rels:
+            continue
+
+        if outgoing_rel["event_start"] is None:
+            preceding = len(rels)
+        else:
+            preceding = bisect_left(starts[key], start_order(outgoing_rel))
+
+        if preceding:
+            labels[outgoing_rel["id"]] = rels[preceding - 1]["attribution_label"]
+
+    return labels
+
+
+def set_attribution_label(
+    store: GraphStore, node_name: str, window: Window = None
+) -> bool:
+    """Labels the outgoing relationships of a node from its incoming ones.
+    :window: The window of the relationships to consider
+    :returns: Whether a relationship was labelled
+    """
+    incoming, outgoing = store.get_relationships([node_name], window)
+
+    labels = match_relationships(incoming[node_name], outgoing[node_name])
+
+    store.set_relationship_properties("attribution_label", labels)
+
+    return bool(labels)
+
+
+def propagate_labels(store: GraphStore, node_name: str, window: Window = None) -> None:
+    """Propagates the attribution labels from a node, level by level. Each
+    level is read at once and its labels written at once, and a node is only
+    visited once, so that the number of round trips grows with the depth of
+    the graph.
+    :node_name: The node to start from, whose neighbours are all visited
+    :window: The window of the relationships to consider, others being
+    neither read nor labelled
+    """
+
+    visited = {node_name}
+    level = [node_name]
+
+    while level:
+
+        incoming, outgoing = store.get_relationships(level, window)
+
+        labels = {}
+        frontier = set()
+
+        for name in level:
+            matched = match_relationships(incoming[name], outgoing[name])
+            labels.update(matched)
+
+            # Only nodes where labels went through are propagated from
+            if matched or name == node_name:
+                frontier.update(rel["target"] for rel in outgoing[name])
+
+        store.set_relationship_properties("attribution_label", labels)
+
+        level = sorted(frontier - visited)
+        visited.update(level)
+
+
+def propagate_labels_in_memory(
+    store: GraphStore, node_name: str, window: Window = None
+) -> int:
+    """Propagates the attribution labels on an in-memory copy of a store, then
+    writes the changed labels back to it in one batch. For small worlds, or
+    short windows, this replaces a round trip per level with one read and
+    one write.
+    :window: The window of the relationships to copy
+    :returns: The number of relationships whose label changed
+    """
+    memory = MemoryGraphStore.copy(store, window)
+    labels = list(memory.columns["attribution_label"])
+
+    propagate_labels(memory, node_name)
+
+    changed = {
+        memory.ids[position]: label
+        for position, label in enumerate(memory.columns["attribution_label"])
+        if label != labels[position]
+    }
+
+    store.set_relationship_properties("attribution_label", changed)
+
+    return len(changed)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""This module exports packet rows to CSV files in the format of
+`neo4j-admin database import full`, for rebuilding the attribution graph
+offline instead of through transactions. Rows are streamed : nodes are
+written the first time their name is met, and relationships are split over
+files of bounded size, so that memory only grows with the number of
+hosts."""
+
+import csv
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+from twmn_helpers.logging import Logging
+
+l = Logging(__name__)
+
+NODE_HEADER = ["name:ID(IP)", "hostname"]
+
+RELATIONSHIP_HEADER = [
+    ":START_ID(IP)",
+    ":END_ID(IP)",
+    ":TYPE",
+    "name",
+    "transport",
+    "source_port:int",
+    "destination_port:int",
+    "attribution_label",
+    "event_start",
+    "event_end",
+    "count:int",
+]
+
+
+class CsvExporter:
+    """Writes packet rows to node and relationship CSV files."""
+
+    def __init__(
+        self,
+        directory: str,
+        source_prefix: str = "w1-s",
+        max_rows_per_file: int = 1000000,
+    ) -> None:
+        """Create an exporter.
+        :directory: The directory of the CSV files, created if needed
+        :source_prefix: The prefix of the names of the students' hosts, whose
+        relationships are attributed to them like by neo4j_writer
+        :max_rows_per_file: The number of relationships per CSV file
+        """
+        self.directory = directory
+        self.source_prefix = source_prefix
+        self.max_rows_per_file = max_rows_per_file
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.seen = set()
+        self.nb_nodes = 0
+        self.nb_relationships = 0
+
+        self.relationship_files: List[str] = []
+        self.relationship_file = None
+        self.relationship_writer = None
+
+        self.write_header("nodes_header.csv", NODE_HEADER)
+        self.write_header("relationships_header.csv", RELATIONSHIP_HEADER)
+
+        self.node_file = open(os.path.join(directory, "nodes.csv"), "w", newline="")
+        self.node_writer = csv.writer(self.node_file)
+
+    def write_header(self, file_name: str, header: List[str]) -> None:
+        with open(os.path.join(self.directory, file_name), "w", newline="") as f:
+            csv.writer(f).writerow(header)
+
+    def add_node(self, name: str, hostname: Optional[str]) -> None:
+        """Writes a node, unless it was already written. As with MERGE, the
+        first hostname met is kept."""
+        if name not in self.seen:
+            self.seen.add(name)
+            self.node_writer.writerow([name, hostname or name])
+            self.nb_nodes += 1
+
+    def next_relationship_file(self) -> None:
+        if self.relationship_file:
+            self.relationship_file.close()
+
+        file_name = f"relationships_{len(self.relationship_files):04d}.csv"
+        self.relationship_files.append(file_name)
+
+        self.relationship_file = open(
+            os.path.join(self.directory, file_name), "w", newline=""
+        )
+        self.relationship_writer = csv.writer(self.relationship_file)
+
+    def add(self, row: Dict[str, Any]) -> None:
+        """Writes a packet row, as built by neo4jtest.packet_to_row."""
+        source, destination = row["source_ip"], row["destination_ip"]
+
+        self.add_node(source, row.get("source_hostname"))
+        self.add_node(destination, row.get("destination_hostname"))
+
+        if self.nb_relationships % self.max_rows_per_file == 0:
+            self.next_relationship_file()
+
+        if source.startswith(self.source_prefix):
+            attribution_label = source
+        else:
+            attribution_label = row.get("attribution_label", "unknown")
+
+        self.relationship_writer.writerow([
+            source,
+            destination,
+            "TRANSPORT",
+            row["transport"],
+            row["transport"],
+            row.get("source_port"),
+            row.get("destination_port"),
+            attribution_label,
+            row.get("event_start"),
+            row.get("event_end"),
+            row.get("count", 1),
+        ])
+        self.nb_relationships += 1
+
+    def close(self) -> None:
+        self.node_file.close()
+        if self.relationship_file:
+            self.relationship_file.close()
+
+        l.info(
+            f"{self.nb_nodes} nodes and {self.nb_relationships} relationships "
+            f"exported to {self.directory}"
+        )
+
+    def __enter__(self) -> "CsvExporter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def import_command(self, database: str = "neo4j") -> List[str]:
+        """Returns the command importing the exported files into an empty,
+        stopped database."""
+        relationship_files = ",".join(
+            [os.path.join(self.directory, "relationships_header.csv")]
+            + [os.path.join(self.directory, f) for f in self.relationship_files]
+        )
+        return [
+            "neo4j-admin",
+            "database",
+            "import",
+            "full",
+            "--overwrite-destination",
+            f"--nodes=IP={os.path.join(self.directory, 'nodes_header.csv')},"
+            f"{os.path.join(self.directory, 'nodes.csv')}",
+            f"--relationships=TRANSPORT={relationship_files}",
+            database,
+        ]
+
+
+def export_rows(
+    rows: Iterable[Dict[str, Any]],
+    directory: str,
+    source_prefix: str = "w1-s",
+    max_rows_per_file: int = 1000000,
+) -> List[str]:
+    """Exports packet rows to CSV files.
+    :returns: The command importing them
+    """
+    with CsvExporter(directory, source_prefix, max_rows_per_file) as exporter:
+        for row in rows:
+            exporter.add(row)
+
+    return exporter.import_command()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+"""This module ingests packets into Neo4j with a pipeline. A reader thread
+scans Elasticsearch and puts batches of rows in a bounded queue, which
+writer threads drain, each with its own session. The waits of the two sides
+overlap, and when the writers fall behind the full queue blocks the reader
+instead of buffering the whole scan."""
+
+import time
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from neo4j_writer import write_rows
+from twmn_helpers.logging import Logging
+
+l = Logging(__name__)
+
+
+class StageMetrics:
+    """Throughput of a stage of the pipeline. Busy time is spent working,
+    blocked time waiting on the queue."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.items = 0
+        self.batches = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.start = time.monotonic()
+        self.end: Optional[float] = None
+        self.lock = Lock()
+
+    def add(self, items: int, busy: float, blocked: float) -> None:
+        with self.lock:
+            self.items += items
+            self.batches += 1
+            self.busy += busy
+            self.blocked += blocked
+
+    def stop(self) -> None:
+        self.end = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.end or time.monotonic()) - self.start
+
+    @property
+    def rate(self) -> float:
+        """Items per second over the life of the stage."""
+        return self.items / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.items} items in {self.batches} batches, "
+            f"{self.rate:.0f} items/s, busy {self.busy:.1f}s, "
+            f"blocked {self.blocked:.1f}s"
+        )
+
+
+class IngestPipeline:
+    """Pipeline from an iterable of hits to Neo4j relationships."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Any],
+        to_row: Callable[[Any], Dict[str, Any]],
+        nb_writers: int = 2,
+        queue_size: int = 8,
+        batch_size: int = 5000,
+        flush_interval: float = 5.0,
+        source_prefix: str = "w1-s",
+    ) -> None:
+        """Create a pipeline.
+        :session_factory: Opens a Neo4j session, called once per writer as
+        sessions cannot be shared between threads
+        :to_row: Converts a hit to the row of a relationship
+        :nb_writers: The number of writer threads
+        :queue_size: The number of batches buffered between the stages
+        :batch_size: The number of rows written per transaction
+        :flush_interval: The maximum time (in seconds) a row stays buffered
+        :source_prefix: The prefix of the names of the students' hosts
+        """
+        self.session_factory = session_factory
+        self.to_row = to_row
+        self.nb_writers = nb_writers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.source_prefix = source_prefix
+
+        self.queue: Queue = Queue(maxsize=queue_size)
+        self.stopped = Event()
+        self.errors: List[BaseException] = []
+
+        self.reader_metrics = StageMetrics("reader")
+        self.writer_metrics = StageMetrics("writers")
+
+    def put(self, item: Optional[List[Dict[str, Any]]]) -> bool:
+        """Puts a batch or a sentinel in the queue, blocking while it is full.
+        :returns: Whether the batch was queued before the pipeline stopped
+        """
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except Full:
+                continue
+        return False
+
+    def read(self, hits: Iterable[Any]) -> None:
+        """Reads the hits and queues them in batches, then queues one sentinel
+        per writer."""
+        rows: List[Dict[str, Any]] = []
+        last_put = time.monotonic()
+        busy = time.monotonic()
+
+        try:
+            for h in hits:
+                if self.stopped.is_set():
+                    return
+
+                rows.append(self.to_row(h))
+
+                if (
+                    len(rows) >= self.batch_size
+                    or time.monotonic() - last_put >= self.flush_interval
+                ):
+                    blocked = time.monotonic()
+                    if not self.put(rows):
+                        return
+                    last_put = time.monotonic()
+
+                    self.reader_metrics.add(len(rows), blocked - busy, last_put - blocked)
+                    rows = []
+                    busy = last_put
+
+            if rows and self.put(rows):
+                self.reader_metrics.add(len(rows), time.monotonic() - busy, 0.0)
+
+        except BaseException as e:
+            self.fail(e)
+
+        finally:
+            self.reader_metrics.stop()
+            for _ in range(self.nb_writers):
+                self.put(None)
+
+    def write(self) -> None:
+        """Writes the queued batches until a sentinel is met."""
+        try:
+            with self.session_factory() as session:
+                while not self.stopped.is_set():
+                    blocked = time.monotonic()
+                    try:
+                        rows = self.queue.get(timeout=0.5)
+                    except Empty:
+                        continue
+
+                    if rows is None:
+                        return
+
+                    busy = time.monotonic()
+                    session.execute_write(write_rows, rows, self.source_prefix)
+                    self.writer_metrics.add(
+                        len(rows), time.monotonic() - busy, busy - blocked
+                    )
+
+        except BaseException as e:
+            self.fail(e)
+
+    def fail(self, error: BaseException) -> None:
+        """Stops every stage after an error."""
+        l.error(f"Ingest pipeline stopped: {error!r}")
+        self.errors.append(error)
+        self.stopped.set()
+
+    def run(self, hits: Iterable[Any]) -> int:
+        """Ingests hits, until they are exhausted or a stage fails.
+        :returns: The number of relationships written
+        """
+        writers = [
+            Thread(target=self.write, name=f"neo4j-writer-{i}", daemon=True)
+            for i in range(self.nb_writers)
+        ]
+        for writer in writers:
+            writer.start()
+
+        reader = Thread(target=self.read, args=(hits,), name="es-reader", daemon=True)
+        reader.start()
+
+        try:
+            reader.join()
+            for writer in writers:
+                writer.join()
+        except KeyboardInterrupt as e:
+            self.fail(e)
+            reader.join()
+            for writer in writers:
+                writer.join()
+
+        self.writer_metrics.stop()
+
+        l.info(str(self.reader_metrics))
+        l.info(str(self.writer_metrics))
+
+        if self.errors:
+            raise self.errors[0]
+
+        return self.writer_metrics.items
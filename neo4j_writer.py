@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""This module writes packets to Neo4j in batches. Rows are buffered and sent
+as the parameter of a single UNWIND statement per batch, inside an explicit
+write transaction of one reused session, instead of one round trip per node
+and per relationship. Rows of flows between the same hosts and ports can be
+aggregated beforehand, writing one relationship per flow group."""
+
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from twmn_helpers.logging import Logging
+
+l = Logging(__name__)
+
+# Lookups of hosts by name and of relationships by attribution label or start
+# become index seeks instead of label scans
+SCHEMA_CYPHER = [
+    "CREATE CONSTRAINT ip_name IF NOT EXISTS FOR (n:IP) REQUIRE n.name IS UNIQUE",
+    "CREATE INDEX transport_attribution_label IF NOT EXISTS "
+    "FOR ()-[r:TRANSPORT]-() ON (r.attribution_label)",
+    "CREATE INDEX transport_event_start IF NOT EXISTS "
+    "FOR ()-[r:TRANSPORT]-() ON (r.event_start)",
+]
+
+WRITE_PACKETS_CYPHER = """
+    UNWIND $rows AS row
+    MERGE (source:IP {name: row.source_ip})
+    ON CREATE SET source.hostname = row.source_hostname
+    MERGE (destination:IP {name: row.destination_ip})
+    ON CREATE SET destination.hostname = row.destination_hostname
+    CREATE (source)-[:TRANSPORT {
+        name: row.transport,
+        transport: row.transport,
+        source_port: row.source_port,
+        destination_port: row.destination_port,
+        attribution_label: CASE WHEN source.name STARTS WITH $source_prefix
+            THEN source.name ELSE row.attribution_label END,
+        event_start: row.event_start,
+        event_end: row.event_end,
+        count: row.count
+    }]->(destination)
+"""
+
+
+def create_schema(session) -> None:
+    """Creates the constraints and indexes of the attribution graph, if they
+    do not exist yet."""
+    for cypher in SCHEMA_CYPHER:
+        session.run(cypher).consume()
+    session.run("CALL db.awaitIndexes()").consume()
+
+
+def write_rows(tx, rows: List[Dict[str, Any]], source_prefix: str = "w1-s") -> None:
+    """Writes a batch of packet rows in a transaction. Relationships from the
+    students' hosts, named after source_prefix, are attributed to them."""
+    tx.run(WRITE_PACKETS_CYPHER, rows=rows, source_prefix=source_prefix).consume()
+
+
+class BatchWriter:
+    """Buffers packet rows and writes them to Neo4j in batches."""
+
+    def __init__(
+        self,
+        session,
+        batch_size: int = 5000,
+        flush_interval: float = 5.0,
+        source_prefix: str = "w1-s",
+    ) -> None:
+        """Create a batch writer.
+        :session: The Neo4j session, reused for every batch
+        :batch_size: The number of rows written per transaction
+        :flush_interval: The time (in seconds) after which the buffer is
+        written when the next row is added. It is only checked then, as the
+        session cannot be shared with a timer thread, so rows left buffered
+        are written by flush or when leaving the with block
+        :source_prefix: The prefix of the names of the students' hosts
+        """
+        self.session = session
+        self.source_prefix = source_prefix
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.rows: List[Dict[str, Any]] = []
+        self.last_flush = time.monotonic()
+
+        self.written = 0
+        self.batches = 0
+
+    def add(self, row: Dict[str, Any]) -> None:
+        """Buffers a row, writing the buffer once it is full or old enough."""
+        self.rows.append(row)
+
+        if (
+            len(self.rows) >= self.batch_size
+            or time.monotonic() - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the buffered rows."""
+        if self.rows:
+            self.session.execute_write(write_rows, self.rows, self.source_prefix)
+
+            self.written += len(self.rows)
+            self.batches += 1
+
+            l.debug(f"{self.written} relationships written in {self.batches} batches")
+
+            self.rows = []
+
+        self.last_flush = time.monotonic()
+
+    def __enter__(self) -> "BatchWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.flush()
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """Parses an ISO 8601 time to an epoch, None if it is missing."""
+    if value is None:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def aggregate_key(row: Dict[str, Any], bucket: float) -> Tuple:
+    start = parse_time(row.get("event_start"))
+    return (
+        None if start is None else int(start // bucket),
+        row["source_ip"],
+        row["destination_ip"],
+        row["transport"],
+        row.get("source_port"),
+        row.get("destination_port"),
+    )
+
+
+def aggregate_rows(
+    rows: Iterable[Dict[str, Any]], bucket: float = 60.0, max_pending: int = 100000
+) -> Iterator[Dict[str, Any]]:
+    """Aggregates the rows of the flows between the same hosts, with the same
+    transport and ports, within a time bucket, into one row holding their
+    count, their first start and their last end. As propagation matches
+    relationships on their ports and transport, and orders them by start,
+    the aggregated rows attribute like the flows they replace as long as the
+    bucket is short.
+    :bucket: The length of the buckets, in seconds
+    :max_pending: The number of aggregated rows held before they are yielded
+    """
+    pending: Dict[Tuple, Dict[str, Any]] = {}
+
+    for row in rows:
+        key = aggregate_key(row, bucket)
+
+        aggregate = pending.get(key)
+        if aggregate is None:
+            pending[key] = dict(row, count=row.get("count", 1))
+
+            if len(pending) >= max_pending:
+                yield from pending.values()
+                pending = {}
+            continue
+
+        aggregate["count"] += row.get("count", 1)
+
+        if row.get("event_start") is not None and (
+            aggregate["event_start"] is None
+            or parse_time(row["event_start"]) < parse_time(aggregate["event_start"])
+        ):
+            aggregate["event_start"] = row["event_start"]
+
+        if row.get("event_end") is not None and (
+            aggregate.get("event_end") is None
+            or parse_time(row["event_end"]) > parse_time(aggregate["event_end"])
+        ):
+            aggregate["event_end"] = row["event_end"]
+
+    yield from pending.values()
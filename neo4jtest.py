@@ -1,8 +1,16 @@
 from elasticsearch.client import Elasticsearch
 from elasticsearch_dsl import A, Q, Search
 from neo4j import GraphDatabase
+from neo4j.exceptions import ClientError
+from neo4j_writer import BatchWriter, aggregate_rows, create_schema
+from neo4j_pipeline import IngestPipeline
+from neo4j_export import export_rows
+from graph_store import Neo4jGraphStore, window_parameters, window_predicate
+import label_propagation
 import json
 import time
+from collections import Counter
+from typing import Iterator, Optional, Tuple
 from uuid import uuid4
 
 def convert_ip_to_w1_sx(ip_address: str) -> str:
@@ -21,162 +29,322 @@ def get_hostname_for_ip(ip_address: str, packet_data: dict) -> str:
 
     return ip_address
 
-def delete_irrelevant_nodes(session):
-    # Find the largest connected component
-    cypher_find_largest_connected_component = '''
-    MATCH (n)
-    CALL apoc.path.subgraphAll(n, {
-      minLevel: 1
-    })
-    YIELD nodes, relationships
-    WITH apoc.coll.toSet(nodes) AS largest_connected_component
-    RETURN largest_connected_component
-    '''
-
-    largest_connected_component = session.run(cypher_find_largest_connected_component).single()[0]
-
-    # Delete nodes that are not part of the largest connected component
-    cypher_delete_nodes_not_in_largest_component = """
-    MATCH (n)
-    WHERE NOT id(n) IN $largest_connected_component_ids
-    DETACH DELETE n
-    RETURN count(*) as deleted_nodes_count
+def find_components_gds(session):
+    """Computes the weakly connected components of the hosts with the WCC
+    procedure of the Graph Data Science library.
+    :returns: The component of each node id, or None if GDS is not installed
     """
+    graph_name = f"wcc-{uuid4()}"
+
+    try:
+        session.run("""
+            CALL gds.graph.project($graph_name, 'IP', {TRANSPORT: {orientation: 'UNDIRECTED'}})
+        """, graph_name=graph_name).consume()
+    except ClientError:
+        return None
+
+    try:
+        result = session.run("""
+            CALL gds.wcc.stream($graph_name)
+            YIELD nodeId, componentId
+            RETURN nodeId AS id, componentId AS component
+        """, graph_name=graph_name)
+
+        components = {record['id']: record['component'] for record in result}
+    finally:
+        session.run("CALL gds.graph.drop($graph_name)", graph_name=graph_name).consume()
+
+    return components
+
+
+class UnionFind:
+    """Disjoint sets of node ids, with path halving."""
+
+    def __init__(self):
+        self.parent = {}
+
+    def add(self, node):
+        self.parent.setdefault(node, node)
+
+    def find(self, node):
+        parent = self.parent
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def union(self, a, b):
+        """Merges the sets of two nodes, adding them if needed."""
+        self.add(a)
+        self.add(b)
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[a] = b
+
+    def components(self):
+        """Returns the root of the set of each node."""
+        return {node: self.find(node) for node in self.parent}
+
+
+def find_components(session):
+    """Computes the weakly connected components of the hosts from a single
+    streamed export of the relationships, merged with a union-find.
+    :returns: The component of each node id
+    """
+    union_find = UnionFind()
 
-    largest_connected_component_ids = [node.id for node in largest_connected_component]
-    result = session.run(cypher_delete_nodes_not_in_largest_component,
-                         {"largest_connected_component_ids": largest_connected_component_ids})
+    for record in session.run("MATCH (n:IP) RETURN id(n) AS id"):
+        union_find.add(record['id'])
 
-    total_deleted_nodes = result.single()[0]
+    for record in session.run("""
+        MATCH (a:IP)-[:TRANSPORT]->(b:IP)
+        RETURN DISTINCT id(a) AS source, id(b) AS target
+    """):
+        union_find.union(record['source'], record['target'])
+
+    return union_find.components()
 
-    return total_deleted_nodes
 
+def delete_nodes(tx, ids):
+    return tx.run("""
+        UNWIND $ids AS id
+        MATCH (n:IP) WHERE id(n) = id
+        DETACH DELETE n
+        RETURN count(*) AS deleted_nodes_count
+    """, ids=ids).single()[0]
 
-def set_initial_attribution_labels(session, source_prefix):
-    cypher = f"""
-        MATCH (source:Node)-[r:TRANSPORT]->(target:Node)
-        WHERE source.name STARTS WITH '{source_prefix}'
-        SET r.attribution_label = source.name
+
+def delete_irrelevant_nodes(session, batch_size=10000):
+    """Deletes the hosts outside of the largest weakly connected component,
+    in batches of transactions.
+    :batch_size: The number of nodes deleted per transaction
+    :returns: The number of deleted nodes
     """
-    session.run(cypher)
 
+    components = find_components_gds(session)
+
+    if components is None:
+        components = find_components(session)
+
+    if not components:
+        return 0
 
-def get_connected_nodes(session, node_name):
-    connected_nodes = session.run("""
-        MATCH (n {name: $node_name})-[r]->(connected:Node)
-        RETURN connected.name AS name
-    """, node_name=node_name).data()
+    largest_component = Counter(components.values()).most_common(1)[0][0]
 
-    return [connected_node['name'] for connected_node in connected_nodes]
+    ids = [id for id, component in components.items() if component != largest_component]
 
+    total_deleted_nodes = 0
 
-def propagate_labels(session, node_name):
+    for i in range(0, len(ids), batch_size):
+        total_deleted_nodes += session.execute_write(delete_nodes, ids[i : i + batch_size])
 
-    connected_nodes = get_connected_nodes(session, node_name)
+    return total_deleted_nodes
+
+
+def find_window_components(session, window):
+    """Computes the weakly connected components of the hosts linked by the
+    relationships started within a window, read with a seek of the
+    event_start index.
+    :returns: The component of each node id, and the id of each relationship
+    with the ids of the nodes it links
+    """
+    union_find = UnionFind()
+    relationships = []
+
+    for record in session.run(f"""
+        MATCH (a:IP)-[r:TRANSPORT]->(b:IP)
+        WHERE {window_predicate(window)}
+        RETURN id(r) AS id, id(a) AS source, id(b) AS target
+    """, **window_parameters(window)):
+        relationships.append((record['id'], record['source'], record['target']))
+
+        union_find.union(record['source'], record['target'])
+
+    return union_find.components(), relationships
+
+
+def delete_relationships(tx, ids):
+    return tx.run("""
+        UNWIND $ids AS id
+        MATCH ()-[r:TRANSPORT]->() WHERE id(r) = id
+        DELETE r
+        RETURN count(*) AS deleted_relationships_count
+    """, ids=ids).single()[0]
+
+
+def delete_orphan_nodes(tx, ids):
+    return tx.run("""
+        UNWIND $ids AS id
+        MATCH (n:IP) WHERE id(n) = id AND NOT (n)--()
+        DELETE n
+        RETURN count(*) AS deleted_nodes_count
+    """, ids=ids).single()[0]
+
+
+def delete_irrelevant_window(session, window, batch_size=10000):
+    """Deletes the relationships started within a window that are outside of
+    the largest weakly connected component of the window, then the hosts
+    left without any relationship. Relationships outside the window are
+    kept, so that a window is pruned without reloading the graph.
+    :window: The inclusive start and exclusive end of the window
+    :batch_size: The number of relationships or nodes deleted per transaction
+    :returns: The number of deleted relationships and of deleted nodes
+    """
 
-    if not connected_nodes:
-        return
+    components, relationships = find_window_components(session, window)
 
-    for connected_node in connected_nodes:
+    if not components:
+        return 0, 0
 
-        matched = set_attribution_label(session, connected_node)
+    largest_component = Counter(components.values()).most_common(1)[0][0]
 
-        if matched:
-            propagate_labels(session, connected_node)
+    ids = []
+    nodes = set()
 
+    for id, source, target in relationships:
+        if components[source] != largest_component:
+            ids.append(id)
+            nodes.update((source, target))
 
-def set_attribution_label(session, node_name):
+    nodes = sorted(nodes)
 
-    matched = False
+    total_deleted_relationships = 0
+    total_deleted_nodes = 0
 
-    # incoming edges
-    incoming_rels = session.run("""
-        MATCH (n {name: $node_name})<-[r]-()
-        RETURN r.source_port AS source_port, r.destination_port AS destination_port, r.transport AS transport, r.attribution_label AS attribution_label
-    """, node_name=node_name).data()
+    for i in range(0, len(ids), batch_size):
+        total_deleted_relationships += session.execute_write(delete_relationships, ids[i : i + batch_size])
 
-    # outcoming edges
-    outgoing_rels = session.run("""
-        MATCH (n {name: $node_name})-[r]->()
-        RETURN ID(r) AS id, r.source_port AS source_port, r.destination_port AS destination_port, r.transport AS transport
-    """, node_name=node_name).data()
+    for i in range(0, len(nodes), batch_size):
+        total_deleted_nodes += session.execute_write(delete_orphan_nodes, nodes[i : i + batch_size])
 
-    # compare
-    for incoming_rel in incoming_rels:
-        for outgoing_rel in outgoing_rels:
-            if (
-                incoming_rel['source_port'] == outgoing_rel['source_port']
-                and incoming_rel['destination_port'] == outgoing_rel['destination_port']
-                and incoming_rel['transport'] == outgoing_rel['transport']
-            ):
+    return total_deleted_relationships, total_deleted_nodes
 
-                matched = True
-                # update attribution label of outcoming edge
-                session.run("""
-                    MATCH ()-[r]->() WHERE ID(r) = $id
-                    SET r.attribution_label = $attribution_label
-                """, id=outgoing_rel['id'], attribution_label=incoming_rel['attribution_label'])
 
+def set_initial_attribution_labels(session, source_prefix, window=None):
+    Neo4jGraphStore(session).set_initial_attribution_labels(source_prefix, window)
 
-    return matched
 
+def set_attribution_label(session, node_name, window=None):
+    return label_propagation.set_attribution_label(Neo4jGraphStore(session), node_name, window)
 
-def merge_edges(session):
 
-    query = """
-    MATCH (a)-[r:TRANSPORT]->(b)
-    WHERE r.attribution_label = 'unknown'
-    WITH a, b, r.transport as transport, collect(r) as edges
-    WHERE size(edges) > 1
-    CREATE (a)-[merged:TRANSPORT {
-        transport: transport,
-        attribution_label: 'unknown',
-        source_ports: [x in edges WHERE x.source_port IS NOT NULL | x.source_port],
-        destination_ports: [x in edges WHERE x.destination_port IS NOT NULL | x.destination_port]
-    }]->(b)
-    FOREACH (r IN edges | DELETE r)
-    RETURN a, b, transport, size(edges) as merged_count
+def propagate_labels(session, node_name, in_memory=False, window=None):
+    """Propagates the attribution labels from a node, level by level.
+    :in_memory: Whether to propagate on an in-memory copy of the graph,
+    which is faster for small worlds
+    :window: The inclusive start and exclusive end of the event_start of the
+    relationships to propagate through, None for the whole graph
+    """
+    store = Neo4jGraphStore(session)
+
+    if in_memory:
+        label_propagation.propagate_labels_in_memory(store, node_name, window)
+    else:
+        label_propagation.propagate_labels(store, node_name, window)
+
+
+def propagate_labels_server(session, node_name, window=None):
+    """Propagates the attribution labels from a node on the server, like
+    label_propagation.propagate_labels : each level is matched and labelled
+    by one query, an outgoing relationship taking the label of the latest
+    matching incoming one started before it, and labels are overwritten.
+    Only the names of the next level come back to the client, which keeps
+    the visited nodes.
+    :node_name: The node to start from, whose neighbours are all visited
+    :window: The window of the relationships to consider, others being
+    neither read nor labelled
+    :returns: The number of levels visited
+    """
+    # The labels of a level are all read before any is written, and ports
+    # or transports missing on both relationships match, like the hash join
+    query = f"""
+        UNWIND $level AS name
+        MATCH (n:IP {{name: name}})-[out:TRANSPORT]->(m:IP)
+        WHERE {window_predicate(window, "out")}
+        CALL {{
+            WITH n, out
+            OPTIONAL MATCH (:IP)-[inc:TRANSPORT]->(n)
+            WHERE {window_predicate(window, "inc")}
+              AND coalesce(inc.source_port = out.source_port, inc.source_port IS NULL AND out.source_port IS NULL)
+              AND coalesce(inc.destination_port = out.destination_port, inc.destination_port IS NULL AND out.destination_port IS NULL)
+              AND coalesce(inc.transport = out.transport, inc.transport IS NULL AND out.transport IS NULL)
+              AND (out.event_start IS NULL OR inc.event_start IS NULL OR inc.event_start < out.event_start)
+            WITH inc
+            ORDER BY inc.event_start IS NOT NULL DESC, inc.event_start DESC
+            RETURN collect(inc)[0] AS latest
+        }}
+        WITH collect({{name: name, out: out, target: m.name, matched: latest IS NOT NULL, label: latest.attribution_label}}) AS rows
+        FOREACH (row IN [r IN rows WHERE r.matched] | SET (row.out).attribution_label = row.label)
+        WITH rows
+        UNWIND rows AS row
+        WITH row.name AS name, collect(row.target) AS targets, any(matched IN collect(row.matched) WHERE matched) AS matched
+        WHERE matched OR name = $node_name
+        UNWIND targets AS target
+        RETURN DISTINCT target
     """
 
-    result = session.run(query)
-    merged_count = 0
+    visited = {node_name}
+    level = [node_name]
+    nb_levels = 0
 
-    for record in result:
-        merged_count += record["merged_count"]
+    while level:
+        frontier = {
+            record["target"]
+            for record in session.run(
+                query, level=level, node_name=node_name, **window_parameters(window)
+            )
+        }
+        nb_levels += 1
 
-    print(f"Merged {merged_count} edges")
+        level = sorted(frontier - visited)
+        visited.update(level)
 
+    return nb_levels
 
 
-def get_packetbeat_filtered_packets() -> None:
-    """Retrieves packetbeat packets from the Elasticsearch database and saves
-    them to a newly created local database and adds relationships to Neo4j."""
+def merge_edges(session, window=None):
 
-    print('Starting get packetbeat')
+    merged_count = Neo4jGraphStore(session).merge_edges(window)
 
-    es = {
-        "hosts": ["35.206.158.243"],
-        "port": 9200,
-        "use_ssl": True,
-        "verify_certs": False,
-        "ssl_show_warn": False,
-    }
+    print(f"Merged {merged_count} edges")
 
-    with open("api-key.json") as f:
-        api_key = json.load(f)
 
-    es["api_key"] = (api_key["api_key"])
 
-    es_connection = Elasticsearch(**es, timeout=200, max_retries=10, retry_on_timeout=True)
+def packet_to_row(h) -> dict:
+    """Converts a packetbeat hit to the row of a relationship written by
+    neo4j_writer.BatchWriter."""
 
-    print('Elasticsearch connection established')
+    packet_data = h.to_dict()
+
+    source_ip = convert_ip_to_w1_sx(h.source.ip)
+    destination_ip = convert_ip_to_w1_sx(h.destination.ip)
+    source_hostname = get_hostname_for_ip(source_ip, packet_data)
+    destination_hostname = get_hostname_for_ip(destination_ip, packet_data)
+
+    return {
+        "event_start": h.event.start,
+        "event_end": h.event.end,
+        "source_ip": source_ip,
+        "source_port": getattr(h.source, "port", None),
+        "destination_ip": destination_ip,
+        "destination_port": getattr(h.destination, "port", None),
+        "transport": getattr(h.network, "transport", "unknown"),
+        "source_hostname": source_hostname or source_ip,
+        "destination_hostname": destination_hostname or destination_ip,
+        "attribution_label": "unknown",
+        "count": 1,
+    }
+
+
+def build_packetbeat_search(es_connection, world_name: str = "en2720-w1") -> Search:
+    """Builds the search of the packetbeat packets between the hosts of a
+    world."""
 
     s: Search = Search(using=es_connection)
     s = s.extra(track_total_hits=True)
     s = s.extra(size=1000)
 
     agent_type = "packetbeat"
-    world_name = "en2720-w1"
 
     filter = Q(
         "range", event__start={"lte": 20221001, "gte": 20221001, "format": "basic_date"}
@@ -216,7 +384,32 @@ def get_packetbeat_filtered_packets() -> None:
 
     print(f"Total hits: {s.count()}")
 
-    s = s.query(q)
+    return s.query(q)
+
+
+def connect_elasticsearch() -> Elasticsearch:
+
+    es = {
+        "hosts": ["35.206.158.243"],
+        "port": 9200,
+        "use_ssl": True,
+        "verify_certs": False,
+        "ssl_show_warn": False,
+    }
+
+    with open("api-key.json") as f:
+        api_key = json.load(f)
+
+    es["api_key"] = (api_key["api_key"])
+
+    es_connection = Elasticsearch(**es, timeout=200, max_retries=10, retry_on_timeout=True)
+
+    print('Elasticsearch connection established')
+
+    return es_connection
+
+
+def connect_neo4j():
 
     # Connect to Neo4j database
     neo4j_url = "bolt://localhost:7687"
@@ -227,56 +420,87 @@ def get_packetbeat_filtered_packets() -> None:
 
     print('Neo4j connection established')
 
-    with driver.session() as session:
+    return driver
 
-        for h in s.scan():
-
-            source_ip = convert_ip_to_w1_sx(h.source.ip)
-            destination_ip = convert_ip_to_w1_sx(h.destination.ip)
-            source_hostname = get_hostname_for_ip(source_ip, h.to_dict())
-            destination_hostname = get_hostname_for_ip(destination_ip, h.to_dict())
-
-            params = {
-                "event_start": h.event.start,
-                "event_end": h.event.end,
-                "source_ip": source_ip,
-                "source_port": getattr(h.source, "port", None),
-                "destination_ip": destination_ip,
-                "destination_port": getattr(h.destination, "port", None),
-                "transport": getattr(h.network, "transport", "unknown"),
-                "source_hostname": source_hostname or source_ip,
-                "destination_hostname": destination_hostname or destination_ip,
-                "attribution_label": "unknown",
-            }
-
-            # create nodes
-
-            create_or_update_node_cypher = """
-                MERGE (source:IP {name: $source_ip})
-                ON CREATE SET source.hostname = $source_hostname
-                MERGE (destination:IP {name: $destination_ip})
-                ON CREATE SET destination.hostname = $destination_hostname
-            """
-
-            session.run(create_or_update_node_cypher, params)
-
-            # create relationships
-            create_or_update_relationship_cypher = """
-                MATCH (source:IP {name: $source_ip}), (destination:IP {name: $destination_ip})
-                CREATE (source)-[t:TRANSPORT {name: $transport, source_port: $source_port, destination_port: $destination_port, attribution_label: CASE WHEN source.name STARTS WITH 'w1-s' THEN source.name ELSE $attribution_label END, event_start: $event_start, event_end: $event_end, count: 1}]->(destination)
-            """
-
-            session.run(create_or_update_relationship_cypher, params)
-
-        #filter out nodes that are not connected to any other nodes
+
+def attribute_graph(session, window: Optional[Tuple[str, str]] = None) -> int:
+    """Prunes the ingested graph and propagates the attribution labels.
+    :window: The inclusive start and exclusive end of the event_start of the
+    relationships to attribute, None for the whole graph
+    :returns: The number of deleted nodes
+    """
+
+    #filter out nodes that are not connected to any other nodes
+    if window is None:
         total_deleted_nodes = delete_irrelevant_nodes(session)
+    else:
+        _, total_deleted_nodes = delete_irrelevant_window(session, window)
+
+    vpn_instance = '10.0.0.2'
+
+    set_initial_attribution_labels(session, 'w1-s', window)
+    propagate_labels(session, vpn_instance, window=window)
+    #merge_edges(session)
+
+    return total_deleted_nodes
+
+
+def packet_rows(s: Search, bucket: Optional[float] = None) -> Iterator[dict]:
+    """Scans the packets, as relationship rows.
+    :bucket: The length (in seconds) of the buckets within which the flows
+    with the same hosts, transport and ports are aggregated, None to keep a
+    row per flow
+    """
+    rows = (packet_to_row(h) for h in s.scan())
+
+    if bucket:
+        rows = aggregate_rows(rows, bucket)
+
+    return rows
+
+
+def get_packetbeat_filtered_packets(
+    batch_size: int = 5000,
+    flush_interval: float = 5.0,
+    nb_writers: int = 0,
+    bucket: Optional[float] = None,
+) -> None:
+    """Retrieves packetbeat packets from the Elasticsearch database and adds
+    them to Neo4j in batches of relationships.
+    :batch_size: The number of relationships written per transaction
+    :flush_interval: The maximum time (in seconds) a packet stays buffered
+    :nb_writers: The number of writer threads fed by a reader thread, 0 to
+    read and write in turn
+    :bucket: The length (in seconds) of the buckets within which flows are
+    aggregated before being written, None to write a relationship per flow
+    """
 
-        vpn_instance = '10.0.0.2'
+    print('Starting get packetbeat')
+
+    s = build_packetbeat_search(connect_elasticsearch())
+
+    driver = connect_neo4j()
+
+    with driver.session() as session:
+
+        create_schema(session)
 
-        set_initial_attribution_labels(session, 'w1-s')
-        set_attribution_label(session, vpn_instance)
-        propagate_labels(session, vpn_instance)
-        #merge_edges(session)
+        if nb_writers:
+            pipeline = IngestPipeline(
+                driver.session, lambda row: row, nb_writers,
+                batch_size=batch_size, flush_interval=flush_interval,
+            )
+            written = pipeline.run(packet_rows(s, bucket))
+
+            print(f'{written} relationships written in {pipeline.writer_metrics.batches} batches')
+        else:
+            with BatchWriter(session, batch_size, flush_interval) as writer:
+                for row in packet_rows(s, bucket):
+                    writer.add(row)
+
+            print(f'{writer.written} relationships written in {writer.batches} batches')
+
+        total_deleted_nodes = attribute_graph(session)
 
 
     driver.close()
@@ -285,6 +509,37 @@ def get_packetbeat_filtered_packets() -> None:
 
 
 
+def export_packetbeat_packets(
+    directory: str = "import", bucket: Optional[float] = None
+) -> None:
+    """Exports the packetbeat packets to CSV files for the offline importer of
+    Neo4j. A full rebuild runs the printed import command on the stopped
+    database, then attribute_imported_graph once it is started again.
+    :directory: The directory of the CSV files
+    :bucket: The length (in seconds) of the buckets within which flows are
+    aggregated, None to export a relationship per flow
+    """
+
+    s = build_packetbeat_search(connect_elasticsearch())
+
+    command = export_rows(packet_rows(s, bucket), directory)
+
+    print(' '.join(command))
+
+
+def attribute_imported_graph() -> None:
+    """Indexes and attributes a graph loaded by the offline importer."""
+
+    driver = connect_neo4j()
+
+    with driver.session() as session:
+        create_schema(session)
+        total_deleted_nodes = attribute_graph(session)
+
+    driver.close()
+    print(f'{total_deleted_nodes} irrelevant nodes deleted.')
+
+
 if __name__ == "__main__":
     start_time = time.time()
     get_packetbeat_filtered_packets()
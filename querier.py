@@ -6,24 +6,40 @@ module, the Elasticsearch database and the local database."""
 #initial
 
 import json
+import os
 import sqlite3 as sl
 from typing import Any, Dict, List
 
+import numpy as np
 from elasticsearch.client import Elasticsearch
 from elasticsearch_dsl import A, Q, Search
-from twmn.player import Player, PlayerSession
+from twmn.player import Player, PlayerSession, build_sessions, timestamp_to_epoch
+from twmn.session_index import SessionIndex
 
+DEFAULT_WORLD = "en2720-w1"
 
-def save_all_players_data(roster: List[Player]) -> None:
-    """Saves the data of all players in a json file."""
+
+def store_path(name: str, world: str = DEFAULT_WORLD, create: bool = False) -> str:
+    """Returns the path of a local store (database or json file) of a world.
+    Every world keeps its stores in its own directory.
+    :name: The file name of the store
+    :world: The name of the world
+    :create: Whether to create the directory of the world, for a store about
+    to be written
+    """
+    if create:
+        os.makedirs(world, exist_ok=True)
+    return os.path.join(world, name)
+
+
+def save_all_players_data(roster: List[Player], world: str = DEFAULT_WORLD) -> None:
+    """Saves the data of all players of a world in a json file."""
 
     print('starting get players data')
-    players = get_all_players()
+    players = get_all_players(world)
     print('get all players data complete')
 
-    for player in players:
-        player.retrieve_sessions(roster)
-        print('retrieving sessions')
+    retrieve_all_sessions(players, roster, world)
 
 
     print('retrieve sessions complete')
@@ -34,13 +50,16 @@ def save_all_players_data(roster: List[Player]) -> None:
 
     print('retrieve ip complete')
 
+    index = SessionIndex.from_players(players)
+
     for player in players:
-        player.retrieve_coplayers_session(roster)
+        for session in player.sessions:
+            session.coplayers = index.coplayer_sessions(player, session)
         print('retrieving coplayers')
 
     print('retrieve coplayers complete')
 
-    with open("player_data.json", "w") as fichier:
+    with open(store_path("player_data.json", world, create=True), "w") as fichier:
         hits = []
         print('start write json file')
         for player in players:
@@ -81,9 +100,9 @@ def save_all_players_data(roster: List[Player]) -> None:
         print('write json file complete')
 
 
-def get_filebeat_packets() -> None:
-    """Retrieves filebeat packets from the Elasticsearch database and saves
-    them to a newly created local database."""
+def get_filebeat_packets(world_name: str = DEFAULT_WORLD) -> None:
+    """Retrieves filebeat packets of a world from the Elasticsearch database
+    and saves them to a newly created local database."""
 
     print('getting filebeat file')
 
@@ -106,8 +125,6 @@ def get_filebeat_packets() -> None:
     s = s.extra(track_total_hits=True)
     s = s.extra(size=0)
 
-    world_name = "en2720-w1"
-
     agentf = Q("term", agent__type={"value": "filebeat"})
     world = Q("term", world=world_name)
     time = Q(
@@ -124,7 +141,7 @@ def get_filebeat_packets() -> None:
 
     s = s.query(q)
 
-    con = sl.connect("filebeat.db")
+    con = sl.connect(store_path("filebeat.db", world_name, create=True))
 
     with con:
         con.execute(
@@ -156,9 +173,9 @@ def get_filebeat_packets() -> None:
     print('get filebeat file complete')
 
 
-def get_journalbeat_packets() -> None:
-    """Retrieves journalbeat packets from the Elasticsearch database and saves
-    them to a newly created local database."""
+def get_journalbeat_packets(world_name: str = DEFAULT_WORLD) -> None:
+    """Retrieves journalbeat packets of a world from the Elasticsearch
+    database and saves them to a newly created local database."""
 
     es = {
         "hosts": ["35.206.158.243"],
@@ -183,7 +200,7 @@ def get_journalbeat_packets() -> None:
     filter = (
         Q("term", agent__type="journalbeat")
         & Q("term", syslog__identifier="conntrack")
-        & Q("term", agent__hostname="en2720-w1-vpn")
+        & Q("term", agent__hostname=f"{world_name}-vpn")
     )
     destination = Q(
         "term",
@@ -198,7 +215,7 @@ def get_journalbeat_packets() -> None:
 
     s = s.query(q)
 
-    con = sl.connect("journalbeat.db")
+    con = sl.connect(store_path("journalbeat.db", world_name, create=True))
 
     with con:
         con.execute(
@@ -251,9 +268,9 @@ def get_journalbeat_packets() -> None:
     print('get journetbeat file complete')
 
 
-def get_packetbeat_packets() -> None:
-    """Retrieves packetbeat packets from the Elasticsearch database and saves
-    them to a newly created local database."""
+def get_packetbeat_packets(world_name: str = DEFAULT_WORLD) -> None:
+    """Retrieves packetbeat packets of a world from the Elasticsearch database
+    and saves them to a newly created local database."""
 
     print('staring get packetbeat')
 
@@ -279,7 +296,6 @@ def get_packetbeat_packets() -> None:
     s = s.extra(size=0)
 
     agent_type = "packetbeat"
-    world_name = "en2720-w1"
 
     filter = Q(
         "range", event__start={"lte": 20221011, "gte": 20221001, "format": "basic_date"}
@@ -305,7 +321,7 @@ def get_packetbeat_packets() -> None:
 
     s = s.query(q)
 
-    con = sl.connect("packetbeat.db")
+    con = sl.connect(store_path("packetbeat.db", world_name, create=True))
 
     with con:
         con.execute(
@@ -361,7 +377,7 @@ def get_player_pivot_for_flow_query_result(
     string = "vpn"
     vpn = f"{world}{delimiter}{string}"
 
-    con = sl.connect("journalbeat.db")
+    con = sl.connect(store_path("journalbeat.db", world))
 
     req = (
         "SELECT conntrack__dst2, conntrack__timestamp, conntrack__trans_proto, conntrack__sport1, conntrack__dport1 FROM JOURNALBEAT WHERE agent__hostname='"
@@ -408,7 +424,7 @@ def get_target_instances_query_result(player: str, session: PlayerSession) -> Li
     string = "vpn"
     vpn = f"{world}{delimiter}{string}"
 
-    con = sl.connect("journalbeat.db")
+    con = sl.connect(store_path("journalbeat.db", world))
 
     req = (
         "SELECT DISTINCT(conntrack__dst1) FROM JOURNALBEAT WHERE agent__hostname='"
@@ -437,12 +453,12 @@ def get_target_instances_query_result(player: str, session: PlayerSession) -> Li
 
 
 def flows_over_path_query_result(
-    source: str, destination: str, session: PlayerSession
+    source: str, destination: str, session: PlayerSession, world: str = DEFAULT_WORLD
 ) -> List[Dict[str, Dict[str, Any]]]:
     """Retrieves all information related to the transmission of a packet
     between a source and a destination during a session."""
 
-    con = sl.connect("packetbeat.db")
+    con = sl.connect(store_path("packetbeat.db", world))
 
     req = (
         "SELECT * FROM PACKETBEAT WHERE source__ip='"
@@ -478,8 +494,65 @@ def flows_over_path_query_result(
     return hits
 
 
-def get_all_players() -> List[Player]:
-    """Retrieves the list of all players active in the network."""
+def retrieve_all_sessions(
+    players: List[Player], roster: List[Player], world_name: str = DEFAULT_WORLD
+) -> None:
+    """Determines and assigns the sessions of all players of a world, from a
+    single scan of the connection events of the world instead of a query per
+    player.
+    :players: The players of the world
+    :roster: The roster the players are appended to
+    :world_name: The name of the world
+    """
+    es = {
+        "hosts": ["35.206.158.243"],
+        "port": 9200,
+        "use_ssl": True,
+        "verify_certs": False,
+        "ssl_show_warn": False,
+    }
+
+    with open("api-key.json") as f:
+        api_key = json.load(f)
+
+    es["api_key"] = (api_key["api_key"])
+
+    es_connection = Elasticsearch(
+        **es, timeout=200, max_retries=10, retry_on_timeout=True
+    )
+
+    s: Search = Search(using=es_connection)
+
+    agent = Q("term", agent__type={"value": "filebeat"})
+
+    world = Q("term", world={"value": world_name})
+
+    session_start = Q("term", openvpn__event={"value": "client-connected"})
+
+    session_end = Q("term", openvpn__event={"value": "client-disconnected"})
+
+    q = Q("bool", filter=agent & world & (session_start | session_end))
+
+    s = s.query(q).source(["@timestamp", "openvpn.event", "openvpn.common_name"])
+
+    names, epochs, events = [], [], []
+
+    for h in s.scan():
+        names.append(h.openvpn.common_name)
+        epochs.append(timestamp_to_epoch(h["@timestamp"]))
+        events.append(h.openvpn.event)
+
+    sessions = build_sessions(np.array(names, dtype=str), epochs, np.array(events, dtype=str))
+
+    for player in players:
+        player.sessions = sessions.get(player.name, [])
+        roster.append(player)
+
+    print(f"found {sum(len(p.sessions) for p in players)} sessions for {len(players)} players")
+
+
+def get_all_players(world_name: str = DEFAULT_WORLD) -> List[Player]:
+    """Retrieves the list of all players active in a world."""
     es = {
         "hosts": ["35.206.158.243"],
         "port": 9200,
@@ -504,7 +577,7 @@ def get_all_players() -> List[Player]:
 
     agent = Q("term", agent__type={"value": "filebeat"})
 
-    world = Q("term", world={"value": "en2720-w1"})
+    world = Q("term", world={"value": world_name})
 
     session_start = Q("term", openvpn__event={"value": "client-connected"})
 
@@ -522,6 +595,6 @@ def get_all_players() -> List[Player]:
     response = s.execute()
 
     return [
-        Player(name=item.key, id=item.key, world="en2720-w1")
+        Player(name=item.key, id=item.key, world=world_name)
         for item in response.aggregations.coplayers.buckets
     ]
\ No newline at end of file
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""Runs the graph of attribution_test.py through a MemoryGraphStore, without
+a Neo4j server. The relationships it draws at random are given fixed ports
+and transports that match no other relationship."""
+
+import pytest
+
+import label_propagation
+from graph_store import MemoryGraphStore
+
+VPN_INSTANCE = "192.168.0.3"
+
+RELS = [
+    ("w1-s2", "192.168.0.3", 1234, 2345, "tcp"),
+    ("192.168.0.3", "192.168.0.4", 1234, 2345, "tcp"),
+    ("192.168.0.3", "192.168.0.4", 3242, 245, "tcp"),
+    ("192.168.0.3", "192.168.0.4", 124, 235, "tcp"),
+    ("192.168.0.4", "192.168.0.5", 1234, 2345, "tcp"),
+    ("192.168.0.5", "192.168.0.6", 14, 34, "tcp"),
+    ("192.168.0.4", "192.168.0.6", 50001, 50002, "udp"),
+    ("192.168.0.3", "192.168.0.7", 50003, 50004, "udp"),
+    ("192.168.0.7", "192.168.0.8", 50005, 50006, "icmp"),
+    ("w1-s3", "192.168.0.3", 4567, 6789, "icmp"),
+    ("192.168.0.3", "192.168.0.10", 4567, 6789, "icmp"),
+]
+
+
+@pytest.fixture
+def store():
+    store = MemoryGraphStore()
+    store.insert_relationships(
+        {
+            "id": id,
+            "source_ip": source,
+            "destination_ip": target,
+            "source_port": source_port,
+            "destination_port": destination_port,
+            "transport": transport,
+            "attribution_label": "unknown",
+        }
+        for id, (source, target, source_port, destination_port, transport) in enumerate(RELS)
+    )
+    return store
+
+
+def labels(store):
+    return {rel["id"]: rel["attribution_label"] for rel in store.relationships()}
+
+
+def test_propagate_labels(store):
+    label_propagation.propagate_labels(store, VPN_INSTANCE)
+
+    assert labels(store) == {
+        0: "w1-s2",
+        1: "w1-s2",
+        2: "unknown",
+        3: "unknown",
+        4: "w1-s2",
+        5: "unknown",
+        6: "unknown",
+        7: "unknown",
+        8: "unknown",
+        9: "w1-s3",
+        10: "w1-s3",
+    }
+
+
+def test_propagate_labels_in_memory(store):
+    expected = MemoryGraphStore.copy(store)
+    label_propagation.propagate_labels(expected, VPN_INSTANCE)
+
+    assert label_propagation.propagate_labels_in_memory(store, VPN_INSTANCE) == 3
+    assert labels(store) == labels(expected)
+
+
+def test_merge_edges(store):
+    label_propagation.propagate_labels(store, VPN_INSTANCE)
+
+    assert store.merge_edges() == 2
+
+    merged = [rel for rel in store.relationships() if rel["source_ports"]]
+    assert len(merged) == 1
+    assert merged[0]["source_ip"] == VPN_INSTANCE
+    assert merged[0]["destination_ip"] == "192.168.0.4"
+    assert merged[0]["transport"] == "tcp"
+    assert merged[0]["attribution_label"] == "unknown"
+    assert merged[0]["count"] == 2
+    assert sorted(merged[0]["source_ports"]) == [124, 3242]
+    assert sorted(merged[0]["destination_ports"]) == [235, 245]
+
+    # The relationships that were merged are gone, the others are untouched
+    assert sorted(rel["id"] for rel in store.relationships() if not rel["source_ports"]) == [
+        0, 1, 4, 5, 6, 7, 8, 9, 10
+    ]
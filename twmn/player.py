@@ -11,7 +11,10 @@ from __future__ import annotations
 
 import json
 from copy import copy
-from typing import Any, List, NamedTuple, Optional
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
 
 from elasticsearch.client import Elasticsearch
 from elasticsearch_dsl import A, Q, Search
@@ -23,6 +26,8 @@ from twmn_helpers.time import Timeframe
 
 roster: List[Player] = []
 
+CLIENT_CONNECTED = "client-connected"
+
 l = Logging(__name__)
 
 
@@ -380,6 +385,163 @@ class CoplayerSessions(NamedTuple):
     sessions: List[PlayerSession]
 
 
+class EpochPlayerSession:
+    """Represents a player session in the world, as start and end epochs.
+    A lighter replacement for PlayerSession: it has no instance dict, it
+    compares on epochs, and its MayaDT start and end are only created when
+    read."""
+
+    __slots__ = ("start_epoch", "end_epoch", "coplayers", "_start", "_end")
+
+    def __init__(
+        self,
+        start: Any,
+        end: Any,
+        coplayers: List[CoplayerSessions] = None,
+    ) -> None:
+        """Initialize a session object.
+        :param start: the starting time of the session, as a MayaDT or epoch
+        :param end: the ending time of the session, as a MayaDT or epoch
+        :param coplayers: other players, also logged-in at the time
+        """
+        self._start = start if isinstance(start, MayaDT) else None
+        self._end = end if isinstance(end, MayaDT) else None
+        self.start_epoch = start.epoch if self._start else float(start)
+        self.end_epoch = end.epoch if self._end else float(end)
+        self.coplayers = coplayers or []
+
+    @classmethod
+    def from_session(cls, session: PlayerSession) -> EpochPlayerSession:
+        """Convert a session, keeping its coplayers.
+        :param session: a PlayerSession object
+        :return: the equivalent epoch-based session
+        """
+        return cls(session.start, session.end, session.coplayers)
+
+    @property
+    def start(self) -> MayaDT:
+        """The starting time of the session, as a MayaDT."""
+        if self._start is None:
+            self._start = MayaDT(self.start_epoch)
+        return self._start
+
+    @property
+    def end(self) -> MayaDT:
+        """The ending time of the session, as a MayaDT."""
+        if self._end is None:
+            self._end = MayaDT(self.end_epoch)
+        return self._end
+
+    @property
+    def duration(self) -> float:
+        """The duration of the session, in seconds."""
+        return self.end_epoch - self.start_epoch
+
+    def to_timeframe(self) -> Timeframe:
+        """Create a timeframe from the session.
+        :return: a Timeframe equivalent of the session
+        """
+        return Timeframe(self.start, self.end)
+
+    def iso8601(self) -> str:
+        """Return the session as an ISO 8601 interval, like MayaInterval."""
+        return f"{self.start.iso8601()}/{self.end.iso8601()}"
+
+    def intersects(self, other: Any) -> bool:
+        """Whether the session overlaps another session or interval."""
+        other_start = getattr(other, "start_epoch", None)
+        other_end = getattr(other, "end_epoch", None)
+        if other_start is None:
+            other_start, other_end = other.start.epoch, other.end.epoch
+        return self.start_epoch < other_end and other_start < self.end_epoch
+
+    def __contains__(self, item: Any) -> bool:
+        """Whether a time is within the session, as for PlayerSession."""
+        if isinstance(item, (int, float)):
+            t = float(item)
+        else:
+            t = timestamp_to_epoch(item)
+        return self.start_epoch <= t < self.end_epoch
+
+    def __copy__(self) -> EpochPlayerSession:
+        session = EpochPlayerSession.__new__(EpochPlayerSession)
+        session.start_epoch = self.start_epoch
+        session.end_epoch = self.end_epoch
+        session.coplayers = self.coplayers
+        session._start = self._start
+        session._end = self._end
+        return session
+
+    def _key(self) -> tuple:
+        return (self.start_epoch, self.end_epoch)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, EpochPlayerSession):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __lt__(self, other: EpochPlayerSession) -> bool:
+        return self._key() < other._key()
+
+    def __le__(self, other: EpochPlayerSession) -> bool:
+        return self._key() <= other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def __str__(self) -> str:
+        """Return a user friendly representation of a session."""
+        return (
+            f"session from {self.start} to {self.end} with"
+            + f" {len(self.coplayers)} coplayers"
+        )
+
+    def __repr__(self) -> str:
+        """Return a developer friendly representation of a session."""
+        return (
+            f"{self.__class__.__name__}({self.start}, {self.end},"
+            + f" {len(self.coplayers)} coplayers)"
+        )
+
+
+class EpochPlayer:
+    """Represents a student in the cyber range, with epoch-based sessions.
+    A lighter replacement for Player, without instance dict."""
+
+    __slots__ = ("name", "id", "uid", "world", "sessions", "vpn_ip")
+
+    def __init__(
+        self,
+        name: str,
+        id: str,
+        uid: str = None,
+        world: Optional[str] = None,
+        sessions: List[EpochPlayerSession] = None,
+    ) -> None:
+        """Create a player object.
+        :name: the nickname/username of the Player
+        :id: the id of the player in the cyber range
+        :uid: the id of the player in the scoreboard
+        :world: the world the player belongs to
+        :sessions: a list of sessions when the user was active in the world
+        """
+        self.name = name
+        self.id = id
+        self.uid = uid
+        self.world = world
+        self.sessions = sessions or []
+
+        # The ip address the player will use when logged into the world
+        self.vpn_ip = ""
+
+    retrieve_sessions = Player.retrieve_sessions
+    retrieve_coplayers_session = Player.retrieve_coplayers_session
+    retrieve_ip = Player.retrieve_ip
+    __repr__ = Player.__repr__
+    __str__ = Player.__str__
+    __hash__ = Player.__hash__
+
+
 def complete_half_session(events: List, start: str, end: str) -> List:
     """Complete missing session events based on the given boundaries.
     For instance, if the first event is a session-end event, then
@@ -415,84 +577,122 @@ def complete_half_session(events: List, start: str, end: str) -> List:
     return events
 
 
-def order_events_to_sessions(events: List) -> List[PlayerSession]:
-    """Convert session events to a list of sessions.
-    :param events: a list of session creation/termination retrieved events
-    :return: a list of player session objects
+def timestamp_to_epoch(timestamp: Any) -> float:
+    """Convert an event timestamp to an epoch, naive timestamps being UTC.
+    :param timestamp: an ISO 8601 string, a datetime or a MayaDT
+    :return: the epoch of the timestamp, in seconds
+    """
+    if isinstance(timestamp, MayaDT):
+        return timestamp.epoch
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+def build_sessions(
+    player_ids: Any,
+    epochs: Any,
+    event_types: Any,
+    max_gap: float = 300,
+) -> Dict[Any, List[PlayerSession]]:
+    """Convert the session events of several players to their sessions.
+    Events are sorted once, disconnections first at equal times. Each player's
+    sessions go from the first connection of a run of connections to the
+    last disconnection of the following run of disconnections, ignoring the
+    disconnections before the first connection and a last connection without
+    disconnection. Sessions at most `max_gap` seconds apart are merged.
+    :param player_ids: the player of each event
+    :param epochs: the time of each event, in seconds
+    :param event_types: the openvpn event of each event
+    :param max_gap: the longest gap (in seconds) between merged sessions
+    :return: the sessions of each player with at least one session
     """
-    sessions: List[str] = []
+    if not len(epochs):
+        return {}
 
-    for event in events:
-        event["@timestamp"] = maya_parse(event["@timestamp"])
+    player_ids = np.asarray(player_ids)
+    epochs = np.asarray(epochs, dtype=np.float64)
+    connected = np.asarray(event_types, dtype=str) == CLIENT_CONNECTED
 
-    # TODO is this first sort needed?
-    events.sort(key=lambda e: e.openvpn.event, reverse=True)
-    events.sort(key=lambda e: e["@timestamp"])
+    order = np.lexsort((connected, epochs, player_ids))
+    player_ids, epochs, connected = player_ids[order], epochs[order], connected[order]
+
+    n = len(order)
+    first = np.ones(n, dtype=bool)
+    first[1:] = player_ids[1:] != player_ids[:-1]
+
+    # Number of connections of the player up to each event
+    nb_connected = np.cumsum(connected)
+    group_start = np.maximum.accumulate(np.where(first, np.arange(n), 0))
+    nb_connected -= nb_connected[group_start] - connected[group_start]
+
+    keep = nb_connected > 0
+    player_ids, epochs, connected = player_ids[keep], epochs[keep], connected[keep]
+
+    n = len(epochs)
+    first = np.ones(n, dtype=bool)
+    first[1:] = player_ids[1:] != player_ids[:-1]
+    last = np.ones(n, dtype=bool)
+    last[:-1] = first[1:]
+
+    previous_connected = np.zeros(n, dtype=bool)
+    previous_connected[1:] = connected[:-1] & ~first[1:]
+    next_connected = np.ones(n, dtype=bool)
+    next_connected[:-1] = connected[1:]
+
+    # First connection and last disconnection of each run
+    keep = np.where(connected, ~previous_connected, last | next_connected)
+    player_ids, epochs, connected = player_ids[keep], epochs[keep], connected[keep]
+
+    # A player's last connection, now alone in its run, has no disconnection
+    last = np.ones(len(epochs), dtype=bool)
+    last[:-1] = player_ids[1:] != player_ids[:-1]
+
+    keep = ~(connected & last)
+    player_ids, epochs, connected = player_ids[keep], epochs[keep], connected[keep]
+
+    # Connections and disconnections now alternate for each player
+    starts = epochs[connected]
+    ends = epochs[~connected]
+    session_players = player_ids[connected]
 
-    i = 0
-    # not doing a `for` because I want to manipulate the loop variable
-    while i < len(events):
-        current_event = events[i]
-
-        if not sessions and current_event.openvpn.event == "client-disconnected":
-            # This will make sure we start counting sessions from a connection.
-            i += 1
-            continue
-
-        try:
-            next_event = events[i + 1]
-
-            if next_event.openvpn.event == current_event.openvpn.event:
-                if current_event.openvpn.event == "client-disconnected":
-                    # Current event is a disconnect and the logs missed the next
-                    # connected event.
-                    continue
-
-            previous_event = events[i - 1]
-
-            if previous_event.openvpn.event == current_event.openvpn.event:
-                if previous_event.openvpn.event == "client-connected":
-                    # Current event is a connection but the logs missed the
-                    # previous disconnect.
-                    continue
-        except IndexError:
-            pass
-        finally:
-            i += 1
-
-        sessions.append(current_event["@timestamp"])
-
-    if len(sessions) % 2 != 0:
-        # A client connection event exists without a disconnect event.
-        sessions.pop(-1)
-
-    compact_sessions: List[str] = []
-    for i, t in enumerate(sessions):
-        if i % 2 != 0:
-            continue
-
-        try:
-            session_start = sessions[i]
-            previous_end = sessions[i - 1]
-
-            # If two sessions are 5 minutes apart consider them one.
-            time_diff = maya_parse(session_start) - maya_parse(previous_end)
-
-            if time_diff.seconds <= 300:
-                compact_sessions.pop()
-                compact_sessions.append(sessions[i + 1])
-            else:
-                compact_sessions.append(sessions[i])
-                compact_sessions.append(sessions[i + 1])
-        except IndexError:
-            continue
-    return [
-        PlayerSession(
-            maya_parse(compact_sessions[i]), maya_parse(compact_sessions[i + 1])
+    if not len(starts):
+        return {}
+
+    merged = np.zeros(len(starts), dtype=bool)
+    merged[1:] = (session_players[1:] == session_players[:-1]) & (
+        starts[1:] - ends[:-1] <= max_gap
+    )
+
+    firsts = np.flatnonzero(~merged)
+    lasts = np.append(firsts[1:] - 1, len(starts) - 1)
+
+    sessions: Dict[Any, List[PlayerSession]] = {}
+
+    for player_id, start, end in zip(
+        session_players[firsts].tolist(), starts[firsts].tolist(), ends[lasts].tolist()
+    ):
+        sessions.setdefault(player_id, []).append(
+            PlayerSession(MayaDT(start), MayaDT(end))
         )
-        for i in range(0, len(compact_sessions), 2)
-    ]
 
+    return sessions
+
+
+def order_events_to_sessions(events: List) -> List[PlayerSession]:
+    """Convert session events to a list of sessions.
+    :param events: a list of session creation/termination retrieved events
+    :return: a list of player session objects
+    """
+    sessions = build_sessions(
+        np.zeros(len(events), dtype=np.int8),
+        [timestamp_to_epoch(event["@timestamp"]) for event in events],
+        [event.openvpn.event for event in events],
+    )
+
+    return sessions.get(0, [])
 
 
 def limit_player_sessions(
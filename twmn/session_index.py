@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+"""Contains an interval index over the sessions of the players in the roster.
+It is a centered interval tree: each node holds the sessions containing its
+center, sorted by start and by end, so that stabbing, overlap and window
+queries only visit a path of the tree and the sessions they return."""
+
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from typing import Any, Iterable, List, Tuple
+
+from maya import MayaDT
+
+from twmn.player import CoplayerSessions, EpochPlayerSession, Player, PlayerSession
+
+Interval = Tuple[float, float, Any]
+
+
+def to_epoch(t: Any) -> float:
+    """Convert a time to an epoch.
+    :param t: a MayaDT or an epoch
+    :return: the epoch, in seconds
+    """
+    return t.epoch if isinstance(t, MayaDT) else float(t)
+
+
+def session_bounds(session: Any) -> Tuple[float, float]:
+    """Get the start and end epochs of a session, without creating MayaDT
+    objects for an EpochPlayerSession.
+    :param session: a PlayerSession or an EpochPlayerSession
+    :return: the start and end epochs
+    """
+    if isinstance(session, EpochPlayerSession):
+        return session.start_epoch, session.end_epoch
+    return session.start.epoch, session.end.epoch
+
+
+class _Node:
+    """Node of the interval tree."""
+
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+    def __init__(self, intervals: List[Tuple[float, float, int]]) -> None:
+        """Build the subtree of the intervals, given with their position.
+        :param intervals: a non empty list of (start, end, position)
+        """
+        endpoints = sorted([i[0] for i in intervals] + [i[1] for i in intervals])
+        self.center = endpoints[len(endpoints) // 2]
+
+        here, left, right = [], [], []
+        for interval in intervals:
+            if interval[1] < self.center:
+                left.append(interval)
+            elif interval[0] > self.center:
+                right.append(interval)
+            else:
+                here.append(interval)
+
+        self.by_start = sorted(here)
+        self.by_end = sorted(here, key=lambda i: i[1], reverse=True)
+        self.left = _Node(left) if left else None
+        self.right = _Node(right) if right else None
+
+
+class SessionIndex:
+    """Interval index over sessions, as half-open [start, end) intervals.
+    Stabbing and overlap queries take O(log n + k) for k returned sessions,
+    and all queries return them in the order of their start."""
+
+    def __init__(self, intervals: Iterable[Interval]) -> None:
+        """Build the index.
+        :param intervals: the (start, end, item) of each interval, as epochs
+        """
+        self.intervals = sorted(intervals, key=lambda i: (i[0], i[1]))
+        self.starts = [i[0] for i in self.intervals]
+        self.root = (
+            _Node([(s, e, p) for p, (s, e, _) in enumerate(self.intervals)])
+            if self.intervals
+            else None
+        )
+
+    @classmethod
+    def from_players(cls, players: Iterable[Player]) -> SessionIndex:
+        """Build the index of the sessions of several players.
+        :param players: the players, usually the roster
+        :return: an index whose items are (player, session) pairs
+        """
+        return cls(
+            (*session_bounds(session), (player, session))
+            for player in players
+            for session in player.sessions
+        )
+
+    def __len__(self) -> int:
+        return len(self.intervals)
+
+    def _items(self, positions: List[int]) -> List[Any]:
+        positions.sort()
+        return [self.intervals[p][2] for p in positions]
+
+    def _stab(self, t: float) -> List[int]:
+        positions = []
+        node = self.root
+
+        while node is not None:
+            if t < node.center:
+                for start, _, p in node.by_start:
+                    if start > t:
+                        break
+                    positions.append(p)
+                node = node.left
+            else:
+                for _, end, p in node.by_end:
+                    if end <= t:
+                        break
+                    positions.append(p)
+                node = node.right
+
+        return positions
+
+    def _overlap(self, start: float, end: float) -> List[int]:
+        positions = []
+        nodes = [self.root] if self.root is not None and start < end else []
+
+        while nodes:
+            node = nodes.pop()
+
+            if end <= node.center:
+                for s, _, p in node.by_start:
+                    if s >= end:
+                        break
+                    positions.append(p)
+                if node.left is not None:
+                    nodes.append(node.left)
+            elif start >= node.center:
+                for _, e, p in node.by_end:
+                    if e <= start:
+                        break
+                    positions.append(p)
+                if node.right is not None:
+                    nodes.append(node.right)
+            else:
+                positions.extend(p for _, _, p in node.by_start)
+                if node.left is not None:
+                    nodes.append(node.left)
+                if node.right is not None:
+                    nodes.append(node.right)
+
+        return positions
+
+    def stab(self, t: Any) -> List[Any]:
+        """Find the sessions running at a time.
+        :param t: a MayaDT or an epoch
+        :return: the items of the sessions with start <= t < end
+        """
+        return self._items(self._stab(to_epoch(t)))
+
+    def overlapping(self, start: Any, end: Any) -> List[Any]:
+        """Find the sessions overlapping a window.
+        :param start: the start of the window
+        :param end: the end of the window
+        :return: the items of the sessions running at some time of the window
+        """
+        return self._items(self._overlap(to_epoch(start), to_epoch(end)))
+
+    def contained(self, start: Any, end: Any) -> List[Any]:
+        """Find the sessions strictly inside a window, like
+        twmn.player.limit_player_sessions. The sessions starting in the
+        window are found by binary search on the sorted starts, so that this
+        takes O(log n + k + m), m being the number of sessions still running
+        at the end of the window.
+        :param start: the start of the window
+        :param end: the end of the window
+        :return: the items of the sessions with start < session start and
+        session end < end
+        """
+        start, end = to_epoch(start), to_epoch(end)
+        return [
+            self.intervals[p][2]
+            for p in range(bisect_right(self.starts, start), bisect_left(self.starts, end))
+            if self.intervals[p][1] < end
+        ]
+
+    def join(self, intervals: Iterable[Interval]) -> List[Tuple[Any, Any]]:
+        """Join other intervals with the sessions they overlap.
+        :param intervals: the (start, end, item) of each interval
+        :return: the pairs of overlapping items, the other interval first
+        """
+        return [
+            (item, match)
+            for start, end, item in intervals
+            for match in self.overlapping(start, end)
+        ]
+
+    def coplayer_sessions(
+        self, player: Player, session: PlayerSession
+    ) -> List[CoplayerSessions]:
+        """Find the sessions of the other players during a session, cut to its
+        boundaries like twmn.player.complete_half_session does.
+        :param player: the player of the session
+        :param session: the session
+        :return: the coplayers, with their sessions, in the order of their
+        first session
+        """
+        coplayers: dict = {}
+
+        start, end = session_bounds(session)
+
+        for coplayer, coplayer_session in self.overlapping(start, end):
+            if coplayer is player:
+                continue
+
+            if isinstance(coplayer_session, EpochPlayerSession):
+                cut = EpochPlayerSession(
+                    max(coplayer_session.start_epoch, start),
+                    min(coplayer_session.end_epoch, end),
+                )
+            else:
+                cut = PlayerSession(
+                    max(coplayer_session.start, session.start),
+                    min(coplayer_session.end, session.end),
+                )
+
+            coplayers.setdefault(coplayer, []).append(cut)
+
+        return [CoplayerSessions(c, sessions) for c, sessions in coplayers.items()]
+